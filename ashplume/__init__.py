@@ -0,0 +1,6 @@
+"""
+Helper package of the volcanic ash plume model (eruptionModel_version2.17_FINAL_py2.7.py).
+
+The modules in this package contain the parts of the model which are used by the main script but
+do not require any user interaction. They can therefore also be imported by other scripts.
+"""
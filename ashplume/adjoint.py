@@ -0,0 +1,121 @@
+import numpy as np
+
+from ashplume.transport import getTransportFields
+from ashplume.operators import SparseTransportOperator
+
+
+"""
+_____________________________________Source-Receptor Sensitivity__________________________________________
+
+Adjoint (backward) run of the model for point receptors.
+
+For fixed wind fields the model is linear in the emission: the concentration of a receptor at the target timestep
+is a weighted sum of all emissions
+    c = sum over timesteps t, size bins and sources of emission[t] * sensitivity[t]
+Instead of one forward run per emission timestep, the sensitivities of all timesteps are calculated in one backward
+run with the transposed operators (see operators.py):
+    - the adjoint field starts at the target timestep with the bilinear receptor weights (in every size bin,
+      since the frames sum up the bins)
+    - going back in time, every wind timestep applies the transposed transport-diffusion operator of its wind field
+      (A^k)^T for its k sub-steps and then the fall-out of the timestep
+    - the adjoint field at a timestep is the sensitivity of the receptor to a unit emission in every cell at that
+      timestep, it is read at the cells of the sources
+All receptors are processed together as leading dimension of the adjoint field.
+
+Any emission time series of the sources can afterwards be combined with the sensitivities by a dot product
+(see getConcentration and getRateSensitivity), e.g. for source inversion or emission scenarios.
+
+The adjoint run requires the sparse transport operator (scipy, diffusion type 1 or no diffusion). The 3D mode is not
+supported (settling and the maximum of the layers in the frames).
+"""
+
+
+# Function returns the adjoint field of the receptors (receptors, [bins,] rows, cols) at the target timestep
+# receptors: built ReceptorSet (see receptors.py)
+def getReceptorSeed(receptors, particle_shape):
+    if receptors.indices is None:
+        raise AttributeError("Receptors have to be built before the adjoint run!")
+    count = len(receptors.names)
+    seed = np.zeros((count, int(np.prod(particle_shape[-2:]))))
+    np.add.at(seed, (np.arange(count)[:, np.newaxis], receptors.indices), receptors.weights)
+    seed = seed.reshape((count, 1) + tuple(particle_shape[-2:]))
+    # the frames sum up the size bins, thus every bin has the same receptor weights
+    return np.repeat(seed, int(np.prod(particle_shape[:-2])), axis=1).reshape((count,) + tuple(particle_shape))
+
+
+class SourceSensitivity(object):
+
+    # receptors: built ReceptorSet, sources: built SourceTable (see sources.py)
+    # particle_shape: shape of the particle raster ([bins,] rows, cols)
+    # fall_out: fall-out (1 - percent) of the timesteps, scalar or array of the bins (bins, 1, 1)
+    def __init__(self, receptors, sources, particle_shape, fall_out):
+        if sources.emission is None:
+            raise AttributeError("Sources have to be built before the adjoint run!")
+        self.receptors = receptors
+        self.sources = sources
+        self.particle_shape = tuple(particle_shape)
+        self.fall_out = fall_out
+        # (time x receptor x [bin x] source) sensitivities and the summed sensitivity field of every receptor
+        self.sensitivity = None
+        self.footprint = None
+        self.target = None
+
+    # Function runs the adjoint model from the target timestep back to the first timestep
+    # wind: wind provider (see wind.py), timesteps: wind timesteps of the model run
+    # target: number of sub-steps since the start of the model run (0 for the state before the first transport)
+    # geometry: CellGeometry of the grid (see grid.py), None for square cells
+    def run(self, wind, timesteps, target, hourly_res, resolution, diffusion_percent, diffusion_type,
+            boundary=("periodic", "reflective"), geometry=None):
+        if target < 0 or target > len(timesteps) * hourly_res:
+            raise ValueError("Invalid target timestep of the adjoint run: {}".format(target))
+        # wind timestep of the target
+        last = max(target - 1, 0) // hourly_res
+
+        adjoint = getReceptorSeed(self.receptors, self.particle_shape)
+        self.sensitivity = np.zeros((len(self.sources.emission), len(self.receptors.names)) +
+                                    self.sources.emission.shape[1:])
+        self.footprint = np.zeros_like(adjoint)
+        self.target = target
+
+        for t in range(last, -1, -1):
+            sub_steps = hourly_res if t < last else target - last * hourly_res
+            if sub_steps > 0:
+                u, v = wind.getWind(timesteps[t])
+                cells, transport_perc = getTransportFields(u, v, resolution, geometry)
+                operator = SparseTransportOperator(cells, transport_perc, diffusion_percent, diffusion_type,
+                                                   boundary)
+                adjoint = operator.applyTranspose(adjoint, sub_steps)
+            # the fall-out is processed after the injection and before the transport
+            adjoint = adjoint * self.fall_out
+            np.add(self.footprint, adjoint, out=self.footprint)
+            if t < len(self.sensitivity):
+                for r in range(len(adjoint)):
+                    self.sensitivity[t, r] = adjoint[r][self.sources.index]
+        return self.sensitivity
+
+    # Function returns the concentration of every receptor at the target timestep for an emission matrix
+    # (time x [bin x] source) as the dot product with the sensitivities
+    def getConcentration(self, emission):
+        emission = np.asarray(emission, dtype=float)
+        steps = min(len(emission), len(self.sensitivity))
+        products = self.sensitivity[:steps] * emission[:steps, np.newaxis]
+        return products.reshape(steps, len(self.receptors.names), -1).sum(axis=(0, 2))
+
+    # Function returns the (time x receptor x source) sensitivity to the erupted concentration of the sources
+    # bin_fractions: grain-size distribution (None for a single bin)
+    def getRateSensitivity(self, bin_fractions=None):
+        if bin_fractions is None:
+            return self.sensitivity
+        fractions = np.asarray(bin_fractions, dtype=float).reshape(1, 1, -1, 1)
+        return (self.sensitivity * fractions).sum(axis=2)
+
+    # Function writes the (time x receptor x source) sensitivities to a CSV file
+    # one line per emission timestep, one column per receptor and source ("receptor:source")
+    def writeCSV(self, filename, bin_fractions=None):
+        table = self.getRateSensitivity(bin_fractions)
+        columns = ["{}:{}".format(receptor, source) for receptor in self.receptors.names
+                   for source in self.sources.names]
+        with open(filename, "w") as out_file:
+            out_file.write(",".join(["timestep"] + columns) + "\n")
+            for t, row in enumerate(table.reshape(len(table), -1)):
+                out_file.write(",".join([str(t)] + [repr(float(value)) for value in row]) + "\n")
@@ -0,0 +1,130 @@
+import json
+import numpy as np
+
+
+"""
+_____________________________________Mass Balance__________________________________________
+
+Surveillance of the mass balance of the model:
+    erupted mass = airborne mass + fall-out + boundary loss
+
+The MassBalanceMonitor records the mass balance of every sub-step in a ring buffer (the last "capacity" steps).
+The totals are running totals of the values which are computed anyway during the model run (injected mass, fall-out
+and boundary loss of the kernel), the airborne mass is a running value as well:
+    airborne = previous airborne + injected - fall-out - boundary loss
+thus the records need no additional pass over the particle raster.
+
+The airborne mass is only measured (one sum of the particle raster) at the check steps: after every sub-step in the
+strict mode, every "interval" sub-steps otherwise (0 for no checks). The drift is the deviation of the measured
+airborne mass from the running value (0 at all other steps). In the strict mode a MassBalanceError is raised as soon
+as the relative drift exceeds the tolerance (fail fast). All totals are summed up in float64.
+"""
+
+# Columns of the mass balance records
+BALANCE_FIELDS = ("step", "injected", "fallout", "boundary_loss", "airborne",
+                  "total_injected", "total_fallout", "total_boundary_loss", "drift")
+
+
+class MassBalanceError(Exception):
+    pass
+
+
+# Function returns the total of an array summed up in float64
+def getTotal(values):
+    return float(np.sum(values, dtype=np.float64))
+
+
+# Function raises a MassBalanceError if the erupted mass is not equal to the sum of airborne mass, fall-out and
+# boundary loss (relative tolerance with respect to the erupted mass)
+def checkMassBalance(erupted, airborne, fallout, boundary_loss, step, tolerance=1e-9):
+    deviation = erupted - (airborne + fallout + boundary_loss)
+    if abs(deviation) > tolerance * max(abs(erupted), 1.0):
+        raise MassBalanceError("Mass balance violated at timestep {}: erupted {}, airborne {}, fall-out {}, "
+                               "boundary loss {} (deviation {})".format(step, erupted, airborne, fallout,
+                                                                        boundary_loss, deviation))
+    return deviation
+
+
+class MassBalanceMonitor(object):
+
+    # capacity: number of sub-steps which are kept in the ring buffer
+    # strict: if True a MassBalanceError is raised as soon as the drift exceeds the tolerance (fail fast)
+    # tolerance: relative tolerance of the strict check
+    # interval: number of sub-steps between the checks of the measured airborne mass outside the strict mode (0: none)
+    def __init__(self, capacity=1000, strict=False, tolerance=1e-9, interval=0):
+        self.buffer = np.zeros((capacity, len(BALANCE_FIELDS)))
+        self.strict = strict
+        self.tolerance = tolerance
+        self.interval = interval
+        self.count = 0
+        self.total_injected = 0.0
+        self.total_fallout = 0.0
+        self.total_boundary_loss = 0.0
+
+    # Function returns the airborne mass according to the running totals
+    def getAirborne(self):
+        return self.total_injected - self.total_fallout - self.total_boundary_loss
+
+    # Function returns True if the airborne mass has to be measured after the next sub-step
+    def isCheckStep(self):
+        return self.strict or (self.interval > 0 and (self.count + 1) % self.interval == 0)
+
+    # Function adds the mass balance of one sub-step to the running totals and to the ring buffer
+    # measured: measured airborne mass after the sub-step (see getTotal and isCheckStep), None at other steps
+    def record(self, step, injected, fallout, boundary_loss, measured=None):
+        self.total_injected += injected
+        self.total_fallout += fallout
+        self.total_boundary_loss += boundary_loss
+        airborne = self.getAirborne()
+
+        drift = 0.0
+        if measured is not None:
+            if self.strict:
+                drift = checkMassBalance(self.total_injected, measured, self.total_fallout, self.total_boundary_loss,
+                                         step, self.tolerance)
+            else:
+                drift = airborne - measured
+
+        self.buffer[self.count % len(self.buffer)] = (step, injected, fallout, boundary_loss, airborne,
+                                                      self.total_injected, self.total_fallout,
+                                                      self.total_boundary_loss, drift)
+        self.count += 1
+
+    # Function restores the records (oldest record first) and the running totals, e.g. from a cached model run
+    def loadRecords(self, records):
+        records = np.asarray(records, dtype=float).reshape(-1, len(BALANCE_FIELDS))[-len(self.buffer):]
+        self.buffer[:len(records)] = records
+        self.count = len(records)
+        if len(records) > 0:
+            self.total_injected, self.total_fallout, self.total_boundary_loss = [float(value)
+                                                                                 for value in records[-1, 5:8]]
+
+    # Function returns the records of the ring buffer (oldest record first)
+    def getRecords(self):
+        if self.count <= len(self.buffer):
+            return self.buffer[:self.count]
+        return np.roll(self.buffer, -(self.count % len(self.buffer)), axis=0)
+
+    # Function writes the records to a CSV file
+    def writeCSV(self, filename):
+        with open(filename, "w") as out_file:
+            out_file.write(",".join(BALANCE_FIELDS) + "\n")
+            for row in self.getRecords():
+                out_file.write(",".join([str(int(row[0]))] + [repr(float(value)) for value in row[1:]]) + "\n")
+
+    # Function writes the records to a JSON file (one object per record)
+    def writeJSON(self, filename):
+        records = []
+        for row in self.getRecords():
+            record = dict(zip(BALANCE_FIELDS, [float(value) for value in row]))
+            record["step"] = int(row[0])
+            records.append(record)
+        with open(filename, "w") as out_file:
+            json.dump(records, out_file, indent=1)
+
+    # Function writes the records to a CSV or JSON file (according to the file extension)
+    def write(self, filename):
+        if filename.lower().endswith(".json"):
+            self.writeJSON(filename)
+        else:
+            self.writeCSV(filename)
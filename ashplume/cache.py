@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+"""
+_____________________________________Result Cache__________________________________________
+
+Content-addressed cache of model results on the local disk.
+
+The key of a model run is the sha256 hash of all its inputs (settings, source terms and the sha256 hash of the
+content of the wind files) serialised as sorted JSON, thus identical configurations always get the same key,
+independent of the file names or the order of the settings. The hashes of the wind files are remembered in the
+cache directory (files.json) together with the size and the modification time of the files, such that large wind
+files are only read again if they have changed.
+
+Every result is one compressed NumPy file (<key>.npz) with arrays of any name (e.g. final state, frames and mass
+balance). A hit marks the result as recently used (modification time). After every new result the least recently
+used results are removed until the cache fits into the maximum size (the newest result is always kept).
+"""
+
+
+# Function returns the sha256 hash of the content of a file (read in blocks)
+def getFileHash(filename, block_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as in_file:
+        block = in_file.read(block_size)
+        while block:
+            digest.update(block)
+            block = in_file.read(block_size)
+    return digest.hexdigest()
+
+
+# Function converts NumPy arrays and scalars for the JSON serialisation
+def getJSONValue(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Input of type {} cannot be hashed!".format(type(value).__name__))
+
+
+# Function returns the key (sha256 hash) of the inputs (dictionary)
+def getCacheKey(inputs):
+    text = json.dumps(inputs, sort_keys=True, default=getJSONValue)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResultCache(object):
+
+    # directory: cache directory (created if required), max_size: maximum size of all results (MB)
+    def __init__(self, directory, max_size=1024):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size * 1024.0 ** 2
+
+    # Function returns the sha256 hash of a file, the hash is only calculated again if the file has changed
+    def getFileHash(self, filename):
+        memo_file = os.path.join(self.directory, "files.json")
+        memo = {}
+        if os.path.exists(memo_file):
+            with open(memo_file, "r") as in_file:
+                memo = json.load(in_file)
+
+        path = os.path.abspath(filename)
+        status = os.stat(path)
+        entry = memo.get(path)
+        if entry is not None and entry["size"] == status.st_size and entry["mtime"] == status.st_mtime:
+            return entry["sha256"]
+
+        memo[path] = {"size": status.st_size, "mtime": status.st_mtime, "sha256": getFileHash(path)}
+        with open(memo_file, "w") as out_file:
+            json.dump(memo, out_file, indent=1, sort_keys=True)
+        return memo[path]["sha256"]
+
+    # Function returns the filename of a result
+    def getFilename(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    # Function returns the cached result (dictionary of arrays) or None, a hit marks the result as recently used
+    def get(self, key):
+        filename = self.getFilename(key)
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as cached:
+            result = dict((name, cached[name]) for name in cached.files)
+        os.utime(filename, None)
+        return result
+
+    # Function stores a result (arrays as keyword arguments) and removes the least recently used results
+    def put(self, key, **result):
+        filename = self.getFilename(key)
+        # the result is written to a temporary file first, thus an interrupted run leaves no broken result
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as out_file:
+            np.savez_compressed(out_file, **result)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp_filename, filename)
+        self.evict()
+
+    # Function removes the least recently used results until the cache fits into the maximum size
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                filename = os.path.join(self.directory, name)
+                entries.append((os.path.getmtime(filename), os.path.getsize(filename), filename))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        while total > self.max_size and len(entries) > 1:
+            modified, size, filename = entries.pop(0)
+            os.remove(filename)
+            total -= size
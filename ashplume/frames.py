@@ -0,0 +1,171 @@
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+try:
+    from shutil import which
+except ImportError:
+    # Python 2
+    from distutils.spawn import find_executable as which
+
+
+"""
+_____________________________________Frame Writers__________________________________________
+
+Writers for the image frames of a model run.
+
+The AsyncFrameWriter saves the frames in a background thread: the model only puts a copy of the particle raster into
+a queue and continues with the next timestep while the image is written. The queue is bounded (maxsize), thus the
+model waits if the images are written slower than the frames are produced and the memory use stays limited.
+
+The AnimationWriter assembles an animation directly from the rendered figures: the RGB buffer of the figure canvas
+is encoded frame by frame, no images are written and read again and only the current frame is kept in memory.
+    "gif" - every frame is quantized to 256 colours (own colour table) and appended to the file (Pillow)
+    "mp4" - the raw RGB frames are piped to an ffmpeg process (H.264), which encodes while the next frame is rendered
+All frames of an animation must have the same size (same figure size and dpi).
+"""
+
+ANIMATION_FORMATS = ("gif", "mp4")
+
+
+# Function returns the path of the ffmpeg executable (None if ffmpeg is not installed)
+def getFFmpeg():
+    return which("ffmpeg")
+
+
+# Function returns the RGB buffer (height, width, 3) of a figure as rendered by its canvas (Agg)
+def getFigureRGB(fig):
+    fig.canvas.draw()
+    renderer = fig.canvas.get_renderer()
+    height = int(renderer.height)
+    width = int(renderer.width)
+    return np.frombuffer(fig.canvas.buffer_rgba(), dtype=np.uint8).reshape(height, width, 4)[..., :3]
+
+
+class AsyncFrameWriter(object):
+
+    # filename: filename pattern with one {} for the frame number (e.g. "Ash_Plumes/Ash_Plume{}")
+    # maxsize: maximum number of frames waiting in the queue, cmap: colormap of the images (None for the default)
+    # image_format: format of the images (required if the filename has no extension)
+    def __init__(self, filename, maxsize=8, cmap=None, image_format="png"):
+        from matplotlib import image
+
+        self.imsave = image.imsave
+        self.filename = filename
+        self.cmap = cmap
+        self.image_format = image_format
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.errors = []
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Function writes the frames of the queue until the end of the queue (None) is reached
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            frame, number = item
+            try:
+                self.imsave(self.filename.format(number), frame, cmap=self.cmap, format=self.image_format)
+            except Exception as error:
+                self.errors.append(error)
+
+    # Function adds a copy of the frame to the queue (returns immediately if the queue is not full)
+    def write(self, frame, number):
+        self.frames.put((frame.copy(), number))
+
+    # Function waits until all frames are written, raises the first error of the writer thread
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+class AnimationWriter(object):
+
+    # filename: animation file, the format is given by the extension (".gif" or ".mp4")
+    # fps: frames per second
+    def __init__(self, filename, fps=4):
+        self.format = filename.rsplit(".", 1)[-1].lower()
+        if self.format not in ANIMATION_FORMATS:
+            raise ValueError("Invalid animation format: {} (choose from {})".format(filename, ANIMATION_FORMATS))
+        if self.format == "mp4" and getFFmpeg() is None:
+            raise ValueError("MP4 animations require ffmpeg (not found)!")
+        self.filename = filename
+        self.fps = fps
+        self.size = None
+        self.frames = 0
+        # output file (gif) or encoder process (mp4), opened with the first frame (size of the frames)
+        self.out_file = None
+        self.process = None
+        # error messages of the encoder process (a file, thus a full pipe can never block the encoder)
+        self.error_file = None
+
+    # Function opens the output for frames of the size (height, width)
+    def open(self, size):
+        self.size = size
+        if self.format == "mp4":
+            # odd sizes are padded, H.264 (yuv420p) requires even sizes
+            command = [getFFmpeg(), "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                       "-s", "{}x{}".format(size[1], size[0]), "-r", str(self.fps), "-i", "-",
+                       "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-vcodec", "libx264", "-pix_fmt", "yuv420p",
+                       self.filename]
+            self.error_file = tempfile.TemporaryFile()
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.error_file)
+        else:
+            self.out_file = open(self.filename, "wb")
+
+    # Function appends a frame (RGB array (height, width, 3) or matplotlib figure)
+    def write(self, frame):
+        if hasattr(frame, "canvas"):
+            frame = getFigureRGB(frame)
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if self.size is None:
+            self.open(frame.shape[:2])
+        elif frame.shape[:2] != self.size:
+            raise ValueError("All frames of an animation need the same size ({} instead of {})!".format(
+                frame.shape[:2], self.size))
+
+        if self.process is not None:
+            self.process.stdin.write(frame.tobytes())
+        else:
+            from PIL import Image, GifImagePlugin
+
+            image = Image.fromarray(frame).quantize(256)
+            duration = int(round(1000.0 / self.fps))
+            if self.frames == 0:
+                # header with the colour table of the first frame and infinite looping
+                header = GifImagePlugin.getheader(image, info={"loop": 0, "duration": duration})[0]
+                self.out_file.write(b"".join(header))
+            for data in GifImagePlugin.getdata(image, duration=duration, include_color_table=True):
+                self.out_file.write(data)
+        self.frames += 1
+
+    # Function finishes the animation, raises an IOError if the encoder failed
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            returncode = self.process.wait()
+            self.error_file.seek(0)
+            errors = self.error_file.read()
+            self.error_file.close()
+            self.process = None
+            self.error_file = None
+            if returncode != 0:
+                raise IOError("ffmpeg failed to write {}: {}".format(self.filename, errors.decode("utf-8", "replace")))
+        if self.out_file is not None:
+            # GIF trailer
+            self.out_file.write(b";")
+            self.out_file.close()
+            self.out_file = None
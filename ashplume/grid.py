@@ -0,0 +1,227 @@
+import numpy as np
+
+
+"""
+_____________________________________Grid Geometry__________________________________________
+
+The grid geometry is created once per model run from the latitude and longitude arrays of the wind fields
+(or the artificial test grid) and is shared by every location lookup of the model
+(volcano position, zoom plot extent, point receptors, ...).
+
+Conventions of the model grid:
+    - latitudes are increasing (row i + 1 lies north of row i)
+    - longitudes are increasing and lie within -180 to 180 (column j + 1 lies east of column j)
+
+Wind datasets often use other conventions (e.g. ERA-Interim: latitudes from 90 to -90 and longitudes from 0 to 360).
+The grid therefore stores the orientation of the input data and converts every input field with toModelField.
+
+Coordinates are mapped to grid indices with np.searchsorted (binary search), thus a lookup costs O(log n)
+instead of a full scan of the coordinate arrays.
+
+Regional (limited-area) domains:
+    The RegionalGrid contains only the cells of a grid within a bounding box. Input fields are read as hyperslab of
+    the bounding box (readField), such that only the data of the region is read from the NetCDF files. In the
+    orientation of the input data the columns of the region can wrap around (e.g. -40 to 40 degrees in a 0 to 360
+    file), in this case the region is read as two hyperslabs. Regions must not cross the date line of the model grid.
+
+Cell geometry:
+    The cells of a regular latitude-longitude grid shrink towards the poles: the east-west size of a cell is
+    proportional to the cosine of its latitude (e.g. about half of the equatorial size at 63.6 N). The CellGeometry
+    contains the distances of the cells of every row (dx, dy and diagonal), the model resolution is the
+    north-south size of the cells (dy). The east-west size is the area weighted mean over the latitudes of the cell,
+    thus the cells at the poles keep a finite size. The areas of the cells are not used (the model moves
+    concentrations).
+"""
+
+
+# Function converts longitudes to the range -180 to 180 (180 degrees becomes -180 degrees)
+def wrapLongitude(lon):
+    return (np.asarray(lon, dtype=float) + 180.0) % 360.0 - 180.0
+
+
+# Function checks if the coordinate values are strictly increasing (no duplicates)
+def isIncreasing(coordinate):
+    return len(coordinate) < 2 or bool(np.all(np.diff(coordinate) > 0))
+
+
+class GridGeometry(object):
+
+    def __init__(self, lat, lon):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+
+        # Orientation of the latitudes (e.g. ERA-Interim: 90 to -90)
+        self.lat_flipped = len(lat) > 1 and lat[0] > lat[-1]
+        if self.lat_flipped:
+            lat = lat[::-1]
+        if not isIncreasing(lat):
+            raise ValueError("Latitudes have to be strictly monotonic (no duplicates)!")
+
+        # Longitudes are wrapped to -180 to 180 and rolled such that they are increasing
+        # (e.g. 0 to 360 --> -180 to 180, replaces the former "lon - 180" correction)
+        wrapped = wrapLongitude(lon)
+        self.lon_shift = int(np.argmin(wrapped))
+        lon = np.roll(wrapped, -self.lon_shift)
+        if not isIncreasing(lon):
+            raise ValueError("Longitudes have to be strictly monotonic (no duplicates)!")
+
+        self.lat = lat
+        self.lon = lon
+        self.dim_lat = len(lat)
+        self.dim_lon = len(lon)
+
+        # Grid spacing (degrees)
+        self.dlat = float(np.mean(np.diff(lat))) if self.dim_lat > 1 else 0.0
+        self.dlon = float(np.mean(np.diff(lon))) if self.dim_lon > 1 else 0.0
+        # True if the longitudes span the whole globe (the last column is a neighbour of the first column)
+        self.global_lon = self.dim_lon > 1 and abs(self.dim_lon * self.dlon - 360.0) < 0.5 * self.dlon
+
+    # Function converts an input field (..., lat, lon) in the orientation of the input data to the model orientation
+    def toModelField(self, field):
+        field = np.asarray(field)
+        if self.lat_flipped:
+            field = field[..., ::-1, :]
+        if self.lon_shift != 0:
+            field = np.roll(field, -self.lon_shift, axis=-1)
+        return field
+
+    # Function reads a field (..., lat, lon) of a NetCDF variable and converts it to the model orientation
+    # index: indices of the leading dimensions (e.g. (time,) or (time, level))
+    def readField(self, variable, index=()):
+        return self.toModelField(variable[tuple(index)])
+
+    # Function returns True for every location within the extent of the grid
+    def contains(self, lat_values, lon_values):
+        lat_values = np.asarray(lat_values, dtype=float)
+        inside = (lat_values >= self.lat[0] - 0.5 * self.dlat) & (lat_values <= self.lat[-1] + 0.5 * self.dlat)
+        if self.global_lon:
+            return inside
+        lon_values = wrapLongitude(lon_values)
+        return inside & (lon_values >= self.lon[0] - 0.5 * self.dlon) & (lon_values <= self.lon[-1] + 0.5 * self.dlon)
+
+    # Function returns the index of the closest latitude for every value
+    def getLatIndex(self, lat_values):
+        return self._nearest(self.lat, np.asarray(lat_values, dtype=float), False)
+
+    # Function returns the index of the closest longitude for every value (-180 to 180 or 0 to 360)
+    def getLonIndex(self, lon_values):
+        return self._nearest(self.lon, wrapLongitude(lon_values), self.global_lon)
+
+    # Function returns the row and column index of the cell closest to the specified location(s)
+    # Returns integers for scalar coordinates and arrays otherwise
+    def getIndex(self, lat_values, lon_values):
+        i = self.getLatIndex(lat_values)
+        j = self.getLonIndex(lon_values)
+        if np.ndim(i) == 0 and np.ndim(j) == 0:
+            return int(i), int(j)
+        return i, j
+
+    # Function returns the fractional row and column position of the specified location(s)
+    # Values outside of the coordinate range are set to the first / last index, on global grids the longitudes
+    # between the last and the first longitude lie between the last index and dim_lon (used for bilinear interpolation)
+    def getFractionalIndex(self, lat_values, lon_values):
+        return (self._fractional(self.lat, np.asarray(lat_values, dtype=float)),
+                self._fractional(self.lon, wrapLongitude(lon_values), self.global_lon))
+
+    @staticmethod
+    def _nearest(coordinate, values, periodic):
+        n = len(coordinate)
+        upper = np.searchsorted(coordinate, values)
+        lower = upper - 1
+        if periodic:
+            # the neighbours of the first and the last longitude are found across the date line
+            upper = upper % n
+            lower = lower % n
+            dist_upper = abs(wrapLongitude(coordinate[upper] - values))
+            dist_lower = abs(wrapLongitude(coordinate[lower] - values))
+        else:
+            upper = np.minimum(upper, n - 1)
+            lower = np.maximum(lower, 0)
+            dist_upper = abs(coordinate[upper] - values)
+            dist_lower = abs(coordinate[lower] - values)
+        # the lower index is chosen if both distances are the same
+        return np.where(dist_lower <= dist_upper, lower, upper)
+
+    @staticmethod
+    def _fractional(coordinate, values, periodic=False):
+        n = len(coordinate)
+        if n < 2:
+            return np.zeros(np.shape(values))
+        if periodic:
+            # the first longitude is repeated after the last one (across the date line)
+            values = coordinate[0] + (values - coordinate[0]) % 360.0
+            coordinate = np.append(coordinate, coordinate[0] + 360.0)
+            n += 1
+        upper = np.clip(np.searchsorted(coordinate, values), 1, n - 1)
+        lower = upper - 1
+        position = lower + (values - coordinate[lower]) / (coordinate[upper] - coordinate[lower])
+        return np.clip(position, 0, n - 1)
+
+
+class RegionalGrid(GridGeometry):
+
+    # parent: GridGeometry of the input data
+    # lat_min, lat_max, lon_min, lon_max: bounding box of the region (degrees), all cells within the box are used
+    def __init__(self, parent, lat_min, lat_max, lon_min, lon_max):
+        if lon_max - lon_min >= 360:
+            raise ValueError("The region has to be smaller than the globe (use the global grid instead)!")
+        if wrapLongitude(lon_min) > wrapLongitude(lon_max):
+            raise ValueError("The region must not cross the date line (longitudes {} to {})!".format(lon_min, lon_max))
+        rows = np.nonzero((parent.lat >= lat_min) & (parent.lat <= lat_max))[0]
+        cols = np.nonzero((parent.lon >= wrapLongitude(lon_min)) & (parent.lon <= wrapLongitude(lon_max)))[0]
+        if len(rows) < 2 or len(cols) < 2:
+            raise ValueError("The region {} - {} N, {} - {} E contains less than 2 x 2 cells!".format(
+                lat_min, lat_max, lon_min, lon_max))
+        GridGeometry.__init__(self, parent.lat[rows], parent.lon[cols])
+
+        # rows and columns of the region in the model orientation of the parent grid
+        self.parent = parent
+        self.rows = slice(rows[0], rows[-1] + 1)
+        self.cols = slice(cols[0], cols[-1] + 1)
+
+        # hyperslab of the region in the orientation of the input data
+        if parent.lat_flipped:
+            self.file_rows = slice(parent.dim_lat - 1 - rows[-1], parent.dim_lat - rows[0])
+        else:
+            self.file_rows = self.rows
+        # columns of the input data in the model order, split into contiguous parts
+        file_cols = (cols + parent.lon_shift) % parent.dim_lon
+        parts = np.split(file_cols, np.nonzero(np.diff(file_cols) != 1)[0] + 1)
+        self.file_cols = [slice(part[0], part[-1] + 1) for part in parts]
+
+    # Function converts a field of the parent grid (..., lat, lon) in the orientation of the input data to the region
+    def toModelField(self, field):
+        return self.parent.toModelField(field)[..., self.rows, self.cols]
+
+    # Function reads the hyperslab of the region of a NetCDF variable (..., lat, lon) in the model orientation
+    def readField(self, variable, index=()):
+        field = np.concatenate([np.asarray(variable[tuple(index) + (self.file_rows, file_cols)])
+                                for file_cols in self.file_cols], axis=-1)
+        if self.parent.lat_flipped:
+            field = field[..., ::-1, :]
+        return field
+
+
+class CellGeometry(object):
+
+    # grid: GridGeometry of the model, resolution: spatial model resolution (km), north-south size of the cells
+    def __init__(self, grid, resolution):
+        dlat = grid.dlat if grid.dlat > 0 else grid.dlon
+        # mean cosine of the latitudes of every cell (edges clipped to the poles)
+        upper = np.radians(np.minimum(grid.lat + 0.5 * dlat, 90.0))
+        lower = np.radians(np.maximum(grid.lat - 0.5 * dlat, -90.0))
+        cosine = (np.sin(upper) - np.sin(lower)) / np.radians(dlat)
+
+        # size of the cells of every row (km) as (rows, 1) arrays, thus they broadcast with the fields
+        self.resolution = float(resolution)
+        self.dy = np.full((grid.dim_lat, 1), self.resolution)
+        self.dx = (self.resolution * grid.dlon / dlat * cosine).reshape(-1, 1)
+        self.diagonal = np.sqrt(self.dx ** 2 + self.dy ** 2)
+
+        # distance (km) to the neighbour cells 0 - 8 of every row (see transport.py, cell 0: no transport)
+        self.distances = np.hstack([self.dy, self.dy, self.diagonal, self.dx, self.diagonal, self.dy, self.diagonal,
+                                    self.dx, self.diagonal])
+
+    # Function returns the distance (km) of every cell to its transport receiving cell ([layers,] rows, cols)
+    def getDistance(self, cells):
+        return self.distances[np.arange(self.distances.shape[0])[:, np.newaxis], cells]
@@ -0,0 +1,126 @@
+import numpy as np
+
+from ashplume.transport import (CELL_OFFSETS, getHaloArray, addShifted, foldHalo, transportStep, diffusionStep)
+
+
+"""
+_____________________________________Kernel Registry__________________________________________
+
+Common interface of the transport rules of the main model and of the f2D_Wind prototypes:
+    kernel(direction, particles, **params) --> new particles
+direction is a raster of direction codes, particles is the particle raster (rows, cols).
+
+Direction encodings:
+    "cells"     - transport receiving cells of the main model (1 - 8, see transport.py), 0 for no transport
+    "prototype" - codes of the f2D_Wind prototypes, 0 - 7 clockwise from the top left neighbour:
+                      0 1 2
+                      7 . 3
+                      6 5 4
+                  (row index i - 1 is the "top" row), -1 for no transport
+
+Registered kernels (all vectorized):
+    "main"       - transport and diffusion of the main model (transportStep and diffusionStep)
+    "2D_Wind"    - f2D_Wind/2D_Wind.py: half of every cell is moved to the target cell, the rest is lost
+    "2D_Wind_M2" - f2D_Wind/2D_Wind_M2.py: (1 - diff_loss) of every cell is moved to the target cell, each of the 8
+                   neighbours of the target cell receives diff_loss (multiplied by the fall-out factor loss)
+                   The particles are first moved with one masked shift per direction code, the spreading around the
+                   target cells is then one 3x3 convolution of the moved field.
+
+Differences to the prototype loops: values with the same target are accumulated (the 2D_Wind loop overwrites them),
+and targets outside of the raster are handled by the boundary conditions of transport.py (the prototype loops wrap
+negative indices around and skip targets beyond the last row / column).
+
+With runKernel every kernel can be run on the same direction raster in either encoding, thus the rule sets can be
+compared side by side on identical inputs.
+"""
+
+# Row and column offsets of the prototype direction codes 0 - 7
+PROTOTYPE_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+# Lookup tables between the encodings (index 0 of the prototype table is used for code -1)
+CELL_TO_PROTOTYPE = np.array([-1] + [PROTOTYPE_OFFSETS.index(offset) for offset in CELL_OFFSETS])
+PROTOTYPE_TO_CELL = np.array([0] + [CELL_OFFSETS.index(offset) + 1 for offset in PROTOTYPE_OFFSETS])
+
+# Registered kernels: name --> (function, encoding)
+KERNELS = {}
+
+
+# Function registers a kernel function with the encoding of its direction codes
+def registerKernel(name, function, encoding):
+    if encoding not in ("cells", "prototype"):
+        raise ValueError("Invalid direction encoding: {}".format(encoding))
+    KERNELS[name] = (function, encoding)
+
+
+# Function converts a direction raster from one encoding to the other
+def convertDirections(direction, source, target):
+    direction = np.asarray(direction, dtype=int)
+    if source == target:
+        return direction
+    if source == "cells":
+        return CELL_TO_PROTOTYPE[direction]
+    return PROTOTYPE_TO_CELL[direction + 1]
+
+
+# Function runs a registered kernel, the direction raster is converted to the encoding of the kernel
+def runKernel(name, direction, particles, encoding="cells", **params):
+    if name not in KERNELS:
+        raise ValueError("Unknown kernel: {} (choose from {})".format(name, sorted(KERNELS)))
+    function, kernel_encoding = KERNELS[name]
+    return function(convertDirections(direction, encoding, kernel_encoding), particles, **params)
+
+
+# Function returns the halo array of the particles moved to the target cells of the prototype codes
+def getPrototypeTargets(direction, moved):
+    halo = getHaloArray(moved.shape)
+    for code, (di, dj) in enumerate(PROTOTYPE_OFFSETS):
+        addShifted(halo, np.where(direction == code, moved, 0.0), di, dj)
+    return halo
+
+
+# Function returns the 3x3 kernel of the M2 rule (target cell: 1 - diff_loss, 8 neighbours: diff_loss)
+def getM2Kernel(diff_loss):
+    kernel = np.full((3, 3), float(diff_loss))
+    kernel[1, 1] = 1 - diff_loss
+    return kernel
+
+
+# Function distributes every cell to its 3x3 neighbourhood, kernel[1 + di, 1 + dj] is the share of the neighbour
+# (di, dj), returns the new field and the mass lost through the boundaries
+def convolve3x3(field, kernel, boundary=("open", "open")):
+    halo = getHaloArray(field.shape)
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            if kernel[1 + di, 1 + dj] != 0:
+                addShifted(halo, field * kernel[1 + di, 1 + dj], di, dj)
+    return foldHalo(halo, boundary)
+
+
+# MAIN MODEL: transport percentage of the remaining part to the receiving cell, then diffusion
+def mainKernel(direction, particles, transport_perc=1.0, diffusion_percent=0.1, diffusion_type=1,
+               boundary=("open", "open")):
+    transport_perc = np.where(direction > 0, transport_perc, 0.0)
+    temp_arr = transportStep(particles, direction, transport_perc, diffusion_percent, boundary)[0]
+    return diffusionStep(temp_arr, diffusion_percent, diffusion_type, boundary)[0]
+
+
+# 2D_WIND: half of every cell is moved to the target cell
+def windKernel(direction, particles, boundary=("open", "open")):
+    halo = getPrototypeTargets(direction, particles * 0.5)
+    # cells without a direction keep their particles
+    addShifted(halo, np.where(direction < 0, particles, 0.0), 0, 0)
+    return foldHalo(halo, boundary)[0]
+
+
+# 2D_WIND_M2: move to the target cell, then spread diff_loss to the 8 neighbours of the target cell
+def windM2Kernel(direction, particles, loss=1.0, diff_loss=0.5, boundary=("open", "open")):
+    moved = particles * loss
+    targets = getPrototypeTargets(direction, moved)
+    addShifted(targets, np.where(direction < 0, moved, 0.0), 0, 0)
+    targets = foldHalo(targets, boundary)[0]
+    return convolve3x3(targets, getM2Kernel(diff_loss), boundary)[0]
+
+
+registerKernel("main", mainKernel, "cells")
+registerKernel("2D_Wind", windKernel, "prototype")
+registerKernel("2D_Wind_M2", windM2Kernel, "prototype")
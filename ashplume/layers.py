@@ -0,0 +1,50 @@
+import numpy as np
+
+
+"""
+_____________________________________Vertical Layers__________________________________________
+
+Helper functions for the 3D mode with K flight-level layers.
+
+The particle raster has the shape ([bins,] layers, rows, cols), layer 0 is the lowest layer.
+Every layer is transported with the wind of its own pressure level (see wind.py), all layers are processed
+in one vectorized pass of the transport-diffusion kernel (see transport.py).
+
+Emission:
+    The erupted concentration is distributed uniformly between the vent (0 km) and the plume height.
+    Each layer receives the part of the plume which lies between its bottom and its top.
+    Plume parts above the highest layer top are added to the highest layer.
+
+Settling:
+    In each timestep a constant percentage of every layer settles to the next lower layer.
+    The particles settling out of the lowest layer are deposited on the ground (fall-out).
+"""
+
+
+# Function returns the fraction of the plume within each layer (layers x plume heights)
+# heights: plume heights (km), layer_tops: altitude of the top of each layer (km, increasing)
+def getLayerFractions(heights, layer_tops):
+    heights = np.atleast_1d(np.asarray(heights, dtype=float))
+    tops = np.asarray(layer_tops, dtype=float)
+    bottoms = np.concatenate(([0.0], tops[:-1]))
+
+    # overlap of each layer with the plume column (0 to plume height)
+    overlap = np.clip(np.minimum(tops[:, np.newaxis], heights) - bottoms[:, np.newaxis], 0, None)
+    # plume parts above the highest layer
+    overlap[-1] += np.clip(heights - tops[-1], 0, None)
+
+    fractions = np.zeros((len(tops), len(heights)))
+    fractions[0] = 1.0
+    erupting = heights > 0
+    fractions[:, erupting] = overlap[:, erupting] / heights[erupting]
+    return fractions
+
+
+# Function moves the settling percentage of every layer to the next lower layer (in place)
+# particles: (..., layers, rows, cols)
+# returns the concentration field (..., rows, cols) deposited on the ground out of the lowest layer
+def settlingStep(particles, settling_perc):
+    settled = particles * settling_perc
+    particles -= settled
+    particles[..., :-1, :, :] += settled[..., 1:, :, :]
+    return settled[..., 0, :, :]
@@ -0,0 +1,235 @@
+import numpy as np
+
+from ashplume.transport import getTransportFields, transportStep, diffusionStep
+
+
+"""
+_____________________________________Nested Grid__________________________________________
+
+Two-way nested fine grid around the volcano, embedded in the (coarse) model grid.
+
+The nest covers a block of coarse cells (rows x cols), each coarse cell is refined into r x r fine cells. The mass of
+the covered coarse cells is owned by the fine grid, the coarse cells of the nest stay empty. All concentrations are
+in the units of the coarse grid: a coarse cell corresponds to the mean of its r x r fine cells.
+
+Every sub-step of the coarse grid:
+    1) the coarse grid is transported (mass can move into the empty nest cells)
+    2) inflow: the mass of the coarse nest cells is distributed uniformly to their fine cells
+    3) the fine grid is transported in r fine sub-steps (cells r times smaller, r times shorter timesteps, thus the
+       transport percentages of the wind speeds stay the same)
+    4) outflow: after every fine sub-step the mass in the ring of fine cells around the nest (one coarse cell wide)
+       is added to the coarse cells of the ring (mean of their fine cells)
+Both exchanges only move mass between the grids, thus the nesting is conservative. The wind of the fine grid is
+interpolated bilinearly from the coarse wind field.
+
+The eruption sources within the nest erupt into their fine cell (the concentration is multiplied by r^2, the mass
+stays the same). With a moving nest the nest follows the centre of mass of the fine grid in steps of whole coarse
+cells: the fine values of the cells which stay within the nest are kept, cells leaving the nest are given back to the
+coarse grid and new cells are refined uniformly.
+
+The nest is available for particle rasters (rows, cols), i.e. without size bins and vertical layers.
+"""
+
+
+# Function returns the mean of every block of r x r cells of a field (rows * r, cols * r)
+def getBlockMean(field, r):
+    rows, cols = field.shape
+    return field.reshape(rows // r, r, cols // r, r).mean(axis=(1, 3))
+
+
+# Function returns the field with every cell repeated r x r times
+def getRefined(field, r):
+    return np.repeat(np.repeat(field, r, axis=0), r, axis=1)
+
+
+# Function interpolates a field bilinearly at fractional row and column positions (1D arrays of the rows and cols)
+# periodic: the last column is a neighbour of the first column
+def interpolateField(field, frac_rows, frac_cols, periodic):
+    rows, cols = field.shape
+    frac_rows = np.clip(frac_rows, 0, rows - 1)
+    i0 = np.minimum(np.floor(frac_rows).astype(int), rows - 2)
+    di = (frac_rows - i0)[:, np.newaxis]
+    if periodic:
+        j0 = np.floor(frac_cols).astype(int)
+        dj = (frac_cols - j0)[np.newaxis, :]
+        j1 = (j0 + 1) % cols
+        j0 = j0 % cols
+    else:
+        frac_cols = np.clip(frac_cols, 0, cols - 1)
+        j0 = np.minimum(np.floor(frac_cols).astype(int), cols - 2)
+        dj = (frac_cols - j0)[np.newaxis, :]
+        j1 = j0 + 1
+    return ((1 - di) * (1 - dj) * field[np.ix_(i0, j0)] + (1 - di) * dj * field[np.ix_(i0, j1)] +
+            di * (1 - dj) * field[np.ix_(i0 + 1, j0)] + di * dj * field[np.ix_(i0 + 1, j1)])
+
+
+class NestedGrid(object):
+
+    # grid: GridGeometry of the coarse grid, lat0, lon0: centre of the nest (degrees)
+    # size: number of coarse cells (rows and cols) of the nest, refinement: fine cells per coarse cell and direction
+    # moving: if True the nest follows the centre of mass of the plume
+    def __init__(self, grid, lat0, lon0, size=9, refinement=3, moving=False):
+        if refinement < 2:
+            raise ValueError("The refinement of the nest has to be at least 2!")
+        if size < 1 or size + 2 > grid.dim_lat or size + 2 > grid.dim_lon:
+            raise ValueError("Invalid size of the nest: {}".format(size))
+        self.grid = grid
+        self.size = size
+        self.r = refinement
+        self.moving = moving
+        # fine grid with a ring of one coarse cell (r fine cells) for the outflow
+        self.fine = np.zeros(((size + 2) * refinement, (size + 2) * refinement))
+        self.cells = None
+        self.transport_perc = None
+        # fine fields and coordinates of the recorded frames
+        self.frames = []
+        self.frame_lats = []
+        self.frame_lons = []
+
+        i, j = grid.getIndex(lat0, lon0)
+        self.place(i - size // 2, j - size // 2)
+
+    # Function places the nest at the first coarse row i0 and column j0 (within the grid)
+    def place(self, i0, j0):
+        # the ring around the nest has to lie within the grid
+        self.i0 = int(np.clip(i0, 1, self.grid.dim_lat - self.size - 1))
+        if self.grid.global_lon:
+            self.j0 = int(j0) % self.grid.dim_lon
+        else:
+            self.j0 = int(np.clip(j0, 1, self.grid.dim_lon - self.size - 1))
+        # coarse rows and columns of the nest and of the nest with the ring
+        self.rows = np.arange(self.i0, self.i0 + self.size)
+        self.cols = np.arange(self.j0, self.j0 + self.size) % self.grid.dim_lon
+        self.ring_rows = np.arange(self.i0 - 1, self.i0 + self.size + 1)
+        self.ring_cols = np.arange(self.j0 - 1, self.j0 + self.size + 1) % self.grid.dim_lon
+
+    # Function returns the fine cells of the nest (without the ring)
+    def getInner(self):
+        return self.fine[self.r:-self.r, self.r:-self.r]
+
+    # Function returns the latitudes and longitudes of the fine cells of the nest
+    def getCoordinates(self):
+        positions = (np.arange(self.size * self.r) + 0.5) / self.r - 0.5
+        lat = self.grid.lat[0] + (self.i0 + positions) * self.grid.dlat
+        lon = self.grid.lon[0] + (self.j0 + positions) * self.grid.dlon
+        return lat, (lon + 180.0) % 360.0 - 180.0
+
+    # Function returns the mass of the nest (in the units of the coarse grid)
+    def getTotal(self):
+        return float(np.sum(self.fine, dtype=np.float64)) / self.r ** 2
+
+    # Function returns the coarse particle raster with the mean of the fine cells in the cells of the nest
+    def getComposite(self, particles):
+        composite = particles.copy()
+        composite[np.ix_(self.rows, self.cols)] += getBlockMean(self.getInner(), self.r)
+        return composite
+
+    # Function adds the emission of the timestep to the fine grid (sources within the nest) and to the coarse
+    # particle raster (all other sources), returns the injected concentration (see sources.py)
+    def inject(self, particles, sources, step):
+        if step >= len(sources.emission):
+            return 0.0
+        emission = sources.emission[step]
+        inside = self.getInside(sources.rows, sources.cols)
+        # fine cell of every source (coarse cell j covers the fractional positions j - 0.5 to j + 0.5)
+        lat_frac, lon_frac = self.grid.getFractionalIndex(np.array(sources.lats), np.array(sources.lons))
+        n = self.size * self.r
+        fine_rows = np.clip(np.floor((lat_frac - self.i0 + 0.5) * self.r).astype(int), 0, n - 1)
+        fine_cols = np.clip(np.floor(((lon_frac - self.j0 + 0.5) % self.grid.dim_lon) * self.r).astype(int), 0, n - 1)
+        np.add.at(self.fine, (fine_rows[inside] + self.r, fine_cols[inside] + self.r), emission[inside] * self.r ** 2)
+        np.add.at(particles, (sources.rows[~inside], sources.cols[~inside]), emission[~inside])
+        return float(emission.sum())
+
+    # Function returns True for every coarse cell (rows and cols) within the nest
+    def getInside(self, rows, cols):
+        return ((rows >= self.i0) & (rows < self.i0 + self.size) &
+                ((cols - self.j0) % self.grid.dim_lon < self.size))
+
+    # Function processes the fall-out of the fine grid, the fall-out is added to the coarse deposition raster
+    # returns the fall-out (in the units of the coarse grid)
+    def fallOut(self, fall_out, deposition):
+        fallen_out = getBlockMean(self.getInner(), self.r) * (1 - fall_out)
+        self.fine *= fall_out
+        deposition[np.ix_(self.rows, self.cols)] += fallen_out
+        return float(np.sum(fallen_out, dtype=np.float64))
+
+    # Function interpolates the wind field of the coarse grid to the fine grid and calculates the transport fields
+    def setWind(self, u, v, resolution):
+        positions = (np.arange((self.size + 2) * self.r) + 0.5) / self.r - 0.5 - 1
+        frac_rows = self.i0 + positions
+        frac_cols = self.j0 + positions
+        u_fine = interpolateField(u, frac_rows, frac_cols, self.grid.global_lon)
+        v_fine = interpolateField(v, frac_rows, frac_cols, self.grid.global_lon)
+        # r fine sub-steps per coarse sub-step, thus the same transport percentages as in the coarse grid
+        self.cells, self.transport_perc = getTransportFields(u_fine, v_fine, resolution)
+
+    # Function moves the mass of the coarse nest cells (inflow) to the fine grid
+    def refine(self, particles):
+        block = np.ix_(self.rows, self.cols)
+        self.getInner()[...] += getRefined(particles[block], self.r)
+        particles[block] = 0.0
+
+    # Function moves the mass of the ring (outflow) to the coarse particle raster
+    def coarsen(self, particles):
+        r = self.r
+        outflow = self.fine.copy()
+        outflow[r:-r, r:-r] = 0.0
+        particles[np.ix_(self.ring_rows, self.ring_cols)] += getBlockMean(outflow, r)
+        self.fine[:r] = 0.0
+        self.fine[-r:] = 0.0
+        self.fine[:, :r] = 0.0
+        self.fine[:, -r:] = 0.0
+
+    # Function runs one coarse sub-step of the nest after the transport of the coarse grid (see above)
+    # returns the mass leaving the fine grid with the ring (in the units of the coarse grid, normally 0)
+    def step(self, particles, diffusion_percent, diffusion_type):
+        self.refine(particles)
+        loss = 0.0
+        for k in range(self.r):
+            temp_arr, transport_loss = transportStep(self.fine, self.cells, self.transport_perc, diffusion_percent,
+                                                     ("open", "open"))
+            self.fine, diffusion_loss = diffusionStep(temp_arr, diffusion_percent, diffusion_type, ("open", "open"))
+            loss += (transport_loss + diffusion_loss) / self.r ** 2
+            self.coarsen(particles)
+        return loss
+
+    # Function moves the nest to the centre of mass of the fine grid (whole coarse cells)
+    def follow(self, particles):
+        inner = self.getInner()
+        total = inner.sum()
+        if total <= 0:
+            return
+        positions = (np.arange(self.size * self.r) + 0.5) / self.r
+        di = int(np.round((inner.sum(axis=1) * positions).sum() / total - self.size / 2.0))
+        dj = int(np.round((inner.sum(axis=0) * positions).sum() / total - self.size / 2.0))
+        if di == 0 and dj == 0:
+            return
+
+        # all fine cells are given back to the coarse grid, the nest is placed and refined uniformly
+        old = inner.copy()
+        old_i0 = self.i0
+        old_j0 = self.j0
+        particles[np.ix_(self.rows, self.cols)] += getBlockMean(old, self.r)
+        self.fine[...] = 0.0
+        self.place(self.i0 + di, self.j0 + dj)
+        self.refine(particles)
+
+        # the fine values of the coarse cells which stay within the nest are restored (same mass)
+        di = (self.i0 - old_i0) * self.r
+        dj = ((self.j0 - old_j0 + self.grid.dim_lon // 2) % self.grid.dim_lon - self.grid.dim_lon // 2) * self.r
+        n = self.size * self.r
+        if abs(di) < n and abs(dj) < n:
+            self.getInner()[max(-di, 0):n - max(di, 0), max(-dj, 0):n - max(dj, 0)] = \
+                old[max(di, 0):n - max(-di, 0), max(dj, 0):n - max(-dj, 0)]
+
+    # Function stores the fine field and the coordinates of the nest for the current frame
+    def record(self):
+        lat, lon = self.getCoordinates()
+        self.frames.append(self.getInner().copy())
+        self.frame_lats.append(lat)
+        self.frame_lons.append(lon)
+
+    # Function writes the fine fields and coordinates of all frames to a compressed NumPy file
+    def write(self, filename):
+        np.savez_compressed(filename, frames=np.array(self.frames), lat=np.array(self.frame_lats),
+                            lon=np.array(self.frame_lons), refinement=self.r)
@@ -0,0 +1,120 @@
+import numpy as np
+
+from ashplume.transport import CELL_OFFSETS, OFFSET_TABLE
+
+try:
+    from scipy import sparse
+except ImportError:
+    # scipy is optional, only the sparse transport operator requires it
+    sparse = None
+
+
+"""
+_____________________________________Sparse Transport Operator__________________________________________
+
+For a fixed wind field the transport and the diffusion in all directions are linear in the particle raster.
+The SparseTransportOperator assembles both steps once per wind field as one scipy.sparse CSR matrix A (cells x cells):
+    particles(t + 1) = A * particles(t)
+The matrix contains the retained part of every cell, the transported part at the transport receiving cell and the
+diffusion spread to the 8 surrounding cells. The boundary conditions (see transport.py) are part of the matrix:
+periodic and reflective boundaries map the targets back into the domain, targets behind absorbing or open
+boundaries have no entry (the column sums of A are smaller than 1).
+
+k sub-steps with the same wind field are applied as one precomputed matrix power A^k.
+The transposed operator A^T propagates sensitivities backwards in time (adjoint run, see adjoint.py).
+Particle rasters with leading dimensions (size bins) are processed as several columns of one sparse product.
+
+The gradient dependent diffusion (diffusion type 0) depends on the concentrations and is not linear, thus it
+cannot be expressed as an operator.
+"""
+
+
+# Function returns the flat target indices of all cells shifted by (di, dj) and the mask of the targets within the
+# domain (after the boundary conditions are applied)
+# shape: ([layers,] rows, cols), di and dj are scalars or arrays with one offset per cell
+def getTargetIndices(shape, di, dj, boundary):
+    rows = shape[-2]
+    cols = shape[-1]
+    index = np.arange(int(np.prod(shape)))
+    leading, inner = np.divmod(index, rows * cols)
+    i, j = np.divmod(inner, cols)
+    i = i + di
+    j = j + dj
+
+    if boundary[0] == "periodic":
+        j = j % cols
+    if boundary[1] == "reflective":
+        i = np.clip(i, 0, rows - 1)
+    valid = (i >= 0) & (i < rows) & (j >= 0) & (j < cols)
+    return leading * rows * cols + i * cols + j, valid
+
+
+class SparseTransportOperator(object):
+
+    # cells and transport_perc: transport fields of the wind field ([layers,] rows, cols), see transport.py
+    # diffusion_type: 1 - all directions, any other number except 0 - no diffusion
+    def __init__(self, cells, transport_perc, diffusion_percent, diffusion_type, boundary=("periodic", "reflective")):
+        if sparse is None:
+            raise ImportError("The sparse transport operator requires scipy!")
+        if diffusion_type == 0:
+            raise ValueError("The gradient dependent diffusion (type 0) is not linear and has no sparse operator!")
+
+        cells = np.asarray(cells)
+        self.shape = cells.shape
+        self.size = cells.size
+        origin = np.arange(self.size)
+
+        # TRANSPORT: retained part at the origin, transported part at the transport receiving cell
+        moved = (1 - diffusion_percent) * np.ravel(np.broadcast_to(transport_perc, self.shape))
+        offsets = OFFSET_TABLE[np.ravel(cells)]
+        target, valid = getTargetIndices(self.shape, offsets[:, 0], offsets[:, 1], boundary)
+        transport = sparse.csr_matrix((np.concatenate((1 - moved, moved[valid])),
+                                       (np.concatenate((origin, target[valid])),
+                                        np.concatenate((origin, origin[valid])))),
+                                      shape=(self.size, self.size))
+
+        # DIFFUSION in all directions: each surrounding cell receives an eighth of the diffusion part
+        if diffusion_type == 1 and diffusion_percent != 0:
+            rows = [origin]
+            columns = [origin]
+            values = [np.full(self.size, 1 - diffusion_percent)]
+            for di, dj in CELL_OFFSETS:
+                target, valid = getTargetIndices(self.shape, di, dj, boundary)
+                rows.append(target[valid])
+                columns.append(origin[valid])
+                values.append(np.full(valid.sum(), diffusion_percent / 8.0))
+            diffusion = sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                                          shape=(self.size, self.size))
+            self.matrix = diffusion.dot(transport).tocsr()
+        else:
+            self.matrix = transport
+
+        # matrix powers A^k and the part of every cell which leaves the domain within k steps
+        self.powers = {1: self.matrix}
+        self.loss_weights = {}
+
+    # Function returns the matrix power A^k (calculated once)
+    def getPower(self, steps):
+        if steps not in self.powers:
+            self.powers[steps] = self.getPower(steps - 1).dot(self.matrix).tocsr()
+        return self.powers[steps]
+
+    # Function returns the fraction of every cell which leaves the domain within k steps (1 - column sums of A^k)
+    def getLossWeights(self, steps):
+        if steps not in self.loss_weights:
+            self.loss_weights[steps] = 1 - np.ravel(np.asarray(self.getPower(steps).sum(axis=0)))
+        return self.loss_weights[steps]
+
+    # Function applies k steps to the particle raster ([bins,] [layers,] rows, cols)
+    # returns the new particle raster and the mass lost through the boundaries
+    def apply(self, particles, steps=1):
+        columns = np.reshape(particles, (-1, self.size))
+        result = self.getPower(steps).dot(columns.T).T
+        loss = float(np.sum(columns.dot(self.getLossWeights(steps))))
+        return result.reshape(np.shape(particles)), loss
+
+    # Function applies k steps of the transposed operator (A^k)^T to the adjoint field ([receptors,] [bins,] rows, cols)
+    def applyTranspose(self, adjoint, steps=1):
+        columns = np.reshape(adjoint, (-1, self.size))
+        result = self.getPower(steps).T.dot(columns.T).T
+        return result.reshape(np.shape(adjoint))
@@ -0,0 +1,58 @@
+import os
+
+from netCDF4 import Dataset
+
+
+"""
+_____________________________________Output Writers__________________________________________
+
+Streaming writers for gridded model products. Each call of write appends one record along the unlimited time
+dimension of a NetCDF file, thus the fields never have to be kept in memory.
+"""
+
+
+class DepositionWriter(object):
+
+    # filename: NetCDF file which is created (an existing file is overwritten, a missing directory is created)
+    # grid: GridGeometry of the particle raster (see grid.py)
+    # bins: mean diameters of the size bins (micrometers), None for one single bin
+    def __init__(self, filename, grid, bins=None):
+        directory = os.path.dirname(filename)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.dataset = Dataset(filename, "w")
+        self.dataset.description = "Accumulated ground deposition (fall-out) of the volcanic ash plume model"
+
+        self.dataset.createDimension("time", None)
+        self.dataset.createDimension("lat", grid.dim_lat)
+        self.dataset.createDimension("lon", grid.dim_lon)
+        dimensions = ("time", "lat", "lon")
+
+        time = self.dataset.createVariable("time", "i4", ("time",))
+        time.units = "hours since model start"
+        lat = self.dataset.createVariable("lat", "f8", ("lat",))
+        lat.units = "degrees_north"
+        lat[:] = grid.lat
+        lon = self.dataset.createVariable("lon", "f8", ("lon",))
+        lon.units = "degrees_east"
+        lon[:] = grid.lon
+
+        if bins is not None:
+            self.dataset.createDimension("bin", len(bins))
+            diameter = self.dataset.createVariable("diameter", "f8", ("bin",))
+            diameter.units = "micrometers"
+            diameter[:] = bins
+            dimensions = ("time", "bin", "lat", "lon")
+
+        self.deposition = self.dataset.createVariable("deposition", "f4", dimensions, zlib=True)
+        self.deposition.units = "g/m^3"
+        self.records = 0
+
+    # Function appends the accumulated deposition field ([bins,] rows, cols) of the specified hour
+    def write(self, deposition, hour):
+        self.dataset.variables["time"][self.records] = hour
+        self.deposition[self.records] = deposition
+        self.records += 1
+
+    def close(self):
+        self.dataset.close()
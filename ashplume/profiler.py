@@ -0,0 +1,131 @@
+import json
+import sys
+import numpy as np
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak memory is not sampled
+    resource = None
+
+
+"""
+_____________________________________Profiler__________________________________________
+
+Low-overhead instrumentation of a model run:
+    - timers (timeit.default_timer) around each phase of the time loop (wind reads, transport, diffusion, ...)
+    - counters of the visited cells versus the cells with a non-zero concentration
+    - sampling of the peak memory (resident set size) of the process
+
+The Profiler is written to a JSON file and printed as a summary table at the end of the model run.
+The NullProfiler has the same functions which do nothing, thus a disabled profiler costs nothing.
+"""
+
+
+# Function returns the peak memory (MB) of the process, None if it is not available
+def getPeakMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / 1024.0 ** 2
+    return peak / 1024.0
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+        self.started = {}
+        self.order = []
+        self.cells_visited = 0
+        self.cells_nonzero = 0
+        self.memory_samples = []
+        self.run_start = default_timer()
+
+    # Function starts the timer of a phase
+    def start(self, name):
+        self.started[name] = default_timer()
+
+    # Function stops the timer of a phase and adds the elapsed time
+    def stop(self, name):
+        elapsed = default_timer() - self.started.pop(name)
+        if name not in self.totals:
+            self.order.append(name)
+            self.totals[name] = 0.0
+            self.calls[name] = 0
+        self.totals[name] += elapsed
+        self.calls[name] += 1
+
+    # Function counts the cells processed by the kernel and the cells with a non-zero concentration
+    def count(self, particles):
+        self.cells_visited += particles.size
+        self.cells_nonzero += int(np.count_nonzero(particles))
+
+    # Function samples the peak memory of the process
+    def sample(self):
+        peak = getPeakMemory()
+        if peak is not None:
+            self.memory_samples.append(peak)
+
+    # Function returns the profile of the run as dictionary
+    def getProfile(self):
+        runtime = default_timer() - self.run_start
+        phases = []
+        for name in self.order:
+            phases.append({"phase": name,
+                           "calls": self.calls[name],
+                           "total_s": self.totals[name],
+                           "mean_ms": self.totals[name] / self.calls[name] * 1000.0,
+                           "share": self.totals[name] / runtime if runtime > 0 else 0.0})
+        peak = getPeakMemory()
+        return {"runtime_s": runtime,
+                "phases": phases,
+                "cells_visited": self.cells_visited,
+                "cells_nonzero": self.cells_nonzero,
+                "nonzero_fraction": self.cells_nonzero / float(self.cells_visited) if self.cells_visited else 0.0,
+                "peak_memory_mb": peak,
+                "memory_samples_mb": self.memory_samples}
+
+    # Function writes the profile to a JSON file
+    def write(self, filename):
+        with open(filename, "w") as out_file:
+            json.dump(self.getProfile(), out_file, indent=1)
+
+    # Function prints the summary table of the profile
+    def printSummary(self):
+        profile = self.getProfile()
+        print("")
+        print("{:<20}{:>8}{:>12}{:>12}{:>8}".format("Phase", "Calls", "Total [s]", "Mean [ms]", "%"))
+        for phase in profile["phases"]:
+            print("{:<20}{:>8}{:>12.3f}{:>12.3f}{:>8.1f}".format(phase["phase"], phase["calls"], phase["total_s"],
+                                                                  phase["mean_ms"], phase["share"] * 100))
+        print("Runtime: {:.3f} s".format(profile["runtime_s"]))
+        print("Cells visited: {}, cells with concentration: {} ({:.1f} %)".format(
+            profile["cells_visited"], profile["cells_nonzero"], profile["nonzero_fraction"] * 100))
+        if profile["peak_memory_mb"] is not None:
+            print("Peak memory: {:.1f} MB".format(profile["peak_memory_mb"]))
+
+
+class NullProfiler(object):
+
+    def start(self, name):
+        pass
+
+    def stop(self, name):
+        pass
+
+    def count(self, particles):
+        pass
+
+    def sample(self):
+        pass
+
+    def write(self, filename):
+        pass
+
+    def printSummary(self):
+        pass
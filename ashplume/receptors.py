@@ -0,0 +1,107 @@
+import numpy as np
+
+
+"""
+_____________________________________Point Receptors__________________________________________
+
+Point receptors (e.g. airports) for which concentration time series are extracted.
+
+All receptors are registered once. Afterwards the four surrounding grid cells and the bilinear weights
+of every receptor are calculated once and stored in two (receptors x 4) arrays.
+Every model frame is then sampled with one gathered dot product, thus the cost per frame only depends on
+the number of receptors and not on the size of the grid.
+
+The result is a (time x receptor) table which can be written to a CSV file.
+"""
+
+
+class ReceptorSet(object):
+
+    def __init__(self):
+        self.names = []
+        self.lats = []
+        self.lons = []
+        # (receptors x 4) arrays of flat grid indices and bilinear weights (see build)
+        self.indices = None
+        self.weights = None
+        # sampled frames
+        self.hours = []
+        self.rows = []
+
+    # Function registers a new receptor (decimal degrees)
+    def addReceptor(self, name, lat, lon):
+        if lat < -90 or lat > 90:
+            raise ValueError("Invalid latitude of receptor {}: {}".format(name, lat))
+        if lon < -180 or lon > 180:
+            raise ValueError("Invalid longitude of receptor {}: {}".format(name, lon))
+        self.names.append(str(name))
+        self.lats.append(float(lat))
+        self.lons.append(float(lon))
+        # weights have to be calculated again
+        self.indices = None
+        self.weights = None
+
+    # Function reads receptors from a CSV file with one "name,latitude,longitude" line per receptor
+    # The first line is expected to be a header line
+    def loadCSV(self, filename):
+        with open(filename, "r") as receptor_file:
+            lines = receptor_file.read().splitlines()
+        for line in lines[1:]:
+            if line.strip() == "":
+                continue
+            items = [item.strip() for item in line.split(",")]
+            if len(items) != 3:
+                raise ValueError("Invalid receptor line: {}".format(line))
+            self.addReceptor(items[0], float(items[1]), float(items[2]))
+
+    # Function calculates the grid indices and bilinear weights of all receptors
+    # grid is the GridGeometry of the particle raster (see grid.py)
+    def build(self, grid):
+        rows = grid.dim_lat
+        cols = grid.dim_lon
+
+        # fractional row and column position of every receptor
+        lat_frac, lon_frac = grid.getFractionalIndex(np.array(self.lats), np.array(self.lons))
+
+        # lower-left cell (the last row / column is handled by the upper-right cell)
+        # on global grids the right neighbour of the last column is the first column
+        i0 = np.minimum(np.floor(lat_frac).astype(int), max(rows - 2, 0))
+        i1 = np.minimum(i0 + 1, rows - 1)
+        if grid.global_lon:
+            j0 = np.floor(lon_frac).astype(int) % cols
+            j1 = (j0 + 1) % cols
+            dj = lon_frac - np.floor(lon_frac)
+        else:
+            j0 = np.minimum(np.floor(lon_frac).astype(int), max(cols - 2, 0))
+            j1 = np.minimum(j0 + 1, cols - 1)
+            dj = lon_frac - j0
+        di = lat_frac - i0
+
+        self.indices = np.column_stack((i0 * cols + j0, i0 * cols + j1, i1 * cols + j0, i1 * cols + j1))
+        self.weights = np.column_stack(((1 - di) * (1 - dj), (1 - di) * dj, di * (1 - dj), di * dj))
+
+    # Function returns the concentrations of all receptors for one particle raster
+    def sample(self, frame):
+        if self.indices is None:
+            raise AttributeError("Receptors have to be built before sampling!")
+        values = np.ravel(frame)[self.indices]
+        return np.einsum("ij,ij->i", values, self.weights)
+
+    # Function samples a particle raster and stores the result
+    def record(self, frame, hour):
+        self.hours.append(hour)
+        self.rows.append(self.sample(frame))
+
+    # Function returns the recorded (time x receptor) table
+    def getTable(self):
+        if len(self.rows) == 0:
+            return np.zeros((0, len(self.names)))
+        return np.vstack(self.rows)
+
+    # Function writes the recorded (time x receptor) table to a CSV file
+    def writeCSV(self, filename):
+        table = self.getTable()
+        with open(filename, "w") as out_file:
+            out_file.write(",".join(["hour"] + self.names) + "\n")
+            for hour, row in zip(self.hours, table):
+                out_file.write(",".join([str(hour)] + [repr(float(value)) for value in row]) + "\n")
@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+
+from ashplume.grid import GridGeometry
+from ashplume.cache import getCacheKey
+
+
+"""
+_____________________________________Regridding__________________________________________
+
+Resampling of the wind fields from the grid of the wind files to the model grid.
+
+The model grid is a regular latitude-longitude grid with the degree resolution of the spatial model resolution, thus
+the transport (which depends on the resolution in km) stays consistent with the grid. Both grids are regular, thus
+the weights are separable into a latitude and a longitude part:
+    target field = lat_weights x source field x lon_weights^T
+lat_weights (target rows x source rows) and lon_weights (target cols x source cols) are small dense matrices,
+the regridding of a field (or of all layers of a field) is two matrix products.
+
+Methods:
+    "bilinear"     - linear interpolation along the latitudes and the longitudes (periodic for global grids)
+    "conservative" - area weighted mean of the overlapping source cells (the area of a cell is proportional to the
+                     difference of the sine of its edge latitudes), conserves the mean of the field
+
+The weights are calculated once and cached on the disk (compressed NumPy file), the filename is the hash of the
+method and of the coordinates of both grids. Runs at other resolutions use their own weights.
+"""
+
+REGRID_METHODS = ("bilinear", "conservative")
+
+# Kilometers per degree (along a meridian)
+KM_PER_DEGREE = 111.195
+
+
+# Function returns the regular model grid with (about) the degree resolution covering the extent of the source grid
+# the spacing is adjusted to a whole number of cells, thus a global grid has no uneven seam at 180 degrees
+def getTargetGrid(source, degree_res):
+    lat = getRegularAxis(source.lat[0], source.lat[-1], degree_res)
+    if source.global_lon:
+        n = max(int(round(360.0 / degree_res)), 1)
+        lon = -180.0 + np.arange(n) * 360.0 / n
+    else:
+        lon = getRegularAxis(source.lon[0], source.lon[-1], degree_res)
+    return GridGeometry(lat, lon)
+
+
+# Function returns the regular coordinates from first to last (both included) with about the degree resolution
+def getRegularAxis(first, last, degree_res):
+    n = int(round(abs(last - first) / degree_res))
+    return np.linspace(first, last, n + 1)
+
+
+# Function returns the (target x source) weights of the linear interpolation along one coordinate
+# periodic: coordinates are longitudes of a global grid
+def getLinearWeights(source, target, periodic=False):
+    n = len(source)
+    if periodic:
+        position = ((target - source[0]) % 360.0) / (360.0 / n)
+        lower = np.floor(position).astype(int) % n
+        upper = (lower + 1) % n
+        fraction = position - np.floor(position)
+    else:
+        position = np.interp(target, source, np.arange(n))
+        lower = np.minimum(np.floor(position).astype(int), max(n - 2, 0))
+        upper = np.minimum(lower + 1, n - 1)
+        fraction = position - lower
+    weights = np.zeros((len(target), n))
+    rows = np.arange(len(target))
+    np.add.at(weights, (rows, lower), 1 - fraction)
+    np.add.at(weights, (rows, upper), fraction)
+    return weights
+
+
+# Function returns the cell edges of regular cell centres, clipped to the limits
+def getEdges(centres, lower_limit, upper_limit):
+    if len(centres) < 2:
+        return np.array([lower_limit, upper_limit], dtype=float)
+    middle = 0.5 * (centres[1:] + centres[:-1])
+    edges = np.concatenate(([2 * centres[0] - middle[0]], middle, [2 * centres[-1] - middle[-1]]))
+    return np.clip(edges, lower_limit, upper_limit)
+
+
+# Function returns the (target x source) weights of the overlap of the target cells with the source cells
+# period: period of the coordinate (360 for the longitudes of a global grid), None for no period
+def getOverlapWeights(source_edges, target_edges, period=None):
+    shifts = [0.0] if period is None else [-period, 0.0, period]
+    overlap = np.zeros((len(target_edges) - 1, len(source_edges) - 1))
+    for shift in shifts:
+        lower = np.maximum(target_edges[:-1, np.newaxis], source_edges[np.newaxis, :-1] + shift)
+        upper = np.minimum(target_edges[1:, np.newaxis], source_edges[np.newaxis, 1:] + shift)
+        overlap += np.clip(upper - lower, 0, None)
+    total = overlap.sum(axis=1, keepdims=True)
+    return overlap / np.where(total > 0, total, 1.0)
+
+
+class WindRegridder(object):
+
+    # source, target: GridGeometry of the wind files and of the model (model orientation)
+    # method: one of REGRID_METHODS, cache_dir: directory for the cached weights (None for no cache)
+    def __init__(self, source, target, method="bilinear", cache_dir=None):
+        if method not in REGRID_METHODS:
+            raise ValueError("Invalid regridding method: {} (choose from {})".format(method, REGRID_METHODS))
+        self.method = method
+        self.key = getCacheKey({"method": method, "source": [source.lat, source.lon],
+                                "target": [target.lat, target.lon]})
+
+        filename = None
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            filename = os.path.join(cache_dir, "weights_{}.npz".format(self.key))
+        if filename is not None and os.path.exists(filename):
+            with np.load(filename) as weights:
+                self.lat_weights = weights["lat_weights"]
+                self.lon_weights = weights["lon_weights"]
+            self.cached = True
+            return
+
+        if method == "bilinear":
+            self.lat_weights = getLinearWeights(source.lat, target.lat)
+            self.lon_weights = getLinearWeights(source.lon, target.lon, source.global_lon)
+        else:
+            # the area of a cell is proportional to the difference of the sine of its edge latitudes
+            self.lat_weights = getOverlapWeights(np.sin(np.radians(getEdges(source.lat, -90.0, 90.0))),
+                                                 np.sin(np.radians(getEdges(target.lat, -90.0, 90.0))))
+            self.lon_weights = getOverlapWeights(getEdges(source.lon, -np.inf, np.inf),
+                                                 getEdges(target.lon, -np.inf, np.inf),
+                                                 360.0 if source.global_lon else None)
+        self.cached = False
+        if filename is not None:
+            np.savez_compressed(filename, lat_weights=self.lat_weights, lon_weights=self.lon_weights)
+
+    # Function resamples a field ([layers,] source rows, source cols) to the target grid
+    def apply(self, field):
+        return np.matmul(np.matmul(self.lat_weights, np.asarray(field, dtype=float)), self.lon_weights.T)
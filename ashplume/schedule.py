@@ -0,0 +1,140 @@
+import numpy as np
+
+
+"""
+_____________________________________Output Schedule__________________________________________
+
+Thinning and time aggregation of the frames before the plots are rendered.
+
+Every timestep produces a frame (particle raster of the plots). Instead of keeping all frames until the end of the
+model run, every plot product (e.g. "WorldMap") has a policy which decides which frames are kept:
+    "all"     - every frame
+    "every k" - every k-th frame (frame 0, k, 2k, ...)
+    "max k"   - maximum of every cell over windows of k frames (e.g. flight-safety envelopes)
+    "mean k"  - mean of every cell over windows of k frames
+The windows start at frame 0, a last incomplete window is closed at the end of the model run (close).
+
+The aggregates are calculated incrementally: a running reducer holds one raster per window (running maximum or
+running sum) and the frames are not kept. Products with the same policy share their frames and reducer.
+"""
+
+OUTPUT_POLICIES = ("all", "every", "max", "mean")
+
+
+# Function returns the kind and the number of frames k of a policy (e.g. "max 24" --> ("max", 24))
+def parsePolicy(policy):
+    items = str(policy).split()
+    if len(items) == 0 or items[0] not in OUTPUT_POLICIES:
+        raise ValueError("Invalid output policy: {} (choose from {})".format(policy, OUTPUT_POLICIES))
+    if items[0] == "all":
+        if len(items) != 1:
+            raise ValueError("Invalid output policy: {} (\"all\" has no number of frames)".format(policy))
+        return "every", 1
+    if len(items) != 2 or not items[1].isdigit() or int(items[1]) < 1:
+        raise ValueError("Invalid output policy: {} (e.g. \"{} 6\")".format(policy, items[0]))
+    return items[0], int(items[1])
+
+
+class FrameStream(object):
+
+    # kind: "every", "max" or "mean", k: number of frames
+    def __init__(self, kind, k):
+        self.kind = kind
+        self.k = k
+        # kept frames and the first and last frame number of each kept frame (window)
+        self.frames = []
+        self.windows = []
+        # running reducer of the current window
+        self.reduced = None
+        self.first = None
+        self.count = 0
+
+    # Function adds the frame with the frame number
+    def add(self, frame, number):
+        if self.kind == "every":
+            if number % self.k == 0:
+                # copy, the particle raster of the frame can be changed in place by the next timestep
+                self.frames.append(np.array(frame, dtype=float))
+                self.windows.append((number, number))
+            return
+
+        if self.reduced is None:
+            self.reduced = np.array(frame, dtype=float)
+            self.first = number
+        elif self.kind == "max":
+            np.maximum(self.reduced, frame, out=self.reduced)
+        else:
+            np.add(self.reduced, frame, out=self.reduced)
+        self.count += 1
+        if self.count == self.k:
+            self.flush(number)
+
+    # Function closes the current window (last frame number)
+    def flush(self, number):
+        if self.reduced is None:
+            return
+        if self.kind == "mean":
+            self.reduced /= self.count
+        self.frames.append(self.reduced)
+        self.windows.append((self.first, number))
+        self.reduced = None
+        self.count = 0
+
+
+class OutputScheduler(object):
+
+    # policies: dictionary with the policy of every product (e.g. {"WorldMap": "all", "EuropeFlyzone": "max 24"})
+    def __init__(self, policies):
+        self.policies = dict((product, parsePolicy(policy)) for product, policy in policies.items())
+        self.streams = dict((policy, FrameStream(*policy)) for policy in set(self.policies.values()))
+        # number of frames added so far
+        self.count = 0
+
+    # Function adds the next frame to all products, returns the frame number
+    # number: frame number of the frame (e.g. a single synthesized last frame), None for the next frame number
+    def add(self, frame, number=None):
+        if number is None:
+            number = self.count
+        elif number < self.count:
+            raise ValueError("Frame number {} is already used (next frame number {})".format(number, self.count))
+        for stream in self.streams.values():
+            stream.add(frame, number)
+        self.count = number + 1
+        return number
+
+    # Function closes the incomplete windows at the end of the model run
+    def close(self):
+        for stream in self.streams.values():
+            stream.flush(self.count - 1)
+
+    # Function returns the kept frames of a product
+    def getFrames(self, product):
+        return self.streams[self.policies[product]].frames
+
+    # Function returns the (first, last) frame number of every kept frame of a product
+    def getWindows(self, product):
+        return self.streams[self.policies[product]].windows
+
+    # Function returns the description of a kept frame for the plots ("" for single frames)
+    def getLabel(self, product, window):
+        kind = self.policies[product][0]
+        if kind == "every" or window[0] == window[1]:
+            return ""
+        return "{} of frames {} - {}".format("Maximum" if kind == "max" else "Mean", window[0], window[1])
+
+    # Function returns the kept frames and windows of all policies as arrays (e.g. for the result cache)
+    def getState(self):
+        state = {"frame_count": self.count}
+        for (kind, k), stream in self.streams.items():
+            state["frames_{}_{}".format(kind, k)] = np.array(stream.frames)
+            state["windows_{}_{}".format(kind, k)] = np.array(stream.windows, dtype=int).reshape(-1, 2)
+        return state
+
+    # Function restores the kept frames and windows of all policies (see getState)
+    def setState(self, state):
+        self.count = int(state["frame_count"])
+        for (kind, k), stream in self.streams.items():
+            stream.frames = list(state["frames_{}_{}".format(kind, k)])
+            stream.windows = [tuple(window) for window in state["windows_{}_{}".format(kind, k)]]
+            stream.reduced = None
+            stream.count = 0
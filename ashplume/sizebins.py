@@ -0,0 +1,55 @@
+import numpy as np
+
+
+"""
+_____________________________________Particle Size Bins__________________________________________
+
+Helper functions for particle-size-binned fall-out.
+
+A user-defined grain-size distribution splits the erupted concentration into B size bins. All bins are stored in
+one particle raster with the shape (bins, [layers,] rows, cols) and are transported together by the vectorized
+transport-diffusion kernel (the transport fields of the wind are calculated only once for all bins).
+Only the fall-out differs between the bins.
+
+If no fall-out is specified for the bins, it is derived from the terminal settling velocity of the particles
+(Stokes' law) and the depth of the ash cloud:
+    settling velocity = g * d^2 * (particle density - air density) / (18 * air viscosity)
+    fall-out = 1 - settling velocity * timestep duration / cloud depth
+"""
+
+# Physical constants for the Stokes settling velocity
+GRAVITY = 9.81               # m/s^2
+ASH_DENSITY = 2500.0         # kg/m^3
+AIR_DENSITY = 1.2            # kg/m^3
+AIR_VISCOSITY = 1.8e-5       # Pa s
+
+
+# Function returns the terminal settling velocity (m/s) of particles with the diameters (micrometers)
+def getSettlingVelocity(diameters):
+    d = np.asarray(diameters, dtype=float) * 1e-6
+    return GRAVITY * d ** 2 * (ASH_DENSITY - AIR_DENSITY) / (18.0 * AIR_VISCOSITY)
+
+
+# Function returns the fall-out (1 - percent) of each size bin for one timestep
+# diameters: mean diameter of each bin (micrometers), hours: duration of the timestep (h),
+# depth: depth of the ash cloud (km)
+def getStokesFallOut(diameters, hours, depth):
+    fraction = getSettlingVelocity(diameters) * hours * 3600.0 / (depth * 1000.0)
+    return 1.0 - np.clip(fraction, 0.0, 1.0)
+
+
+# Function checks the grain-size distribution and returns the normalised bin fractions
+def getBinFractions(fractions):
+    fractions = np.asarray(fractions, dtype=float)
+    if np.any(fractions < 0) or fractions.sum() <= 0:
+        raise ValueError("Invalid grain-size distribution: {}".format(list(fractions)))
+    if abs(fractions.sum() - 1.0) > 1e-6:
+        print("Bin fractions do not sum up to 1 and are normalised.")
+    return fractions / fractions.sum()
+
+
+# Function returns the fall-out of the bins in a shape which can be multiplied with the particle raster
+# (bins, 1, 1) or (bins, 1, 1, 1) with layers
+def getFallOutArray(bin_fall_out, layers=False):
+    shape = (len(bin_fall_out), 1, 1, 1) if layers else (len(bin_fall_out), 1, 1)
+    return np.asarray(bin_fall_out, dtype=float).reshape(shape)
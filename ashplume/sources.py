@@ -0,0 +1,122 @@
+import numpy as np
+
+from ashplume.layers import getLayerFractions
+
+
+"""
+_____________________________________Eruption Sources__________________________________________
+
+Table of (multiple) simultaneous eruption point sources.
+
+Each source is defined by its location (decimal degrees), its start timestep and an array with the erupted
+concentration (g/m^3) of each timestep. Before the modelling process starts, the table is converted to
+    - index arrays (row and column of the closest cell of every source)
+    - a (time x source) emission matrix
+such that the injection of all sources in one timestep is a single np.add.at call.
+Sources in the same cell are added up.
+
+In the 3D mode the plume heights (km) of the sources are used to distribute the emission to the vertical layers
+(see layers.py). With particle size bins the emission is split according to the grain-size distribution
+(see sizebins.py). The emission is then stored as (time x [bin x] [layer x] source) matrix.
+"""
+
+
+class SourceTable(object):
+
+    def __init__(self):
+        self.names = []
+        self.lats = []
+        self.lons = []
+        self.starts = []
+        self.rates = []
+        self.heights = []
+        # index arrays and (time x [bin x] [layer x] source) emission matrix (see build)
+        self.rows = None
+        self.cols = None
+        self.index = None
+        self.emission = None
+
+    # Function registers a new source
+    # rates: erupted concentration (g/m^3) for each timestep beginning with the start timestep
+    # heights: plume height (km) for each timestep or one plume height for all timesteps (only used in 3D mode)
+    def addSource(self, name, lat, lon, rates, start=0, heights=0.0):
+        if lat < -90 or lat > 90:
+            raise ValueError("Invalid latitude of source {}: {}".format(name, lat))
+        if lon < -180 or lon > 180:
+            raise ValueError("Invalid longitude of source {}: {}".format(name, lon))
+        if start < 0:
+            raise ValueError("Invalid start timestep of source {}: {}".format(name, start))
+        self.names.append(str(name))
+        self.lats.append(float(lat))
+        self.lons.append(float(lon))
+        self.starts.append(int(start))
+        rates = np.atleast_1d(np.asarray(rates, dtype=float))
+        self.rates.append(rates)
+        self.heights.append(np.resize(np.asarray(heights, dtype=float), len(rates)))
+        self.emission = None
+
+    # Function reads sources from a CSV file with one "name,latitude,longitude,start,rates[,heights]" line per source
+    # rates are the concentrations (g/m^3) of each timestep separated by spaces
+    # heights (optional) are the plume heights (km) of each timestep separated by spaces
+    # The first line is expected to be a header line
+    def loadCSV(self, filename):
+        with open(filename, "r") as source_file:
+            lines = source_file.read().splitlines()
+        for line in lines[1:]:
+            if line.strip() == "":
+                continue
+            items = [item.strip() for item in line.split(",")]
+            if len(items) not in (5, 6):
+                raise ValueError("Invalid source line: {}".format(line))
+            rates = [float(rate) for rate in items[4].split()]
+            heights = 0.0
+            if len(items) == 6:
+                heights = [float(height) for height in items[5].split()]
+            self.addSource(items[0], float(items[1]), float(items[2]), rates, int(items[3]), heights)
+
+    # Function calculates the index arrays and the emission matrix for the specified amount of timesteps
+    # grid is the GridGeometry of the particle raster (see grid.py)
+    # layer_tops: altitude of the layer tops (km) in 3D mode, None for a single layer
+    # bin_fractions: fraction of each particle size bin, None for a single bin
+    def build(self, grid, steps, layer_tops=None, bin_fractions=None):
+        rows, cols = grid.getIndex(np.array(self.lats), np.array(self.lons))
+        self.rows = np.atleast_1d(rows)
+        self.cols = np.atleast_1d(cols)
+
+        emission = np.zeros((steps, len(self.names)))
+        heights = np.zeros((steps, len(self.names)))
+        for s in range(len(self.names)):
+            start = min(self.starts[s], steps)
+            end = min(self.starts[s] + len(self.rates[s]), steps)
+            emission[start:end, s] = self.rates[s][:end - start]
+            heights[start:end, s] = self.heights[s][:end - start]
+
+        # index of the particle raster for every entry of one emission matrix row
+        index = [self.rows, self.cols]
+
+        if layer_tops is not None:
+            # (layers x time*source) fractions --> (time x layer x source) emission matrix
+            fractions = getLayerFractions(heights.ravel(), layer_tops)
+            fractions = fractions.reshape((len(layer_tops),) + heights.shape).transpose(1, 0, 2)
+            emission = fractions * emission[:, np.newaxis, :]
+            index = [np.arange(len(layer_tops))[:, np.newaxis]] + index
+
+        if bin_fractions is not None:
+            # (time x bin x [layer x] source) emission matrix
+            bin_fractions = np.asarray(bin_fractions, dtype=float)
+            emission = bin_fractions.reshape((1, -1) + (1,) * (emission.ndim - 1)) * emission[:, np.newaxis]
+            index = [np.arange(len(bin_fractions)).reshape((-1,) + (1,) * (emission.ndim - 2))] + index
+
+        self.index = tuple(index)
+        self.emission = emission
+
+    # Function adds the emission of the timestep to the particle raster ([bins,] [layers,] rows, cols) in place
+    # returns the injected concentration
+    def inject(self, particles, step):
+        if self.emission is None:
+            raise AttributeError("Sources have to be built before injecting!")
+        if step >= len(self.emission):
+            return 0.0
+        np.add.at(particles, self.index, self.emission[step])
+        return float(self.emission[step].sum())
+
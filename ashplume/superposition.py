@@ -0,0 +1,137 @@
+import json
+
+import numpy as np
+
+from ashplume.transport import getTransportFields, transportStep, diffusionStep, TransportPlan
+
+
+"""
+_____________________________________Linear Superposition__________________________________________
+
+Library of unit responses for the re-evaluation of new emission rates without a new model run.
+
+For fixed wind fields the model is linear in the emission. Every emission timestep, size bin and source (a "pulse")
+is simulated once with a unit emission (1 g/m^3) from its timestep to the end of the model run. The library stores
+for every pulse
+    - the particle raster at the end of the model run (rows, cols)
+    - the accumulated fall-out (ground deposition) (rows, cols)
+    - the mass which left the domain through open boundaries
+The results of any emission matrix (time x [bin x] source) with the same sources are then a weighted sum of the unit
+responses (see synthesize), which takes seconds instead of a full model run.
+
+The pulses are simulated in batches as leading dimension of the particle raster (one vectorized pass of the
+transport-diffusion kernel for all pulses of a batch). A batch starts at the earliest timestep of its pulses.
+The responses are stored as float32 in a compressed NumPy file (.npz) together with the settings of the model run.
+A library is only reused if the settings (e.g. content of the wind files, resolutions, diffusion, fall-out, boundaries,
+source cells) match. Only the results at the end of the model run are stored, there are no intermediate frames.
+
+The gradient dependent diffusion (diffusion type 0) is not linear, the 3D mode is not supported (the emission of the
+layers depends on the plume height and the frames show the maximum of the layers).
+"""
+
+
+class UnitResponseLibrary(object):
+
+    # settings: dictionary (JSON serializable) with all settings of the model run except the emission rates
+    def __init__(self, settings):
+        self.settings = json.loads(json.dumps(settings, sort_keys=True))
+        # (time x [bin x] source x rows x cols) responses and (time x [bin x] source) boundary loss of the pulses
+        self.particles = None
+        self.deposition = None
+        self.loss = None
+
+    # Function simulates the unit pulses of all emission timesteps, size bins and sources
+    # wind: wind provider (see wind.py), sources: built SourceTable (see sources.py)
+    # particle_shape: shape of the particle raster ([bins,] rows, cols)
+    # fall_out: fall-out (1 - percent), scalar or array of the bins (bins, 1, 1)
+    # batch_size: number of pulses which are simulated together
+    # geometry: CellGeometry of the grid (see grid.py), None for square cells
+    def build(self, wind, timesteps, sources, particle_shape, fall_out, hourly_res, resolution, diffusion_percent,
+              diffusion_type, boundary=("periodic", "reflective"), backend="bincount", batch_size=24, geometry=None):
+        if diffusion_type == 0:
+            raise ValueError("The gradient dependent diffusion (type 0) is not linear and has no unit responses!")
+        if sources.emission is None:
+            raise AttributeError("Sources have to be built before the unit responses!")
+        shape = sources.emission.shape
+        rows, cols = particle_shape[-2:]
+
+        # timestep, cell and fall-out of every pulse (in the order of the emission matrix)
+        pulse_index = np.indices(shape).reshape(len(shape), -1)
+        pulse_steps = pulse_index[0]
+        pulse_rows = sources.rows[pulse_index[-1]]
+        pulse_cols = sources.cols[pulse_index[-1]]
+        bin_fall_out = np.ravel(fall_out)
+        pulse_fall_out = bin_fall_out[pulse_index[1]] if len(shape) == 3 else np.resize(bin_fall_out, pulse_steps.size)
+
+        pulses = pulse_steps.size
+        self.particles = np.zeros((pulses, rows, cols), dtype=np.float32)
+        self.deposition = np.zeros((pulses, rows, cols), dtype=np.float32)
+        self.loss = np.zeros(pulses)
+
+        for first in range(0, pulses, batch_size):
+            batch = np.arange(first, min(first + batch_size, pulses))
+            current = np.zeros((len(batch), rows, cols))
+            deposited = np.zeros((len(batch), rows, cols))
+            current_fall_out = pulse_fall_out[batch].reshape(-1, 1, 1)
+
+            for t in range(pulse_steps[batch].min(), len(timesteps)):
+                u, v = wind.getWind(timesteps[t])
+                cells, transport_perc = getTransportFields(u, v, resolution, geometry)
+                plan = None if backend == "shift" else TransportPlan(cells, current.shape, backend)
+
+                # unit emission of the pulses of the timestep, then the fall-out (as in the model loop)
+                injected = np.nonzero(pulse_steps[batch] == t)[0]
+                current[injected, pulse_rows[batch][injected], pulse_cols[batch][injected]] += 1.0
+                np.add(deposited, current * (1 - current_fall_out), out=deposited)
+                current = current * current_fall_out
+
+                for k in range(hourly_res):
+                    temp_arr = transportStep(current, cells, transport_perc, diffusion_percent, boundary, plan)[0]
+                    current = diffusionStep(temp_arr, diffusion_percent, diffusion_type, boundary)[0]
+
+            # mass leaving the domain follows from the mass balance of the unit pulse
+            self.loss[batch] = 1.0 - current.sum(axis=(1, 2)) - deposited.sum(axis=(1, 2))
+            self.particles[batch] = current
+            self.deposition[batch] = deposited
+
+        self.particles = self.particles.reshape(shape + (rows, cols))
+        self.deposition = self.deposition.reshape(shape + (rows, cols))
+        self.loss = self.loss.reshape(shape)
+
+    # Function writes the library to a compressed NumPy file
+    def save(self, filename):
+        np.savez_compressed(filename, settings=json.dumps(self.settings, sort_keys=True), particles=self.particles,
+                            deposition=self.deposition, loss=self.loss)
+
+    # Function loads the library from a compressed NumPy file
+    # returns False if the file does not exist or was created with other settings
+    def load(self, filename):
+        try:
+            library = np.load(filename)
+        except IOError:
+            return False
+        if json.loads(str(library["settings"])) != self.settings:
+            return False
+        self.particles = library["particles"]
+        self.deposition = library["deposition"]
+        self.loss = library["loss"]
+        return True
+
+    # Function returns the particle raster ([bins,] rows, cols) and the deposition ([bins,] rows, cols) at the end
+    # of the model run and the mass which left the domain for an emission matrix (time x [bin x] source)
+    def synthesize(self, emission):
+        if self.particles is None:
+            raise AttributeError("The unit responses have to be built or loaded before synthesizing!")
+        emission = np.asarray(emission, dtype=float)
+        if emission.shape != self.loss.shape:
+            raise ValueError("The emission matrix {} does not match the unit responses {}!".format(
+                emission.shape, self.loss.shape))
+        boundary_loss = float(np.sum(emission * self.loss))
+        if emission.ndim == 2:
+            return (np.tensordot(emission, self.particles, axes=2), np.tensordot(emission, self.deposition, axes=2),
+                    boundary_loss)
+        particles = np.stack([np.tensordot(emission[:, b], self.particles[:, b], axes=2)
+                              for b in range(emission.shape[1])])
+        deposition = np.stack([np.tensordot(emission[:, b], self.deposition[:, b], axes=2)
+                               for b in range(emission.shape[1])])
+        return particles, deposition, boundary_loss
@@ -0,0 +1,268 @@
+import numpy as np
+
+from ashplume.profiler import NullProfiler
+
+
+"""
+_____________________________________Transport-Diffusion Kernel__________________________________________
+
+Vectorized version of the transport and diffusion rules of the model (see Fifth Section of the main script).
+
+All functions work on particle arrays of the shape (..., rows, cols). Leading dimensions (e.g. vertical layers)
+are processed in one vectorized pass instead of one pass per layer.
+
+Classification of the transport receiving cell (wind direction "to", clockwise):
+    Cell 1: i + 1, j        Cell 5: i - 1, j
+    Cell 2: i + 1, j + 1    Cell 6: i - 1, j - 1
+    Cell 3: i, j + 1        Cell 7: i, j - 1
+    Cell 4: i - 1, j + 1    Cell 8: i + 1, j - 1
+Cell 0 is used for cells without any wind (no transport).
+
+BOUNDARY CONDITIONS:
+Every shift is done on an array with a halo of one cell around the domain, thus the kernel itself needs no
+index checks. After the shifts the halo is folded back into the domain according to the boundary conditions:
+    Longitude (first and last column):
+        "periodic" - mass leaving the last column enters the first column and vice versa (global grids)
+        "open"     - mass leaving the domain is lost (regional domains)
+    Latitude (first and last row, e.g. the poles):
+        "reflective" - mass leaving the domain is reflected back into the edge row
+        "absorbing"  - mass leaving the domain is lost
+        "open"       - same as "absorbing" (regional domains)
+Mass which is lost through the boundaries is returned by the kernel functions such that it can be considered in
+the mass balance.
+
+TRANSPORT BACKENDS:
+    "shift"    - one masked shift of the whole raster per transport receiving cell (8 passes)
+    "bincount" - scatter-add of all transported values at once with np.bincount on flattened halo indices
+    "add.at"   - scatter-add with np.add.at (unbuffered, slower than np.bincount)
+The scatter-add backends use a transport plan with the target index of every cell, which is calculated once per
+wind field and reused for all sub-steps. Values with the same target are always accumulated, never overwritten.
+
+CELL GEOMETRY:
+By default every cell is a square of "resolution" km. With a CellGeometry (see grid.py) the true distances of the
+cells of every row are used (the areas are not, concentrations are moved as without the geometry):
+    - transport: the wind speed is compared to the distance to the transport receiving cell (dx, dy or diagonal)
+    - gradient dependent diffusion: the gradients are the concentration differences divided by the distances to the
+      neighbour cells, the diffusion part is distributed in proportion to the gradients (instead of equally)
+"""
+
+# Row and column offsets of the transport receiving cells 1 - 8
+CELL_OFFSETS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+
+# Offsets of the transport receiving cells 0 - 8 (cell 0: no transport)
+OFFSET_TABLE = np.array([(0, 0)] + CELL_OFFSETS)
+
+# Available boundary conditions
+BOUNDARY_LON = ("periodic", "open")
+BOUNDARY_LAT = ("reflective", "absorbing", "open")
+
+# Available transport backends
+TRANSPORT_BACKENDS = ("shift", "bincount", "add.at")
+
+
+# Function checks the boundary conditions (longitude, latitude)
+def checkBoundary(boundary):
+    if boundary[0] not in BOUNDARY_LON:
+        raise ValueError("Invalid longitude boundary: {} (choose from {})".format(boundary[0], BOUNDARY_LON))
+    if boundary[1] not in BOUNDARY_LAT:
+        raise ValueError("Invalid latitude boundary: {} (choose from {})".format(boundary[1], BOUNDARY_LAT))
+
+
+# Function returns the transport receiving cell (0 - 8) and the transport percentage of every cell
+# u and v are the wind components (m/s), resolution is the spatial model resolution (km)
+# geometry: CellGeometry of the grid (see grid.py), None for square cells of the model resolution
+def getTransportFields(u, v, resolution, geometry=None):
+    u = np.asarray(u, dtype=float)
+    v = np.asarray(v, dtype=float)
+
+    # Determining the wind angle (0-360)
+    degrees = np.degrees(np.arctan2(u, v)) % 360.0
+
+    # wind in km/h and highest wind speed of u, v and diagonal wind
+    diag_km = np.sqrt(u ** 2 + v ** 2) * 3.6
+    max_wind = np.maximum(np.maximum(u * 3.6, v * 3.6), diag_km)
+
+    # Classification of transport receiving cell (45 degree sectors, Cell 1 from 337.5 to 22.5 degrees)
+    cells = (np.ceil((degrees - 22.5) / 45.0).astype(int) % 8) + 1
+    cells[diag_km == 0] = 0
+
+    # Classification of how much concentration should be transported
+    # 100% if wind reaches "resolution" km/h (the distance to the transport receiving cell with a cell geometry)
+    distance = resolution if geometry is None else geometry.getDistance(cells)
+    transport_perc = np.select([max_wind >= distance - 5,
+                                max_wind >= distance * 0.8 - 5,
+                                max_wind >= distance * 0.6 - 5],
+                               [1.0, 0.95, 0.9], 0.85)
+    transport_perc[max_wind == 0] = 0.0
+
+    return cells, transport_perc
+
+
+# Function returns an empty array with a halo of one cell around the last two dimensions
+def getHaloArray(shape):
+    return np.zeros(tuple(shape[:-2]) + (shape[-2] + 2, shape[-1] + 2))
+
+
+# Function adds the values shifted by (di, dj) to the halo array (in place)
+def addShifted(halo, values, di, dj):
+    rows = values.shape[-2]
+    cols = values.shape[-1]
+    halo[..., 1 + di:1 + di + rows, 1 + dj:1 + dj + cols] += values
+
+
+# Function adds the values at the flat indices of the target array (in place)
+# Values with the same index are accumulated
+def scatterAdd(target, indices, values, backend="bincount"):
+    flat = target.reshape(-1)
+    if backend == "add.at":
+        np.add.at(flat, indices, values)
+    else:
+        flat += np.bincount(indices, weights=values, minlength=flat.size)
+
+
+class TransportPlan(object):
+
+    # cells: transport receiving cells ([layers,] rows, cols), shape: shape of the particle raster
+    # backend: "bincount" or "add.at" (see scatterAdd)
+    def __init__(self, cells, shape, backend="bincount"):
+        if backend not in TRANSPORT_BACKENDS[1:]:
+            raise ValueError("Invalid scatter-add backend: {} (choose from {})".format(backend, TRANSPORT_BACKENDS[1:]))
+        self.backend = backend
+        self.shape = tuple(shape)
+        rows = shape[-2]
+        halo_cols = shape[-1] + 2
+        halo_size = (rows + 2) * halo_cols
+
+        # flat index of every cell within the halo array, each leading slice (layer, bin) has its own halo
+        ii, jj = np.indices(shape[-2:])
+        leading = np.arange(int(np.prod(shape[:-2]))).reshape(tuple(shape[:-2]) + (1, 1)) * halo_size
+        offsets = OFFSET_TABLE[np.broadcast_to(cells, shape)]
+        target = leading + (ii + 1 + offsets[..., 0]) * halo_cols + (jj + 1 + offsets[..., 1])
+        self.target = np.ravel(target)
+
+
+# Function folds the halo back into the domain according to the boundary conditions
+# returns the inner domain and the mass lost through the boundaries
+def foldHalo(halo, boundary):
+    if boundary[0] == "periodic":
+        halo[..., :, 1] += halo[..., :, -1]
+        halo[..., :, -2] += halo[..., :, 0]
+        halo[..., :, 0] = 0.0
+        halo[..., :, -1] = 0.0
+    if boundary[1] == "reflective":
+        halo[..., 1, 1:-1] += halo[..., 0, 1:-1]
+        halo[..., -2, 1:-1] += halo[..., -1, 1:-1]
+        halo[..., 0, 1:-1] = 0.0
+        halo[..., -1, 1:-1] = 0.0
+
+    # mass remaining in the halo leaves the domain (only the halo cells are summed up)
+    loss = (halo[..., 0, :].sum() + halo[..., -1, :].sum() +
+            halo[..., 1:-1, 0].sum() + halo[..., 1:-1, -1].sum())
+    return halo[..., 1:-1, 1:-1].copy(), float(loss)
+
+
+# Function returns the neighbour values of every cell in the order of the cells 1 - 8
+# Outside of the domain: periodic --> opposite column, reflective --> edge cell, open / absorbing --> 0
+def getNeighbours(particles, boundary):
+    halo = getHaloArray(particles.shape)
+    halo[..., 1:-1, 1:-1] = particles
+    if boundary[0] == "periodic":
+        halo[..., 1:-1, 0] = particles[..., :, -1]
+        halo[..., 1:-1, -1] = particles[..., :, 0]
+    if boundary[1] == "reflective":
+        halo[..., 0, :] = halo[..., 1, :]
+        halo[..., -1, :] = halo[..., -2, :]
+    rows = particles.shape[-2]
+    cols = particles.shape[-1]
+    return [halo[..., 1 + di:1 + di + rows, 1 + dj:1 + dj + cols] for di, dj in CELL_OFFSETS]
+
+
+# TRANSPORT
+# The diffusion part stays in the origin cell, the transport percentage of the remaining part is
+# moved to the transport receiving cell
+# boundary: (longitude, latitude) boundary conditions
+# plan: TransportPlan of the wind field for the scatter-add backends, None for the shift backend
+# returns the new particle raster and the mass lost through the boundaries
+def transportStep(particles, cells, transport_perc, diffusion_percent, boundary=("periodic", "reflective"),
+                  plan=None):
+    diff_amount = particles * diffusion_percent
+    x_origin = particles - diff_amount
+    moved = x_origin * transport_perc
+
+    halo = getHaloArray(particles.shape)
+    addShifted(halo, diff_amount + (x_origin - moved), 0, 0)
+    if plan is not None:
+        scatterAdd(halo, plan.target, np.ravel(moved), plan.backend)
+    else:
+        for cell in range(1, 9):
+            di, dj = CELL_OFFSETS[cell - 1]
+            addShifted(halo, np.where(cells == cell, moved, 0.0), di, dj)
+
+    return foldHalo(halo, boundary)
+
+
+# DIFFUSION
+# diffusion_type: 0 - gradient dependent  1 - all directions  any other number - no diffusion
+# boundary: (longitude, latitude) boundary conditions
+# geometry: CellGeometry of the grid for the gradients (see grid.py), None for square cells
+# returns the new particle raster and the mass lost through the boundaries
+def diffusionStep(particles, diffusion_percent, diffusion_type, boundary=("periodic", "reflective"), geometry=None):
+    if diffusion_type not in (0, 1) or diffusion_percent == 0:
+        return particles.copy(), 0.0
+
+    diff_amount = particles * diffusion_percent
+    halo = getHaloArray(particles.shape)
+
+    # DIFFUSION in all directions: each surrounding cell receives an eighth of the diffusion part
+    if diffusion_type == 1:
+        addShifted(halo, particles - diff_amount, 0, 0)
+        for di, dj in CELL_OFFSETS:
+            addShifted(halo, diff_amount / 8.0, di, dj)
+        return foldHalo(halo, boundary)
+
+    # DIFFUSION with respect to gradients: the diffusion part is distributed equally to all
+    # surrounding cells with a lower concentration than the origin cell (negative gradient)
+    x_origin = particles - diff_amount
+    neighbours = getNeighbours(particles, boundary)
+    negative = [neighbour < x_origin for neighbour in neighbours]
+    no_cells = np.sum(negative, axis=0)
+
+    # cells without any negative gradient keep their whole concentration
+    addShifted(halo, np.where(no_cells > 0, x_origin, particles), 0, 0)
+    if geometry is None:
+        share = np.where(no_cells > 0, diff_amount / np.maximum(no_cells, 1), 0.0)
+        for (di, dj), mask in zip(CELL_OFFSETS, negative):
+            addShifted(halo, np.where(mask, share, 0.0), di, dj)
+        return foldHalo(halo, boundary)
+
+    # with a cell geometry the diffusion part is distributed in proportion to the gradients (per km)
+    gradients = [np.where(mask, (x_origin - neighbour) / geometry.distances[:, cell:cell + 1], 0.0)
+                 for cell, (neighbour, mask) in enumerate(zip(neighbours, negative), 1)]
+    total = np.sum(gradients, axis=0)
+    for (di, dj), gradient in zip(CELL_OFFSETS, gradients):
+        addShifted(halo, np.where(total > 0, diff_amount * gradient / np.where(total > 0, total, 1.0), 0.0), di, dj)
+    return foldHalo(halo, boundary)
+
+
+# SUB-STEP of the model loop: transport and diffusion with the kernel, or one product with a sparse operator (see
+# operators.py) which contains both
+# plan: TransportPlan of the wind field for the scatter-add backends, operator: SparseTransportOperator or None
+# profiler: Profiler for the run time of the transport and the diffusion (see profiler.py), None for no profiling
+# returns the new particle raster and the mass lost through the boundaries
+def modelStep(particles, cells, transport_perc, diffusion_percent, diffusion_type, boundary=("periodic", "reflective"),
+              plan=None, geometry=None, operator=None, profiler=None):
+    if profiler is None:
+        profiler = NullProfiler()
+    if operator is not None:
+        profiler.start("transport")
+        particles, loss = operator.apply(particles)
+        profiler.stop("transport")
+        return particles, loss
+
+    profiler.start("transport")
+    temp_arr, transport_loss = transportStep(particles, cells, transport_perc, diffusion_percent, boundary, plan)
+    profiler.stop("transport")
+    profiler.start("diffusion")
+    particles, diffusion_loss = diffusionStep(temp_arr, diffusion_percent, diffusion_type, boundary, geometry)
+    profiler.stop("diffusion")
+    return particles, transport_loss + diffusion_loss
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+"""
+_____________________________________Wind Providers__________________________________________
+
+A wind provider returns the U- and V-wind components (m/s) of a timestep in the orientation of the model grid
+(see grid.py). The model only calls getWind(n), thus every wind source (NetCDF files, synthetic fields of windfields.py, ...)
+can be used in the same way.
+
+For vertical layers (3D mode) the wind components have the shape (layers, rows, cols), otherwise (rows, cols).
+"""
+
+
+class NetCDFWindProvider(object):
+
+    # u_var and v_var are the NetCDF wind variables (time, [level,] lat, lon)
+    # level_indices: indices of the pressure levels used as layers (None for wind files without levels)
+    def __init__(self, u_var, v_var, grid, level_indices=None):
+        self.u_var = u_var
+        self.v_var = v_var
+        self.grid = grid
+        self.level_indices = level_indices
+
+    # The fields are read by the grid (only the hyperslab of the region for regional grids, see grid.py)
+    def getWind(self, n):
+        if self.level_indices is None:
+            return self.grid.readField(self.u_var, (n,)), self.grid.readField(self.v_var, (n,))
+        u = np.stack([self.grid.readField(self.u_var, (n, level)) for level in self.level_indices])
+        v = np.stack([self.grid.readField(self.v_var, (n, level)) for level in self.level_indices])
+        return u, v
+
+
+class RegriddedWindProvider(object):
+
+    # provider: wind provider of the wind files, regridder: WindRegridder to the model grid (see regrid.py)
+    def __init__(self, provider, regridder):
+        self.provider = provider
+        self.regridder = regridder
+
+    def getWind(self, n):
+        u, v = self.provider.getWind(n)
+        return self.regridder.apply(u), self.regridder.apply(v)
+
+
+# Function returns the indices of the requested pressure levels within the level values of the wind file
+def getLevelIndices(level_values, levels):
+    level_values = [float(value) for value in np.asarray(level_values)]
+    indices = []
+    for level in levels:
+        if float(level) not in level_values:
+            raise ValueError("Pressure level {} is not available in the wind file!".format(level))
+        indices.append(level_values.index(float(level)))
+    return indices
@@ -0,0 +1,153 @@
+import numpy as np
+
+
+"""
+_____________________________________Synthetic Wind Fields__________________________________________
+
+Library of synthetic wind scenarios for offline testing and scaling studies. All fields are generated vectorized on
+the model grid (see grid.py) and deterministically from a seed, thus every run with the same settings is identical.
+
+Scenarios (U- and V-wind components in m/s):
+    "uniform" - the same wind in every cell (as the original test mode), or any prescribed field (e.g. bands of rows)
+    "shear"   - zonal wind bands changing their direction with the latitude
+    "vortex"  - rotating (Rankine) vortex around a centre
+    "jet"     - meandering westerly jet stream with a Gaussian profile
+    "random"  - Gaussian random field smoothed to a correlation length (seeded)
+
+The SyntheticWindProvider has the same getWind(n) interface as the NetCDF wind provider (see wind.py).
+With writeWindNetCDF the fields can be exported to a NetCDF file, such that the whole I/O path of the model can be
+used without ERA-Interim data.
+"""
+
+WIND_SCENARIOS = ("uniform", "shear", "vortex", "jet", "random")
+
+
+# Function returns the longitudes and latitudes (rows, cols) of the grid
+def getCoordinates(grid):
+    return np.meshgrid(grid.lon, grid.lat)
+
+
+# UNIFORM: the same wind in every cell
+# u and v are scalars or prescribed fields which are broadcast to (rows, cols) (e.g. a profile of the rows (rows, 1))
+def getUniformWind(grid, u=25.0, v=-25.0):
+    shape = (grid.dim_lat, grid.dim_lon)
+    return np.zeros(shape) + np.asarray(u, dtype=float), np.zeros(shape) + np.asarray(v, dtype=float)
+
+
+# SHEAR: zonal wind bands, the wind direction changes "bands" times from the south to the north pole
+def getShearWind(grid, speed=25.0, bands=6):
+    lon2, lat2 = getCoordinates(grid)
+    u = speed * np.cos(np.pi * bands * (lat2 + 90.0) / 180.0)
+    return u, np.zeros_like(u)
+
+
+# VORTEX: counter-clockwise Rankine vortex (solid body rotation within the radius, decaying outside)
+# lat0, lon0: centre (degrees), radius: radius of the maximum wind (degrees), speed: maximum wind (m/s)
+def getVortexWind(grid, lat0=60.0, lon0=-20.0, radius=15.0, speed=30.0):
+    lon2, lat2 = getCoordinates(grid)
+    dx = ((lon2 - lon0 + 180.0) % 360.0 - 180.0) * np.cos(np.radians(lat0))
+    dy = lat2 - lat0
+    r = np.hypot(dx, dy)
+    tangential = np.where(r < radius, speed * r / radius, speed * radius / np.maximum(r, radius))
+    r = np.maximum(r, 1e-12)
+    return -tangential * dy / r, tangential * dx / r
+
+
+# JET STREAM: westerly jet with a Gaussian profile around a meandering centre latitude
+# lat0: mean latitude, width: half width (degrees), amplitude: meander amplitude (degrees), waves: number of meanders
+def getJetStreamWind(grid, lat0=50.0, width=8.0, speed=50.0, amplitude=10.0, waves=5, phase=0.0):
+    lon2, lat2 = getCoordinates(grid)
+    argument = waves * np.radians(lon2) + phase
+    centre = lat0 + amplitude * np.sin(argument)
+    u = speed * np.exp(-((lat2 - centre) / width) ** 2)
+    # the meridional wind follows the slope of the meander
+    slope = amplitude * waves * np.cos(argument) * np.pi / 180.0
+    return u, u * slope
+
+
+# RANDOM: Gaussian random field (seeded) smoothed in the Fourier space to the correlation length (degrees)
+# speed is the standard deviation of each wind component (m/s)
+def getRandomWind(grid, seed=0, speed=20.0, scale=10.0):
+    random_state = np.random.RandomState(seed)
+    noise = random_state.standard_normal((2, grid.dim_lat, grid.dim_lon))
+    k_lat = np.fft.fftfreq(grid.dim_lat, d=grid.dlat)[:, np.newaxis]
+    k_lon = np.fft.fftfreq(grid.dim_lon, d=grid.dlon)[np.newaxis, :]
+    smoothing = np.exp(-2.0 * (np.pi * scale) ** 2 * (k_lat ** 2 + k_lon ** 2))
+    fields = np.real(np.fft.ifft2(np.fft.fft2(noise) * smoothing))
+    fields = fields - fields.mean(axis=(1, 2), keepdims=True)
+    fields = fields / np.maximum(fields.std(axis=(1, 2), keepdims=True), 1e-12) * speed
+    return fields[0], fields[1]
+
+
+# Function returns the wind fields of a scenario, params are passed to the scenario function
+def getScenarioWind(scenario, grid, seed=0, **params):
+    if scenario == "uniform":
+        return getUniformWind(grid, **params)
+    if scenario == "shear":
+        return getShearWind(grid, **params)
+    if scenario == "vortex":
+        return getVortexWind(grid, **params)
+    if scenario == "jet":
+        return getJetStreamWind(grid, **params)
+    if scenario == "random":
+        return getRandomWind(grid, seed, **params)
+    raise ValueError("Invalid wind scenario: {} (choose from {})".format(scenario, WIND_SCENARIOS))
+
+
+class SyntheticWindProvider(object):
+
+    # scenario: one of WIND_SCENARIOS, params are passed to the scenario function
+    # layers: number of vertical layers (None for a single layer)
+    # The fields are generated once and used for every timestep
+    def __init__(self, scenario, grid, seed=0, layers=None, **params):
+        u, v = getScenarioWind(scenario, grid, seed, **params)
+        if layers is not None:
+            u = np.repeat(u[np.newaxis], layers, axis=0)
+            v = np.repeat(v[np.newaxis], layers, axis=0)
+        self.scenario = scenario
+        self.u = u
+        self.v = v
+
+    def getWind(self, n):
+        return self.u, self.v
+
+
+# Function writes the wind fields of a provider for the specified number of timesteps to a NetCDF file
+# The variable names follow the ERA-Interim files (time, level, latitude, longitude, u, v)
+# levels: pressure levels (hPa) of the layers (only for providers with layers)
+def writeWindNetCDF(filename, provider, grid, steps, levels=None, hourly_res=1):
+    from netCDF4 import Dataset
+
+    dataset = Dataset(filename, "w")
+    dataset.description = "Synthetic wind fields of the volcanic ash plume model"
+    dataset.createDimension("time", None)
+    dataset.createDimension("latitude", grid.dim_lat)
+    dataset.createDimension("longitude", grid.dim_lon)
+    dimensions = ("time", "latitude", "longitude")
+    if levels is not None:
+        dataset.createDimension("level", len(levels))
+        level = dataset.createVariable("level", "i4", ("level",))
+        level.units = "millibars"
+        level[:] = levels
+        dimensions = ("time", "level", "latitude", "longitude")
+
+    time = dataset.createVariable("time", "i4", ("time",))
+    time.units = "hours since 2010-04-14 00:00:00"
+    time.calendar = "gregorian"
+    lat = dataset.createVariable("latitude", "f4", ("latitude",))
+    lat.units = "degrees_north"
+    lat[:] = grid.lat
+    lon = dataset.createVariable("longitude", "f4", ("longitude",))
+    lon.units = "degrees_east"
+    lon[:] = grid.lon
+    u = dataset.createVariable("u", "f4", dimensions, zlib=True)
+    u.units = "m s**-1"
+    v = dataset.createVariable("v", "f4", dimensions, zlib=True)
+    v.units = "m s**-1"
+
+    for n in range(steps):
+        u_n, v_n = provider.getWind(n)
+        time[n] = n * hourly_res
+        u[n] = u_n
+        v[n] = v_n
+    dataset.close()
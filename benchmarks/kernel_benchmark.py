@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ashplume.grid import GridGeometry
+from ashplume.transport import getTransportFields, transportStep, diffusionStep, TransportPlan
+from ashplume.operators import SparseTransportOperator
+from ashplume.profiler import getPeakMemory
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: only the peak memory of the process is recorded
+    tracemalloc = None
+
+
+"""
+_____________________________________Kernel Benchmark__________________________________________
+
+Benchmark of the transport-diffusion kernel on the grids of the test mode of the model
+(constant U- and V-wind fields on np.arange(0, 360, degree_res) grids), thus no wind files are required.
+
+Every combination of degree resolution, diffusion type, number of sub-steps and transport backend is run for the
+specified number of wind timesteps. The results (cells per second and memory) are appended as one JSON line per
+combination to the results file together with the commit and the versions of Python and numpy.
+The "sparse" backend assembles the sparse transport operator (see ashplume/operators.py) once per wind timestep and
+applies all sub-steps as one precomputed matrix power (it is skipped for the gradient dependent diffusion).
+If the results file contains results of another commit, the speed-up against that commit is printed.
+
+Usage:
+    python benchmarks/kernel_benchmark.py            (full sweep)
+    python benchmarks/kernel_benchmark.py --quick    (2 degree grid only)
+"""
+
+# Benchmark settings (as in the test mode of the model)
+degree_resolutions = [2, 0.75, 0.25]
+diffusion_types = [0, 1, 2]             # 0 - gradient dependent  1 - all directions  2 - no diffusion
+sub_steps = [1, 6]
+backends = ["shift", "bincount", "sparse"]
+steps = 4                               # wind timesteps per run
+resolution = 80                         # km
+test_u = 25                             # m/s
+test_v = -25                            # m/s
+diffusion_percent = 0.1
+fall_out = 0.99
+eruption = 100.0                        # g/m^3 per wind timestep
+lat_vol = 63.63
+lon_vol = -19.62
+
+results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+
+# Function returns the short hash of the current commit ("unknown" outside of a git repository)
+def getCommit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        return commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Function runs the kernel for one combination of settings and returns the result record
+def runBenchmark(degree_res, diffusion_type, hourly_res, backend):
+    grid = GridGeometry(np.arange(-90, 90.25, degree_res), np.arange(0, 360, degree_res) - 180)
+    u = np.full((grid.dim_lat, grid.dim_lon), float(test_u))
+    v = np.full((grid.dim_lat, grid.dim_lon), float(test_v))
+    vol_index = grid.getIndex(lat_vol, lon_vol)
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    particles = np.zeros((grid.dim_lat, grid.dim_lon))
+    erupted = 0.0
+    fallen_out = 0.0
+    boundary_loss = 0.0
+
+    start = default_timer()
+    for n in range(steps):
+        cells, transport_perc = getTransportFields(u, v, resolution)
+        particles[vol_index] += eruption
+        erupted += eruption
+        fallen_out += particles.sum() * (1 - fall_out)
+        particles *= fall_out
+        if backend == "sparse":
+            operator = SparseTransportOperator(cells, transport_perc, diffusion_percent, diffusion_type,
+                                               ("periodic", "reflective"))
+            particles, loss = operator.apply(particles, hourly_res)
+            boundary_loss += loss
+            continue
+        plan = None if backend == "shift" else TransportPlan(cells, particles.shape, backend)
+        for k in range(hourly_res):
+            temp_arr, loss = transportStep(particles, cells, transport_perc, diffusion_percent, plan=plan)
+            particles, diff_loss = diffusionStep(temp_arr, diffusion_percent, diffusion_type)
+            boundary_loss += loss + diff_loss
+    seconds = default_timer() - start
+
+    traced_peak = None
+    if tracemalloc is not None:
+        traced_peak = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+        tracemalloc.stop()
+
+    kernel_steps = steps * hourly_res
+    return {"degree_res": degree_res,
+            "cells": particles.size,
+            "diffusion_type": diffusion_type,
+            "sub_steps": hourly_res,
+            "backend": backend,
+            "steps": kernel_steps,
+            "seconds": seconds,
+            "cells_per_s": particles.size * kernel_steps / seconds,
+            "traced_peak_mb": traced_peak,
+            "peak_rss_mb": getPeakMemory(),
+            "mass_deviation": erupted - (particles.sum() + fallen_out + boundary_loss)}
+
+
+# Function returns the results of the latest other commit in the results file (settings --> record)
+def getPreviousResults(filename, commit):
+    previous = {}
+    if not os.path.exists(filename):
+        return previous
+    with open(filename, "r") as in_file:
+        records = [json.loads(line) for line in in_file if line.strip() != ""]
+    others = [record for record in records if record["commit"] != commit]
+    if len(others) == 0:
+        return previous
+    latest = others[-1]["commit"]
+    for record in others:
+        if record["commit"] == latest:
+            previous[getKey(record)] = record
+    return previous
+
+
+# Function returns the settings of a result record
+def getKey(record):
+    return (record["degree_res"], record["diffusion_type"], record["sub_steps"], record["backend"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the transport-diffusion kernel")
+    parser.add_argument("--quick", action="store_true", help="only run the 2 degree grid")
+    parser.add_argument("--results", default=results_file, help="JSON lines file for the results")
+    args = parser.parse_args()
+
+    commit = getCommit()
+    previous = getPreviousResults(args.results, commit)
+    environment = {"commit": commit,
+                   "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "machine": platform.machine()}
+
+    print("{:>6}{:>10}{:>6}{:>6}{:>10}{:>14}{:>10}{:>10}".format("deg", "cells", "diff", "sub", "backend",
+                                                                 "cells/s", "MB", "vs prev"))
+    with open(args.results, "a") as out_file:
+        for degree_res in (degree_resolutions[:1] if args.quick else degree_resolutions):
+            for diffusion_type in diffusion_types:
+                for hourly_res in sub_steps:
+                    for backend in backends:
+                        if backend == "sparse" and diffusion_type == 0:
+                            continue
+                        record = runBenchmark(degree_res, diffusion_type, hourly_res, backend)
+                        record.update(environment)
+                        out_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+                        speed_up = ""
+                        if getKey(record) in previous:
+                            speed_up = "{:.2f}x".format(record["cells_per_s"] /
+                                                        previous[getKey(record)]["cells_per_s"])
+                        memory = record["traced_peak_mb"] if record["traced_peak_mb"] is not None \
+                            else record["peak_rss_mb"]
+                        print("{:>6}{:>10}{:>6}{:>6}{:>10}{:>14.0f}{:>10.1f}{:>10}".format(
+                            degree_res, record["cells"], diffusion_type, hourly_res, backend, record["cells_per_s"],
+                            memory, speed_up))
+    print("Results appended to {}.".format(args.results))
+
+
+if __name__ == "__main__":
+    main()
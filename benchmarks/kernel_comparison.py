@@ -0,0 +1,47 @@
+import argparse
+import os
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ashplume.kernels import KERNELS, runKernel
+
+
+"""
+_____________________________________Kernel Comparison__________________________________________
+
+Runs all registered kernels (see ashplume/kernels.py) side by side on identical inputs: the same seeded random
+direction raster (main model encoding) and the same initial particle raster with a source in the middle.
+For every kernel the run time, the processed cells per second and the remaining mass are printed.
+
+Usage:
+    python benchmarks/kernel_comparison.py --size 500 --steps 20
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Side by side comparison of the registered kernels")
+    parser.add_argument("--size", type=int, default=200, help="raster size (square)")
+    parser.add_argument("--steps", type=int, default=20, help="number of timesteps")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the direction raster")
+    args = parser.parse_args()
+
+    direction = np.random.RandomState(args.seed).randint(1, 9, size=(args.size, args.size))
+    initial = np.zeros((args.size, args.size))
+    initial[args.size // 2, args.size // 2] = 1000.0
+
+    print("{:<14}{:>12}{:>14}{:>14}".format("kernel", "seconds", "cells/s", "mass out/in"))
+    for name in sorted(KERNELS):
+        particles = initial.copy()
+        start = default_timer()
+        for n in range(args.steps):
+            particles = runKernel(name, direction, particles)
+        seconds = default_timer() - start
+        print("{:<14}{:>12.4f}{:>14.0f}{:>14.4f}".format(name, seconds, particles.size * args.steps / seconds,
+                                                         particles.sum() / initial.sum()))
+
+
+if __name__ == "__main__":
+    main()
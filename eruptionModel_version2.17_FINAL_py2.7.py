@@ -1,11 +1,31 @@
+import os
 import numpy as np
 from matplotlib import pyplot as plt
 import matplotlib as m
 from matplotlib import ticker, cm
 from netCDF4 import *
-import math
 import matplotlib.colors as mcolors
 from mpl_toolkits.basemap import  Basemap
+from ashplume.grid import GridGeometry, RegionalGrid, CellGeometry
+from ashplume.receptors import ReceptorSet
+from ashplume.sources import SourceTable
+from ashplume.transport import getTransportFields, modelStep, checkBoundary
+from ashplume.transport import TransportPlan, TRANSPORT_BACKENDS
+from ashplume.operators import SparseTransportOperator
+from ashplume.adjoint import SourceSensitivity
+from ashplume.superposition import UnitResponseLibrary
+from ashplume.cache import ResultCache, getCacheKey, getFileHash
+from ashplume.nesting import NestedGrid
+from ashplume.balance import MassBalanceMonitor, getTotal
+from ashplume.profiler import Profiler, NullProfiler
+from ashplume.wind import NetCDFWindProvider, RegriddedWindProvider, getLevelIndices
+from ashplume.regrid import WindRegridder, getTargetGrid, KM_PER_DEGREE, REGRID_METHODS
+from ashplume.windfields import SyntheticWindProvider
+from ashplume.layers import settlingStep
+from ashplume.sizebins import getBinFractions, getStokesFallOut, getFallOutArray
+from ashplume.output import DepositionWriter
+from ashplume.schedule import OutputScheduler
+from ashplume.frames import AnimationWriter, ANIMATION_FORMATS, getFFmpeg
 
 
 """
@@ -41,13 +61,15 @@ MODEL SECTIONS:
 USER INPUTS:
 - Choice of Test or Simulation
 
-- Choice of mode (either predefined Eyjafjallaj%kull or manual inputs)
+- Choice of mode (either predefined Eyjafjallaj%kull, manual inputs or multiple sources)
     Manual inputs will require:
         1) geographic (decimal degrees) location of point source (e.g. volcano)
         2) Plume height (km)
         3) Eruption durance (h)
         4) Tephra mass rate (g/s)
         5) Tephra volume rate (m^3/s)
+    Multiple sources will require:
+        1) Source file ("xy.csv") with location, start timestep and concentration of each timestep per source
 
 - Choice simulation (own wind fields) or test (fixed wind fields)
 
@@ -66,6 +88,7 @@ USER INPUTS:
         6) test-wind field (u- and v-components, only in test case!)
         7) fall_out (1 - percent)
         8) File-Names ("xy.nc", only in simulation case!)
+        9) Receptor file ("xy.csv", optional)
         
 PREREQUISITES:
 In order to be able to save the plots automatically you should create the following folders
@@ -73,6 +96,8 @@ in your Model.py-directory:
     1) Folder "WorldMap"
     2) Folder "EuropeZoom"
     3) Folder "EuropeFlyzone"
+    4) Folder "Receptors" (only if a receptor file is specified)
+    5) Folder "Deposition"
 
 
 DYNAMICS:
@@ -112,6 +137,8 @@ Parameters to specify are:
     - temporal resolution (in h)
  3) Wind speed of U- and V-wind components
     - has only influence in test run
+    - test_wind: synthetic wind scenario of the test run ("uniform" uses test_u and test_v, "shear", "vortex",
+      "jet" or "random"), test_seed: seed of the random scenario
  4) Amount of Fall-out (1 - percent)
  5) Diffusion Type
     - 0 for gradient dependent
@@ -120,6 +147,103 @@ Parameters to specify are:
  6) Diffusion Percentage
  7) Plot extent (for Zoom-Plot)
     - lon_eu1, lon_eu2, lat_eu1, lat_eu2
+ 8) Point receptors (e.g. airports)
+    - CSV file with one "name,latitude,longitude" line per receptor (first line is a header)
+    - the concentration time series of all receptors is written to "Receptors/ReceptorSeries.csv"
+ 9) Source file (only required for multiple sources mode)
+    - CSV file with one "name,latitude,longitude,start,rates" line per source (first line is a header)
+    - start is the first eruption timestep, rates are the erupted concentrations (g/m^3) of each timestep
+      separated by spaces (e.g. "Hekla,63.98,-19.70,6,0.5 0.5 0.25")
+    - optionally followed by ",heights" with the plume heights (km) of each timestep (only used in 3D mode)
+ 10) Vertical layers (3D mode)
+    - layers_3d: True for several flight-level layers, False for the single level model
+    - layer_levels: pressure levels (hPa) of the wind file used for the layers (only in simulation case)
+    - layer_tops: altitude (km) of the top of each layer (the plume height distributes the emission)
+    - settling_perc: percentage of particles settling to the next lower layer in each timestep
+ 11) Particle size bins
+    - bin_fractions: grain-size distribution (fraction of the erupted concentration in each bin)
+    - bin_diameters: mean particle diameter of each bin (micrometers), only required to derive the fall-out
+    - bin_fall_out: fall-out of each bin (1 - percent), empty to derive it from the settling velocity
+    - cloud_depth: depth of the ash cloud (km), used to derive the fall-out of the bins
+ 12) Ground deposition
+    - deposition_file: NetCDF file to which the accumulated deposition field is written after every fall-out
+      (e.g. "Deposition/GroundDeposition.nc"), the map of the deposition is plotted next to this file
+ 13) Boundary conditions
+    - boundary_lon: "periodic" for global grids (mass leaving at 180 degrees enters at -180 degrees) or "open"
+    - boundary_lat: "reflective" or "absorbing" at the poles, "open" for regional domains
+    - mass leaving the domain (absorbing / open boundaries) is considered in the mass balance
+ 14) Transport kernel
+    - transport_engine: "kernel" (transport-diffusion kernel) or "sparse" (sparse matrix operator per wind field,
+      requires scipy and diffusion type 1 or no diffusion)
+    - transport_backend: "bincount" or "add.at" (scatter-add of the transported mass) or "shift" (masked shifts)
+    - strict_mass_balance: if True the mass balance is checked after every timestep (stops at the first violation)
+ 15) Mass balance records
+    - mass_balance_file: CSV or JSON file for the mass balance of every timestep (empty string for no file)
+    - mass_balance_capacity: number of timesteps kept in memory (the latest timesteps are written)
+    - mass_balance_tolerance: relative tolerance of the strict mass balance check
+    - mass_balance_interval: number of timesteps between the checks of the measured airborne mass outside the
+      strict mode (drift column of the records), 0 for no checks
+ 16) Profiling
+    - profile_file: JSON file for the run time of each model phase, the cell counters and the peak memory
+      (a summary table is printed at the end of the model run), empty string to disable the profiling
+ 17) Adjoint mode (source-receptor sensitivity)
+    - adjoint_mode: if True the sensitivity of every receptor to the emission of every source and timestep is
+      calculated in one backward run (requires receptors, scipy and diffusion type 1 or no diffusion, no 3D mode)
+    - adjoint_step: target timestep of the receptors (sub-steps since the start of the run), -1 for the end of the run
+    - the sensitivities are written to "Receptors/SourceSensitivity.csv"
+ 18) Linear superposition (unit responses)
+    - response_library: compressed NumPy file (.npz) with the unit responses of all emission timesteps and sources,
+      empty string to run the model loop as usual
+    - if the library exists and was created with the same settings (everything except the emission rates, the
+      content of the wind files), the results at the end of the run are synthesized from the unit responses without
+      running the model loop, otherwise the unit responses are simulated once and saved
+    - only the results at the end of the run are available: one frame per plot, one receptor value per receptor and
+      one deposition record (no intermediate frames, time series or animations)
+    - response_batch_size: number of unit pulses which are simulated together
+    - requires diffusion type 1 or no diffusion, not available in 3D mode, only the final frame is plotted
+ 19) Result cache
+    - cache_dir: directory for the results of previous model runs (final state, frames, deposition and mass balance),
+      empty string for no cache
+    - the results are identified by a hash of all inputs (content of the wind files, settings and source terms),
+      a rerun with identical inputs loads the results instead of running the model loop
+    - cache_size: maximum size of the cache (MB), the least recently used results are removed
+ 20) Regional domain
+    - regional_domain: if True only the zoom plot extent (lat_eu1 - lat_eu2, lon_eu1 - lon_eu2) plus a margin is
+      modelled, only this hyperslab of the wind files is read (the region must not cross the date line)
+    - regional_margin: margin around the zoom plot extent (degrees)
+    - the boundaries of the region are open, the mass leaving the region is considered in the mass balance
+ 21) Nested grid
+    - nested_grid: if True a fine grid around the volcano is embedded in the model grid (two-way nesting with
+      conservative mass exchange, wind interpolated from the model grid)
+    - nest_size: number of model grid cells (rows and columns) covered by the nest
+    - nest_refinement: number of fine cells per model grid cell in each direction (at least 2), the nest runs
+      nest_refinement fine timesteps per timestep
+    - nest_moving: if True the nest follows the centre of mass of the plume
+    - nest_file: compressed NumPy file (.npz) for the fine fields of every frame, empty string for no file
+    - not available with size bins, in 3D mode, with the superposition and with the adjoint mode
+ 22) Regridding of the wind fields
+    - regrid_method: "bilinear" or "conservative" (area weighted mean of the overlapping cells) resampling of the
+      wind fields to a regular model grid, empty string for the grid of the wind files
+    - regrid_degree_res: degree resolution of the model grid, 0 for the degree resolution of the model resolution
+      (resolution / 111.195 km), thus the resolution of the wind files does not have to match the model resolution
+    - regrid_cache_dir: directory for the regridding weights (calculated once for every pair of grids)
+    - only for the simulation (the synthetic wind fields of the test case are created on the model grid)
+ 23) Cell geometry
+    - latitude_geometry: if True only the distances between the cells are corrected (the east-west size shrinks
+      with the cosine of the latitude, the model resolution is the north-south size): transport percentages relative
+      to the distance to the transport receiving cell and gradients per km in the gradient dependent diffusion (the
+      diffusion part is then distributed in proportion to the gradients instead of equally)
+    - the areas of the cells are not considered (concentrations are moved, emitted and summed up as without it)
+    - not available with the nested grid
+ 24) Output schedule
+    - output_schedule: frames of every plot product, "all", "every k" (every k-th frame), "max k" or "mean k"
+      (maximum or mean of every cell over windows of k frames, e.g. "max 24" for the daily maximum with hourly frames)
+    - the maxima and means are calculated during the model run, only the plotted frames are kept
+ 25) Animations
+    - animation_format: "gif" or "mp4" (requires ffmpeg) animation of every plot product, assembled directly from
+      the rendered figures (e.g. "WorldMap/WorldMap.gif"), empty string for no animations
+    - animation_fps: frames per second of the animations
+    - frame_images: if False the frames are not saved as PNG images (animations only)
 
 """
 # Parameters which can be specified__________________________________________________________________________________
@@ -136,6 +260,10 @@ hourly_res = 1
 # Wind speed of U-wind and V-wind components (in m/s)
 test_u = 25
 test_v = -25
+# Synthetic wind scenario of the test case: "uniform" (test_u / test_v), "shear", "vortex", "jet" or "random"
+test_wind = "uniform"
+# Seed of the random wind scenario
+test_seed = 0
 
 # 1/24 reasons in the fact that fine ash can persist for several days in the air.
 # We assumed here that it can stay several days (assumption here: 6 days) in the air without major fallout.
@@ -165,6 +293,130 @@ lat_eu2 = 81
 lon_eu1 = -41
 lon_eu2 = 41
 
+# POINT RECEPTORS
+# CSV file with the receptor locations (e.g. "airports.csv"), empty string for no receptors
+receptor_file = ""
+
+# MULTIPLE SOURCES (only required for mode 3)
+# CSV file with the eruption sources (e.g. "iceland_sources.csv")
+source_file = ""
+
+# VERTICAL LAYERS (3D mode)
+# If True the model is run with one layer per pressure level (wind files with a level dimension are required)
+layers_3d = False
+# Pressure levels (hPa) used as layers, from the lowest to the highest layer (only required for simulation)
+layer_levels = [850, 700, 500, 300]
+# Altitude of the top of each layer (km), e.g. approx. FL050, FL100, FL180 and FL300
+layer_tops = [1.5, 3.0, 5.5, 9.0]
+# Percentage of particles settling to the next lower layer in each timestep
+settling_perc = 0.02
+
+# PARTICLE SIZE BINS
+# Fraction of the erupted concentration in each size bin (grain-size distribution), empty list for one single bin
+bin_fractions = []
+# Mean particle diameter of each size bin (micrometers)
+bin_diameters = [4, 16, 32, 63]
+# Fall-out of each size bin (1 - percent), empty list to derive it from the settling velocity (Stokes' law)
+bin_fall_out = []
+# Depth of the ash cloud (km), only used to derive the fall-out of the size bins
+cloud_depth = 5
+
+# GROUND DEPOSITION
+# NetCDF file for the accumulated ground deposition (fall-out) field, empty string for no file
+deposition_file = ""
+
+# BOUNDARY CONDITIONS
+# Longitude: "periodic" (global grids) or "open" (regional domains)
+boundary_lon = "periodic"
+# Latitude: "reflective" or "absorbing" (poles), "open" (regional domains)
+boundary_lat = "reflective"
+
+# TRANSPORT KERNEL
+# "kernel" (transport-diffusion kernel) or "sparse" (sparse matrix operator assembled once per wind field, requires
+# scipy and diffusion type 1 or no diffusion)
+transport_engine = "kernel"
+# "bincount" / "add.at" (scatter-add with a transport plan per wind field) or "shift" (masked shifts)
+transport_backend = "bincount"
+# If True the mass balance is checked after every timestep (float64 totals), a violation stops the model run
+strict_mass_balance = False
+
+# MASS BALANCE RECORDS
+# CSV or JSON file (according to the file extension) for the mass balance of every timestep, empty string for no file
+mass_balance_file = ""
+# Number of timesteps which are kept in memory
+mass_balance_capacity = 1000
+# Relative tolerance of the strict mass balance check
+mass_balance_tolerance = 1e-9
+# Number of timesteps between the checks of the measured airborne mass (outside the strict mode), 0 for no checks
+mass_balance_interval = 0
+
+# PROFILING
+# JSON file for the profile of the model run (run time of each phase, cells, peak memory), empty string for no profiling
+profile_file = ""
+
+# ADJOINT MODE
+# If True the source-receptor sensitivity of every receptor is calculated in one backward run after the model run
+# (requires a receptor file, scipy and diffusion type 1 or no diffusion, not available in 3D mode)
+adjoint_mode = False
+# Target timestep of the receptors (number of timesteps since the start of the model run), -1 for the end of the run
+adjoint_step = -1
+
+# LINEAR SUPERPOSITION
+# Compressed NumPy file (.npz) with the unit responses of the emission timesteps, empty string for a normal model run
+# (requires diffusion type 1 or no diffusion, not available in 3D mode)
+response_library = ""
+# Number of unit pulses which are simulated together when the library is built
+response_batch_size = 24
+
+# RESULT CACHE
+# Directory for the results of previous model runs with identical inputs, empty string for no cache
+cache_dir = ""
+# Maximum size of the result cache (MB), the least recently used results are removed
+cache_size = 1024
+
+# REGIONAL DOMAIN
+# If True only the zoom plot extent plus the margin is modelled (open boundaries, the outflow is considered in the
+# mass balance), e.g. about 10 times fewer cells for Europe
+regional_domain = False
+# Margin around the zoom plot extent (degrees)
+regional_margin = 10
+
+# NESTED GRID
+# If True a fine grid around the volcano is embedded in the model grid (two-way nesting)
+nested_grid = False
+# Number of model grid cells (rows and columns) covered by the nest
+nest_size = 9
+# Number of fine cells per model grid cell in each direction (at least 2)
+nest_refinement = 3
+# If True the nest follows the centre of mass of the plume
+nest_moving = False
+# Compressed NumPy file (.npz) for the fine fields of the nest, empty string for no file
+nest_file = ""
+
+# REGRIDDING
+# Resampling of the wind fields to the model grid: "bilinear", "conservative" or empty string for no regridding
+regrid_method = ""
+# Degree resolution of the model grid, 0 for the degree resolution of the model resolution
+regrid_degree_res = 0
+# Directory for the regridding weights (calculated once for every pair of grids)
+regrid_cache_dir = "Regridding"
+
+# CELL GEOMETRY
+# If True the latitude dependent distances between the cells are used instead of square cells of the model resolution
+latitude_geometry = False
+
+# OUTPUT SCHEDULE
+# Frames of every plot product: "all", "every k" (every k-th frame), "max k" or "mean k" (windows of k frames)
+output_schedule = {"WorldMap": "all", "EuropeZoom": "all", "EuropeFlyzone": "all"}
+
+# ANIMATIONS
+# Animation of every plot product: "gif", "mp4" (requires ffmpeg) or empty string for no animations
+animation_format = ""
+# Frames per second of the animations
+animation_fps = 4
+# If False the frames are not saved as PNG images (animations only)
+frame_images = True
+
 """
 ----------------------------------------------------------------------------------------------------------------
 ----------------------------------------------------------------------------------------------------------------
@@ -217,27 +469,26 @@ def printVariables(list):
         i += 1
     print(string)
 
-# Function which specifies if own scenario or Eyjafjallaj%kull scenario is run
+# Function which specifies if own scenario, Eyjafjallaj%kull scenario or multiple sources scenario is run
+# returns the number of the mode
 def chooseMode():
     print("Mode description: \n"
           + "1 manual inputs \n"
-          + "2 Eyjafjallajökull 2010 scenario")
+          + "2 Eyjafjallajökull 2010 scenario \n"
+          + "3 multiple sources (source file)")
     mode = 0
-    while mode <= 0 or mode >= 3:
+    while mode <= 0 or mode >= 4:
         try:
             mode = int(input("Please chose mode:"))
-            if mode <= 0 or mode >= 3:
+            if mode <= 0 or mode >= 4:
                 raise AttributeError("Invalid choice!")
         except (AttributeError, NameError) as e:
             print("Invalid choice!")
             continue
-    if mode == 1:
-        return True
-    else:
-        return False
+    return mode
 
 # Function which asks the user for eruption specific parameters
-# returns an array with concentration value and durance
+# returns an array with location, concentration value, durance and plume height (km)
 def getManualConcentration():
     print("")
     print("Mode 1: Manual mode")
@@ -340,10 +591,10 @@ def getManualConcentration():
     print("")
     print("Eruption parametrisation complete.")
 
-    return [lat_vol, lon_vol, concentration, durance]
+    return [lat_vol, lon_vol, concentration, durance, height / 1000.0]
 
 # Function creates concentration specific to the 2010 Eyjafjallaj%kull eruption event
-# returns concentration
+# returns concentration and plume height (km)
 def getEyjafjallaConcentration():
     # here the specific characteristics of the Eyjafjallajökull eruption are specified.
     print("")
@@ -399,7 +650,19 @@ def getEyjafjallaConcentration():
     print("")
     print("Eyjafjallajökull 2010 eruption parametrisation complete.")
 
-    return concentration
+    return [concentration, height]
+
+# Function returns the particle raster (rows, cols) which is stored for the plots and receptors
+# Size bins are summed up, in 3D mode the maximum concentration of all layers is used
+# With a nested grid the cells of the nest contain the mean of their fine cells
+def getFrame(particles):
+    if nest is not None:
+        particles = nest.getComposite(particles)
+    if size_bins:
+        particles = particles.sum(axis=0)
+    if layers_3d:
+        particles = particles.max(axis=0)
+    return particles
 
 # PLOT LABEL STRING FUNCTIONS
 # Function creates the title string
@@ -414,6 +677,10 @@ def getTitleString(test, simulation, manual, eyjafjalla):
         title_string = "Manual Characteristics"  # Todo: Add time and date of wind_data
     if manual and test:
         title_string = "Manual Characteristics Test"
+    if not manual and not eyjafjalla:
+        title_string = "Multiple Sources"
+        if test:
+            title_string += " Test"
 
     return title_string
 
@@ -436,6 +703,23 @@ def getResolutionString(resolution, hourly_res):
     return "Spatial Resolution: " + str(resolution) + " km" + "\n" + "Temporal Resolution: " + str(
         hourly_res) + " h"
 
+# Function creates the Time string of a plotted frame
+# takes the product and the (first, last) frame number of the frame (see ashplume/schedule.py)
+def getTimeString(product, window):
+    n = window[1]
+    if n == 0:
+        time_string = "Initialisation"
+    elif test:
+        time_string = "Timestep: " + "+ " + str(timesteps[n - 1] + 1) + " h"
+    elif hourly_res == 1:
+        time_string = str(time_converted[n - 1])
+    else:
+        time_string = str(time_converted[(n - 1) // hourly_res]) + " + " + str((n - 1) % hourly_res) + " h"
+    label = scheduler.getLabel(product, window)
+    if label != "":
+        time_string = label + " until " + time_string
+    return time_string
+
 
 ''' 
 ___________________________Third Section - Initialisation of wind field related data_________________________
@@ -480,7 +764,7 @@ if simulation:
 
     # INITIALISATION
     executable = False
-    which_failed = [0, 0, 0, 0, 0]
+    which_failed = [0, 0, 0, 0, 0, 0]
     fail = 0
     while not executable:
         if fail == 1:
@@ -514,6 +798,9 @@ if simulation:
             if which_failed[4] == 0:
                 v_key = str(keys_v[int(input("V-wind component-Key:"))])
                 # v_key = "v"
+            if layers_3d and which_failed[5] == 0:
+                level_key = str(keys_u[int(input("Pressure level-Key:"))])
+                # level_key = "level"
 
             # Processing LONGITUDE and LATITUDE
             lon1 = u_windFile.variables[lon_key]
@@ -530,12 +817,18 @@ if simulation:
                 raise AttributeError("Wrong variable choice!")
             which_failed[1] = 1
 
-            # Correction for longitude (degree east --> 0-360 to -180-180)
-            lon = np.array(u_windFile.variables[lon_key])
-            lon = lon - 180
-            lat = np.array(u_windFile.variables[lat_key])
-            dim_lon = len(lon)
-            dim_lat = len(lat)
+            # Grid geometry of the wind data
+            # Longitudes are converted to -180-180 and latitudes to increasing order (see ashplume/grid.py)
+            # ATTENTION: the wind fields have to be converted with grid.toModelField as well!
+            grid = GridGeometry(np.array(u_windFile.variables[lat_key]), np.array(u_windFile.variables[lon_key]))
+            # Regional domain: only the hyperslab of the region is read from the wind files
+            if regional_domain:
+                grid = RegionalGrid(grid, lat_eu1 - regional_margin, lat_eu2 + regional_margin,
+                                    lon_eu1 - regional_margin, lon_eu2 + regional_margin)
+            lon = grid.lon
+            lat = grid.lat
+            dim_lon = grid.dim_lon
+            dim_lat = grid.dim_lat
 
             # Processing TIME
             time_u = u_windFile.variables[time_key]
@@ -571,6 +864,37 @@ if simulation:
                 raise AttributeError("Wrong variable choice!")
             which_failed[4] = 1
 
+            # Retrieving the PRESSURE LEVELS of the layers (3D mode)
+            level_indices = None
+            if layers_3d:
+                level_values = u_windFile.variables[level_key][:]
+                if len(u_wind.shape) != 4:
+                    print("")
+                    print("The wind components have no pressure levels!")
+                    raise AttributeError("Wrong variable choice!")
+                try:
+                    level_indices = getLevelIndices(level_values, layer_levels)
+                except ValueError as e:
+                    print("")
+                    print(e)
+                    raise AttributeError("Wrong variable choice!")
+                which_failed[5] = 1
+
+            # Wind provider: returns the wind fields of each timestep in the orientation of the model grid
+            wind = NetCDFWindProvider(u_wind, v_wind, grid, level_indices)
+            # Regridding: the wind fields are resampled to the model grid (weights cached in regrid_cache_dir)
+            if regrid_method != "":
+                source_grid = grid
+                grid = getTargetGrid(source_grid, regrid_degree_res if regrid_degree_res > 0 else
+                                     resolution / KM_PER_DEGREE)
+                wind = RegriddedWindProvider(wind, WindRegridder(source_grid, grid, regrid_method, regrid_cache_dir))
+                lon = grid.lon
+                lat = grid.lat
+                dim_lon = grid.dim_lon
+                dim_lat = grid.dim_lat
+                print("Wind fields regridded ({}) from {} x {} to {} x {} cells.".format(
+                    regrid_method, source_grid.dim_lat, source_grid.dim_lon, dim_lat, dim_lon))
+
             # Statement is reached only if all statements are fulfilled!
             executable = True
 
@@ -624,7 +948,7 @@ if simulation:
 
 
 # Wind-field, Longitude, Latitude and Time initialization for the TEST-CASE!
-# Creates an artificial wind field of constant U-wind and V-wind components.
+# Creates an artificial wind field (constant U-wind and V-wind components or another synthetic wind scenario).
 # Dimensions are set according to initially specified degrees resolution.
 # Time is initialized in one-hourly resolution (10 timesteps = 10 hours).
 if test:
@@ -633,19 +957,21 @@ if test:
     print("________")
     print("")
     # Create Coordinate variables
-    lon = np.arange(0, 360, degree_res) - 180
-    lat = np.arange(-90,90.25, degree_res)
-    dim_lon = len(lon)
-    dim_lat = len(lat)
-
-    # Create wind fields
-    # U wind / V wind
-    u_test = np.ones((dim_lat, dim_lon))
-    v_test = np.ones((dim_lat, dim_lon))
-    # Specification of U-wind and V-wind components
-    u_test[u_test == 1] = test_u
-    v_test[v_test == 1] = test_v
-    # TODO: assign here to u_wind and v_wind if necessary
+    grid = GridGeometry(np.arange(-90, 90.25, degree_res), np.arange(0, 360, degree_res) - 180)
+    # Regional domain: the synthetic wind fields are created for the region only
+    if regional_domain:
+        grid = RegionalGrid(grid, lat_eu1 - regional_margin, lat_eu2 + regional_margin,
+                            lon_eu1 - regional_margin, lon_eu2 + regional_margin)
+    lon = grid.lon
+    lat = grid.lat
+    dim_lon = grid.dim_lon
+    dim_lat = grid.dim_lat
+
+    # Create wind fields of the synthetic wind scenario
+    # "uniform": U-wind and V-wind components of test_u and test_v in every cell
+    # The same wind field is used for every timestep (and every layer in 3D mode)
+    wind_params = {"u": test_u, "v": test_v} if test_wind == "uniform" else {}
+    wind = SyntheticWindProvider(test_wind, grid, test_seed, len(layer_tops) if layers_3d else None, **wind_params)
 
     # Test hourly resolution
     hourly_res = 1
@@ -693,14 +1019,26 @@ In this second section the eruption related parameters are initialised.
         - tephra mass rate (Gudmundsson et al. 2012)
         - tephra volume rate (Gudmundsson et al. 2012)
     
+ Choice 3: Multiple sources
+    All sources of the source file erupt simultaneously, each with its own location, start timestep and
+    concentration series (e.g. regional scenarios with several volcanic systems).
+
+ All modes are stored in a source table (see ashplume/sources.py). Before the modelling process starts the table
+ is converted to index arrays and a (time x source) emission matrix.
+    
 ATTENTION:
-The plume height has no influence in this model! It is initialised for the eventually future introduction of
-new modelling features.
+The plume height has only influence in the 3D mode (layers_3d)! There it distributes the erupted concentration
+to the vertical layers.
 """
 
 # Specify the Mode
-manual = chooseMode()
-eyjafjalla = not manual
+mode = chooseMode()
+manual = mode == 1
+eyjafjalla = mode == 2
+multiple_sources = mode == 3
+
+# Table of all eruption sources
+sources = SourceTable()
 
 if manual:
     # Calls the Manual input auxiliary function
@@ -709,14 +1047,33 @@ if manual:
     lon_vol = manualParameters[1]
     concentration = manualParameters[2]
     durance = manualParameters[3]
+    height = manualParameters[4]
+    # constant concentration for the whole eruption durance
+    sources.addSource("Manual", lat_vol, lon_vol, np.repeat(concentration, durance), 0, height)
 
 
 if eyjafjalla:
     # Calls the Eyjafjallajökull concentration auxiliary function
-    concentration = getEyjafjallaConcentration()
+    eyjafjallaParameters = getEyjafjallaConcentration()
+    concentration = eyjafjallaParameters[0]
+    height = eyjafjallaParameters[1]
     # LONGITUDE AND LATITUDE
     lon_vol = -19.625
     lat_vol = 63.625
+    sources.addSource("Eyjafjallajoekull", lat_vol, lon_vol, concentration, 0, height)
+
+
+if multiple_sources:
+    print("")
+    print("Mode 3: Multiple sources")
+    print("________________________")
+    sources.loadCSV(source_file)
+    if len(sources.names) == 0:
+        raise AttributeError("The source file does not contain any source!")
+    # The first source is used as centre of the world map
+    lon_vol = sources.lons[0]
+    lat_vol = sources.lats[0]
+    print("{} sources loaded from {}.".format(len(sources.names), source_file))
 
 
 """ 
@@ -737,6 +1094,14 @@ For the diffusion we implemented two options:
         direction of the lower concentrations).
     
     NOTE: The diffusion is run AFTER the transport of every cell is completed.
+    
+Transport and diffusion of all cells are processed together by the vectorized transport-diffusion kernel
+(see ashplume/transport.py).
+
+BOUNDARIES:
+The kernel works on a particle raster with a halo of one cell, which is folded back into the domain according to
+the boundary conditions (periodic longitude, reflective / absorbing poles, open regional boundaries).
+Mass leaving the domain is summed up and considered in the mass balance, no mass is dropped silently at the edges.
         
 
 PARTICULARITIES:
@@ -744,100 +1109,315 @@ We tried to account for the different hourly resolutions.
 If the temporal wind-field resolution is x > 1 hour the model loop will run x-times until a new wind-field is loaded.
 The same holds for fall_out and eruption input.
 
-"""
+3D MODE:
+In the 3D mode the particle raster has the shape (layers, rows, cols). Every layer is transported with the wind
+of its own pressure level. All layers are processed together by the vectorized transport-diffusion kernel,
+thus K layers cost about one vectorized pass. After the fall-out a constant percentage
+of each layer settles to the next lower layer (see ashplume/layers.py).
+The plots and receptors show the maximum concentration of all layers.
 
-# Get the closest coordinates with respect to specified longitude and latitude values
-lat_pos = lat[np.where(abs(lat - lat_vol) == min(abs(lat - lat_vol)))][0]
-lon_pos = lon[np.where(abs(lon - lon_vol) == min(abs(lon - lon_vol)))][0]
-# Get index of closest longitude and latitude values
-lat_index = int(np.where(lat == lat_pos)[0])
-lon_index = int(np.where(lon == lon_pos)[0])
+SIZE BINS:
+With particle size bins the erupted concentration is split according to the grain-size distribution. All bins are
+stored in one particle raster (bins, [layers,] rows, cols) and share the same transport fields of the wind, only
+the fall-out differs between the bins. The fall-out (deposition) is summed up per bin.
 
-# Zero-Raster for storage of particle concentration during the modelling
-particles = np.zeros((dim_lat, dim_lon,))
+GROUND DEPOSITION:
+The fall-out of every cell is accumulated in place in a deposition raster ([bins,] rows, cols). The total fall-out
+of the mass balance is the sum of this raster. The deposition raster is written to a NetCDF file after every fall-out
+and plotted at the end of the model run.
 
-# Calculating Distance for diagonal transport (with cosine of 45 degrees)
-resolution_extended = resolution / math.cos(0.785398)
+"""
 
-# Defining the row and col numbers
-rows = dim_lat
-cols = dim_lon
+# Particle size bins: fraction and fall-out of every bin
+size_bins = len(bin_fractions) > 0
+if size_bins:
+    bin_fractions = getBinFractions(bin_fractions)
+    if len(bin_fall_out) == 0:
+        if len(bin_diameters) != len(bin_fractions):
+            raise AttributeError("bin_fractions and bin_diameters need the same number of bins to derive the fall-out!")
+        bin_fall_out = getStokesFallOut(bin_diameters, hourly_res, cloud_depth)
+    if len(bin_fall_out) != len(bin_fractions):
+        raise AttributeError("bin_fractions and bin_fall_out need the same number of bins!")
+    # with an explicit fall-out the diameters only label the bins (unknown diameters without a matching list)
+    if len(bin_diameters) != len(bin_fractions):
+        bin_diameters = [float("nan")] * len(bin_fractions)
+    bin_labels = ["bin {}".format(b + 1) if np.isnan(diameter) else "{} micrometers".format(diameter)
+                  for b, diameter in enumerate(bin_diameters)]
+    bin_fall_out_array = getFallOutArray(bin_fall_out, layers_3d)
+    print("")
+    print("Size bins (fraction / fall-out):")
+    for b in range(len(bin_fractions)):
+        print("{}: {} / {}".format(bin_labels[b], bin_fractions[b], bin_fall_out[b]))
+
+# Boundary conditions of the transport-diffusion kernel (longitude, latitude)
+boundary = (boundary_lon, boundary_lat)
+if regional_domain:
+    # the mass leaving the region is considered in the mass balance
+    boundary = ("open", "open")
+checkBoundary(boundary)
+if transport_backend not in TRANSPORT_BACKENDS:
+    raise ValueError("Invalid transport backend: {} (choose from {})".format(transport_backend, TRANSPORT_BACKENDS))
+if animation_format != "" and animation_format not in ANIMATION_FORMATS:
+    raise ValueError("Invalid animation format: {} (choose from {})".format(animation_format, ANIMATION_FORMATS))
+if animation_format == "mp4" and getFFmpeg() is None:
+    raise ValueError("MP4 animations require ffmpeg (not found)!")
+if regrid_method != "" and regrid_method not in REGRID_METHODS:
+    raise ValueError("Invalid regridding method: {} (choose from {})".format(regrid_method, REGRID_METHODS))
+if transport_engine not in ("kernel", "sparse"):
+    raise ValueError("Invalid transport engine: {} (choose from kernel, sparse)".format(transport_engine))
+if transport_engine == "sparse" and diffusion_type == 0:
+    raise ValueError("The sparse transport engine does not support the gradient dependent diffusion (type 0)!")
+if adjoint_mode:
+    if receptor_file == "":
+        raise ValueError("The adjoint mode requires a receptor file!")
+    if diffusion_type == 0 or layers_3d:
+        raise ValueError("The adjoint mode does not support the gradient dependent diffusion (type 0) and the 3D mode!")
+superposition = response_library != ""
+if nested_grid and (layers_3d or len(bin_fractions) > 0 or superposition or adjoint_mode or latitude_geometry):
+    raise ValueError("The nested grid is not available with size bins, in 3D mode, with the superposition, with the "
+                     "adjoint mode and with the latitude dependent cell geometry!")
+if superposition and (diffusion_type == 0 or layers_3d):
+    raise ValueError("The superposition does not support the gradient dependent diffusion (type 0) and the 3D mode!")
+
+# Diffusion percentage (Consider: could be adjusted to the wind speed)
+diff_perc = diffusion_percent
+
+# Zero-Raster for storage of particle concentration during the modelling
+# shape: ([bins,] [layers,] rows, cols)
+particle_shape = (dim_lat, dim_lon)
+if layers_3d:
+    particle_shape = (len(layer_tops),) + particle_shape
+if size_bins:
+    particle_shape = (len(bin_fractions),) + particle_shape
+particles = np.zeros(particle_shape)
 
 # Creates an array with integer values from the start to the (end - 1) value
 timesteps = np.arange(start, end, 1)
 
-# Empty list to store particles values of each timestep
-# Used for plotting all frames in the end of the model run
-figures = []
-# Variable to sum up all fall_out
-sum_fallout = 0
+# Distances of the cells of every row (dx, dy and diagonal), None for square cells of the model resolution
+geometry = CellGeometry(grid, resolution) if latitude_geometry else None
+
+# Index arrays (closest cells) and (time x source) emission matrix of all sources
+# In 3D mode the emission is distributed to the layers according to the plume height,
+# with size bins according to the grain-size distribution
+sources.build(grid, len(timesteps), layer_tops if layers_3d else None, bin_fractions if size_bins else None)
+if not np.all(grid.contains(sources.lats, sources.lons)):
+    raise ValueError("All eruption sources have to lie within the model domain!")
+
+# Nested fine grid around the volcano (two-way nesting, see ashplume/nesting.py)
+nest = None
+if nested_grid:
+    nest = NestedGrid(grid, lat_vol, lon_vol, nest_size, nest_refinement, nest_moving)
+
+# Frames of the plot products (particle raster of each timestep, thinned or aggregated, see ashplume/schedule.py)
+# Used for plotting the frames in the end of the model run
+scheduler = OutputScheduler(output_schedule)
+
+# Raster to accumulate the fall-out of every cell (ground deposition), one raster per size bin
+deposition = np.zeros(particle_shape[:-3] + particle_shape[-2:] if layers_3d else particle_shape)
+deposition_writer = None
+if deposition_file != "":
+    deposition_writer = DepositionWriter(deposition_file, grid, bin_diameters if size_bins else None)
 
 # Variable to sum up total erupted material
-eruption_sum = 0
+eruption_sum = 0.0
+# Variable to sum up the material leaving the domain through open boundaries
+boundary_loss = 0.0
+
+# Profiler of the model phases (does nothing without a profile file)
+profiler = Profiler() if profile_file != "" else NullProfiler()
+
+# Mass balance of every timestep (running totals, checked after every timestep in the strict mode)
+mass_balance = MassBalanceMonitor(mass_balance_capacity, strict_mass_balance, mass_balance_tolerance,
+                                  mass_balance_interval)
+
+# Point receptors: interpolation weights are calculated once, every frame is sampled afterwards
+receptors = None
+if receptor_file != "":
+    receptors = ReceptorSet()
+    receptors.loadCSV(receptor_file)
+    receptors.build(grid)
+    print("{} receptors loaded from {}.".format(len(receptors.names), receptor_file))
+
+# Target timestep of the adjoint mode and the receptor concentrations of the model run at the target timestep
+adjoint_target = len(timesteps) * hourly_res if adjoint_step == -1 else adjoint_step
+adjoint_forward = None
+if adjoint_mode and (adjoint_target < 0 or adjoint_target > len(timesteps) * hourly_res):
+    raise ValueError("Invalid target timestep of the adjoint mode: {}".format(adjoint_step))
 
 print("")
 raw_input("Press enter to initiate the modeling process...")
 print("")
-print("Modeling process initiated, going through {} iterations.".format(len(timesteps)*hourly_res))
+
+# Settings of the model run which determine the results (except the emission rates)
+# used to identify the unit responses of the superposition and the cached results
+run_settings = {"wind": [u_windfile, v_windfile] if simulation else [test_wind, test_u, test_v, test_seed],
+                "grid": [float(grid.lat[0]), float(grid.lon[0]), grid.dim_lat, grid.dim_lon],
+                "timesteps": [int(timesteps[0]), len(timesteps)], "hourly_res": hourly_res,
+                "resolution": resolution, "diffusion": [diffusion_type, diff_perc],
+                "fall_out": np.ravel(bin_fall_out_array if size_bins else fall_out).tolist(),
+                "layers": [layer_tops, settling_perc] if layers_3d else None,
+                "nest": [nest_size, nest_refinement, nest_moving, lat_vol, lon_vol] if nested_grid else None,
+                "boundary": list(boundary), "regrid": regrid_method if simulation else "",
+                "geometry": latitude_geometry, "sources": [sources.rows.tolist(), sources.cols.tolist()],
+                "emission": list(sources.emission.shape)}
+
+# LINEAR SUPERPOSITION: the results at the end of the run are a weighted sum of the unit responses of all emission
+# timesteps and sources (the unit responses are simulated once for the settings), the model loop is skipped
+model_timesteps = timesteps
+if superposition:
+    # the unit responses depend on the content of the wind files (not only on their names)
+    library_settings = dict(run_settings)
+    if simulation:
+        library_settings["wind_files"] = [getFileHash(u_windfile), getFileHash(v_windfile), u_key, v_key]
+    library = UnitResponseLibrary(library_settings)
+    profiler.start("superposition")
+    if library.load(response_library):
+        print("Unit responses loaded from {}.".format(response_library))
+    else:
+        print("Simulating the unit responses of {} emission pulses...".format(sources.emission.size))
+        library.build(wind, timesteps, sources, particle_shape, bin_fall_out_array if size_bins else fall_out,
+                      hourly_res, resolution, diff_perc, diffusion_type, boundary, transport_backend,
+                      response_batch_size, geometry)
+        library.save(response_library)
+        print("Unit responses written to {}.".format(response_library))
+    particles, deposition, boundary_loss = library.synthesize(sources.emission)
+    eruption_sum = float(sources.emission.sum())
+    # the synthesized frame is the last frame of the model run
+    frame = getFrame(particles)
+    frame_number = scheduler.add(frame, len(timesteps) * hourly_res)
+    if receptors is not None:
+        receptors.record(frame, frame_number)
+    if adjoint_mode and adjoint_target == len(timesteps) * hourly_res:
+        adjoint_forward = receptors.sample(frame)
+    if deposition_writer is not None:
+        deposition_writer.write(deposition, (len(timesteps) - 1) * hourly_res)
+    profiler.stop("superposition")
+    model_timesteps = []
+    print("Results synthesized from the unit responses, the model loop is skipped.")
+
+# RESULT CACHE: a model run with identical inputs (content of the wind files, settings and emission) is loaded
+result_cache = None
+cache_key = None
+if cache_dir != "" and not superposition:
+    result_cache = ResultCache(cache_dir, cache_size)
+    cache_inputs = dict(run_settings, rates=sources.emission, output=output_schedule)
+    if simulation:
+        cache_inputs["wind_files"] = [result_cache.getFileHash(u_windfile), result_cache.getFileHash(v_windfile),
+                                      u_key, v_key, layer_levels if layers_3d else None]
+    # the receptor time series are part of the cached results
+    cache_inputs["receptors"] = None
+    if receptors is not None:
+        cache_inputs["receptors"] = [receptors.names, receptors.lats, receptors.lons]
+    cache_key = getCacheKey(cache_inputs)
+    cached = result_cache.get(cache_key)
+    # results of an older version without all arrays are treated as a miss
+    if cached is not None and receptors is not None and "receptor_rows" not in cached:
+        cached = None
+    if cached is not None:
+        particles = cached["particles"]
+        deposition = cached["deposition"]
+        scheduler.setState(cached)
+        eruption_sum = float(cached["eruption_sum"])
+        boundary_loss = float(cached["boundary_loss"])
+        mass_balance.loadRecords(cached["mass_balance"])
+        if receptors is not None:
+            receptors.hours = list(cached["receptor_hours"])
+            receptors.rows = list(cached["receptor_rows"])
+        if deposition_writer is not None:
+            deposition_writer.write(deposition, (len(timesteps) - 1) * hourly_res)
+        model_timesteps = []
+        # the results are not stored again
+        cache_key = None
+        print("Results of an identical model run loaded from the cache, the model loop is skipped.")
+
+if len(model_timesteps) > 0:
+    print("Modeling process initiated, going through {} iterations.".format(len(timesteps)*hourly_res))
 
 # for-loop to go through specified amount of timesteps
-for n in timesteps:
+for n in model_timesteps:
 
     # Setting up the wind fields for each timestep
     # If it's a test - the same wind field for every timestep is used
-    if not test:
-        u = u_wind[n, :, :]
-        v = v_wind[n, :, :]
-    else:
-        u = u_test
-        v = v_test
+    profiler.start("wind")
+    u, v = wind.getWind(n)
+    profiler.stop("wind")
+
+    # Transport receiving cells and transport percentages (shared by all size bins)
+    profiler.start("transport fields")
+    cells, transport_perc = getTransportFields(u, v, resolution, geometry)
+    # Transport plan (target cell index of every cell) or sparse operator is reused for all sub-steps of the wind field
+    plan = None
+    operator = None
+    if transport_engine == "sparse":
+        operator = SparseTransportOperator(cells, transport_perc, diff_perc, diffusion_type, boundary)
+    elif transport_backend != "shift":
+        plan = TransportPlan(cells, particle_shape, transport_backend)
+    # The moving nest follows the plume, the wind is interpolated to the fine grid
+    if nest is not None:
+        if nest.moving:
+            nest.follow(particles)
+        nest.setWind(u, v, resolution)
+    profiler.stop("transport fields")
 
     # POINT SOURCE INITIALISATION
-    # At specified geographic location the eruption concentration at current timestep will be
-    # added.
-    if eyjafjalla:
-        if n - min(timesteps) < len(concentration):
-            if particles[lat_index, lon_index] != 0.0:
-                particles[lat_index, lon_index] += concentration[n - min(timesteps)]
-            else:
-                particles[lat_index, lon_index] = concentration[n - min(timesteps)]
-
-            eruption = concentration[n - min(timesteps)]
-            eruption_sum += eruption
-        else:
-            eruption = 0
-    if manual:
-        if n - min(timesteps) < durance:
-            if particles[lat_index, lon_index] == 0:
-                particles[lat_index, lon_index] = concentration
-            else:
-                particles[lat_index, lon_index] += concentration
-
-            eruption = concentration
-            eruption_sum += eruption
-
-    # go through every pixel and evaluate its next time step, then save to temp_arr
-    # TODO: Handle the OutOfBoundsError
-    # TODO: Handle it such that overflow will be added behind! like when -180 is reached then +180 / 179 entering
+    # At the closest cell of every source the eruption concentration at current timestep will be
+    # added (one np.add.at call for all sources).
+    profiler.start("injection")
+    if nest is not None:
+        # sources within the nest erupt into their fine cell
+        eruption = nest.inject(particles, sources, n - min(timesteps))
+    else:
+        eruption = sources.inject(particles, n - min(timesteps))
+    eruption_sum += eruption
+    profiler.stop("injection")
 
     # Adjustment for temporal resolution of wind data
     # if hourly_res = 6 hours the loop will run 6 times before changing the wind field
     res_correction = np.arange(0, hourly_res, 1)
 
     for k in res_correction:
-        # create temporary array to save calculated time steps
-        temp_arr = np.zeros((rows, cols))
-
+        # injected mass and fall-out of the timestep for the mass balance records
+        step_injected = 0.0
+        step_fallout = 0.0
         if k == 0:
-            # summing up fall out for surveillance mechanism
-            sum_fallout += sum(particles[particles > 0.0] * (1 - fall_out))
-
-            # Fall-out processing
-            particles = particles * fall_out
+            step_injected = eruption
+
+            profiler.start("fall-out")
+            # Fall-out processing (with the fall-out of each bin for size bins)
+            # The fall-out is accumulated in the deposition raster for the surveillance mechanism
+            current_fall_out = bin_fall_out_array if size_bins else fall_out
+            fallen_out = particles * (1 - current_fall_out)
+            if layers_3d:
+                fallen_out = fallen_out.sum(axis=-3)
+            np.add(deposition, fallen_out, out=deposition)
+            particles = particles * current_fall_out
+            step_fallout = getTotal(fallen_out)
+            if nest is not None:
+                step_fallout += nest.fallOut(current_fall_out, deposition)
+
+            # Settling to the next lower layer (particles settling out of the lowest layer are deposited)
+            if layers_3d:
+                settled = settlingStep(particles, settling_perc)
+                np.add(deposition, settled, out=deposition)
+                step_fallout += getTotal(settled)
+            profiler.stop("fall-out")
+
+            if deposition_writer is not None:
+                profiler.start("output")
+                deposition_writer.write(deposition, (n - min(timesteps)) * hourly_res)
+                profiler.stop("output")
 
         # Save the very first figure without transport and diffusion
         if n - min(timesteps) == 0:
-            figures.append(particles)
+            frame = getFrame(particles)
+            frame_number = scheduler.add(frame)
+            if nest is not None:
+                nest.record()
+            if receptors is not None:
+                receptors.record(frame, frame_number)
+            if adjoint_mode and adjoint_target == 0 and k == 0:
+                adjoint_forward = receptors.sample(frame)
 
         print("..." * 10)
         print("..." * 10)
@@ -846,278 +1426,122 @@ for n in timesteps:
         if test:
             print("timestep {}, erupting {} g/m^3".format(n + 1, eruption))
 
-        # TRANSPORT LOOP_______________________
-        i = 0
-        while i < rows:
-            j = 0
-            while j < cols:
-
-                # Retrieving u and v wind speed value
-                wind_u = u[i, j]
-                wind_v = v[i, j]
-
-                # Calculating absolute wind speeds and diagonal wind speed
-                v_dir = abs(wind_v)
-                u_dir = abs(wind_u)
-                diag = math.sqrt(u_dir**2 + v_dir**2)
-
-                # Determining the wind angle! (0-360)
-                wind_dir_trig_to = math.atan2(wind_u / diag, wind_v / diag)
-                degrees = wind_dir_trig_to * 180 / math.pi
-
-                # Adjustment for angles < 0 (atan2 --> -180 to 180)
-                if degrees < 0:
-                    degrees += 360
-
-                # Classification of transport receiving cell
-                cell = np.nan
-
-                if 337.5 < degrees or degrees <= 22.5:
-                    cell = 1
-                if 22.5 < degrees <= 67.5:
-                    cell = 2
-                if 67.5 < degrees <= 112.5:
-                    cell = 3
-                if 112.5 < degrees <= 157.5:
-                    cell = 4
-                if 157.5 < degrees <= 202.5:
-                    cell = 5
-                if 202.5 < degrees <= 247.5:
-                    cell = 6
-                if 247.5 < degrees <= 292.5:
-                    cell = 7
-                if 292.5 < degrees <= 337.5:
-                    cell = 8
-
-                # wind in km/h
-                wind_u_km = wind_u * 3.6
-                wind_v_km = wind_v * 3.6
-                diag_km = diag * 3.6
-
-                # Determining highest wind speed of u, v and diagonal wind
-                max_wind = max(wind_u_km, wind_v_km, diag_km)
-
-                # Optional: Diffusion adjustments according to different wind speeds
-                if max_wind > 50:
-                    diff_perc = 0
-                else:
-                    diff_perc = diffusion_percent
-                diff_perc = diffusion_percent # TODO: cancel this line if diffusion should be adjusted to wind speed
-
-                # Classification of how much concentration should be transported
-                # 100% if wind reaches "resolution" km/h
-                transport_perc = 0
-
-                if max_wind >= (resolution - 5) :
-                    transport_perc = 1
-                if (resolution - 5) > max_wind >= resolution * 0.8 - 5:
-                    transport_perc = 0.95 #0.8
-                if resolution * 0.8 - 5 > max_wind >= resolution * 0.6 - 5:
-                    transport_perc = 0.9 #0.6
-                if resolution * 0.6 - 5 > max_wind:
-                    transport_perc = 0.85 #0.4
-                if max_wind == 0:
-                    transport_perc = 0
+        # TRANSPORT AND DIFFUSION: all cells (and all layers and size bins) are processed in one vectorized pass
+        # of the kernel, mass leaving the domain through open boundaries is summed up for the mass balance
+        # (SPARSE ENGINE: transport and diffusion are one sparse matrix product of the operator)
+        profiler.count(particles)
+        particles, step_loss = modelStep(particles, cells, transport_perc, diff_perc, diffusion_type, boundary, plan,
+                                         geometry, operator, profiler)
+        # NESTED GRID: exchange with the model grid and fine timesteps of the nest
+        if nest is not None:
+            profiler.start("nest")
+            step_loss += nest.step(particles, diff_perc, diffusion_type)
+            profiler.stop("nest")
+        boundary_loss += step_loss
+
+        # Mass balance of the timestep (running totals, the airborne mass is only measured at the check steps)
+        measured = None
+        if mass_balance.isCheckStep():
+            measured = getTotal(particles) + (nest.getTotal() if nest is not None else 0.0)
+        mass_balance.record(n*hourly_res + k + 1, step_injected, step_fallout, step_loss, measured)
 
-                try:
-                    # calculates diffusion part
-                    diff_amount = particles[i, j] * diff_perc
-
-                    # receiving concentrations from all grid cells
-                    # x_origin - diff_amount = portion of transportable wind
-                    x_origin = particles[i, j] - diff_amount
-
-                    x1 = particles[i + 1, j]
-                    x2 = particles[i + 1, j + 1]
-                    x3 = particles[i, j + 1]
-                    x4 = particles[i - 1, j + 1]
-                    x5 = particles[i - 1, j]
-                    x6 = particles[i - 1, j - 1]
-                    x7 = particles[i, j - 1]
-                    x8 = particles[i + 1, j - 1]
-
-                    if not x_origin == 0.0:
-
-                        # Concentration transport processing
-                        if cell == 1:
-                            temp_arr[i + 1, j] = x_origin * transport_perc # i-1, j
-                        if cell == 2:
-                            temp_arr[i + 1, j + 1] = x_origin * transport_perc # i-1, j+1
-                        if cell == 3:
-                            temp_arr[i, j + 1] = x_origin * transport_perc
-                        if cell == 4:
-                            temp_arr[i - 1, j + 1] = x_origin * transport_perc # i+1, j+1
-                        if cell == 5:
-                            temp_arr[i - 1, j] = x_origin * transport_perc # i + 1, j
-                        if cell == 6:
-                            temp_arr[i - 1, j - 1] = x_origin * transport_perc #i + 1, j - 1
-                        if cell == 7:
-                            temp_arr[i, j - 1] = x_origin * transport_perc
-                        if cell == 8:
-                            temp_arr[i + 1, j - 1] = x_origin * transport_perc # i-1, j-1
-
-                        # Adjust ash concentration from origin cell to the losses
-                        updated = x_origin - (x_origin * transport_perc)
-                        if updated < 0.00000001:
-                            temp_arr[i, j] += (0 + diff_amount)
-                        else:
-                             temp_arr[i, j] += (updated + diff_amount)
-
-                except IndexError:
-                    # this is to prevent the program from collapsing in case one of the above conditions tries to
-                    # access a pixel outside of the range of a numpy array, like a pixel with index particles[-10,
-                    # -10] in that case the program should just pass the condition and move on
-                    # TODO: OutOfBounds-problem should get solved (transport poles to poles)
-                    pass
-
-                # iterating through columns
-                j += 1
-
-            # iterating through rows
-            i += 1
-
-        # DIFFUSION LOOP_____________________________________
-        # temporary array to store diffusion process timesteps
-        diffusion = np.zeros((dim_lat, dim_lon))
-        p = 0
-        while p < rows:
-            o = 0
-            while o < cols:
-
-                # Retrieving u, v and diagonal wind speed value
-                wind_u = u[p, o]
-                wind_v = v[p, o]
-                diag = math.sqrt(wind_u**2 + wind_v**2)
-
-                # wind in km/h
-                wind_u_km = wind_u * 3.6
-                wind_v_km = wind_v * 3.6
-                diag_km = diag * 3.6
-
-                # Determining highest wind speed of u, v and diagonal wind
-                max_wind = max(wind_u_km, wind_v_km, diag_km)
-
-                # Optional: Diffusion adjustments according to different wind speeds
-                if max_wind > 50:
-                    diff_perc = 0
-                else:
-                    diff_perc = diffusion_percent
-                diff_perc = diffusion_percent # TODO: cancel this line if diffusion should be adjusted to wind speed
-
-                try:
-                    # calculates diffusion part
-                    diff_amount = temp_arr[p, o] * diff_perc
-
-                    # receiving concentrations from all grid cells
-                    # x_origin - diff_amount = portion of transportable wind
-                    x_origin = temp_arr[p, o] - diff_amount
-
-                    if x_origin != 0:
-                        x1 = temp_arr[p + 1, o]
-                        x2 = temp_arr[p + 1, o + 1]
-                        x3 = temp_arr[p, o + 1]
-                        x4 = temp_arr[p - 1, o + 1]
-                        x5 = temp_arr[p - 1, o]
-                        x6 = temp_arr[p - 1, o - 1]
-                        x7 = temp_arr[p, o - 1]
-                        x8 = temp_arr[p + 1, o - 1]
-
-                        # calculate the gradients of all surrounding cells with respect to x_origin
-                        # only used if diffusion-type = 0
-                        grad_x1 = (x1 - x_origin) / resolution
-                        grad_x2 = (x2 - x_origin) / resolution_extended
-                        grad_x3 = (x3 - x_origin) / resolution
-                        grad_x4 = (x4 - x_origin) / resolution_extended
-                        grad_x5 = (x5 - x_origin) / resolution
-                        grad_x6 = (x6 - x_origin) / resolution_extended
-                        grad_x7 = (x7 - x_origin) / resolution
-                        grad_x8 = (x8 - x_origin) / resolution_extended
-
-                        # store all gradients
-                        gradients = [grad_x1, grad_x2, grad_x3, grad_x4, grad_x5, grad_x6, grad_x7, grad_x8]
-
-                        # DIFFUSION with respect to gradients
-                        if diffusion_type == 0:
-
-                            # only executed if any gradient is negative (lower concentration in destination cell)
-                            if any(n < 0 for n in gradients):
-
-                                no_cells = sum(n < 0 for n in gradients)
-
-                                # Diffusion processing
-                                # diffusion part / number of cells with negative gradient will be diffused
-                                # to the corresponding destination cells
-                                if grad_x1 < 0:
-                                    diffusion[p + 1, o] += diff_amount / no_cells
-                                if grad_x2 < 0:
-                                    diffusion[p + 1, o + 1] += diff_amount / no_cells
-                                if grad_x3 < 0:
-                                    diffusion[p, o + 1] += diff_amount / no_cells
-                                if grad_x4 < 0:
-                                    diffusion[p - 1, o + 1] += diff_amount / no_cells
-                                if grad_x5 < 0:
-                                    diffusion[p - 1, o] += diff_amount / no_cells
-                                if grad_x6 < 0:
-                                    diffusion[p - 1, o - 1] += diff_amount / no_cells
-                                if grad_x7 < 0:
-                                    diffusion[p, o - 1] += diff_amount / no_cells
-                                if grad_x8 < 0:
-                                    diffusion[p + 1, o - 1] += diff_amount / no_cells
-
-                                # Adjust x_origin after diffusion processing
-                                diffusion[p, o] += temp_arr[p, o] - diff_amount
-
-                        # DIFFUSION in all directions
-                        if diffusion_type == 1:
-
-                            # Diffusion processing
-                            # diffusion part / 8 surrounding cells will be diffused
-                            diffusion[p + 1, o] += diff_amount / 8
-                            diffusion[p + 1, o + 1] += diff_amount / 8
-                            diffusion[p, o + 1] += diff_amount / 8
-                            diffusion[p - 1, o + 1] += diff_amount / 8
-                            diffusion[p - 1, o] += diff_amount / 8
-                            diffusion[p - 1, o - 1] += diff_amount / 8
-                            diffusion[p, o - 1] += diff_amount / 8
-                            diffusion[p + 1, o - 1] += diff_amount / 8
-
-                            # Adjust x_origin after diffusion processing
-                            diffusion[p, o] += temp_arr[p, o] - diff_amount
-
-                        # if no diffusion is happening (e.g. diff_percent = 0)
-                        # the diffusion array is set equal to the temporary array (after-transport-array)
-                        empty = diffusion[diffusion > 0]
-                        if empty.size == 0:
-                            diffusion = temp_arr
-                except IndexError:
-                    # this is to prevent the program from collapsing in case one of the above conditions tries to
-                    # access a pixel outside of the range of a numpy array, like a pixel with index particles[-10,
-                    # -10] in that case the program should just pass the condition and move on
-                    # TODO: OutOfBounds-problem should get solved (transport poles to poles)
-                    pass
-                o += 1
-            p += 1
-
-        # saving the diffusion array as the new particles for the next time-step
-        particles = diffusion
         # Save figure of timestep
-        figures.append(particles)
+        profiler.start("frames")
+        frame = getFrame(particles)
+        frame_number = scheduler.add(frame)
+        if nest is not None:
+            nest.record()
+        if receptors is not None:
+            receptors.record(frame, frame_number)
+        if adjoint_mode and (n - min(timesteps)) * hourly_res + k + 1 == adjoint_target:
+            adjoint_forward = receptors.sample(frame)
+        profiler.stop("frames")
+
+    profiler.sample()
+
+# The fine cells of the nest are given back to the model grid (mean of the fine cells)
+if nest is not None:
+    particles = nest.getComposite(particles)
+    if nest_file != "" and len(nest.frames) > 0:
+        nest.write(nest_file)
+        print("Fine fields of the nest written to {}.".format(nest_file))
+    # the particle raster contains the mass of the nest from now on
+    nest = None
+
+# The incomplete windows of the aggregated frames are closed
+scheduler.close()
+
+# Stores the results of the model run in the cache
+if cache_key is not None:
+    receptor_state = {}
+    if receptors is not None:
+        receptor_state = {"receptor_hours": np.array(receptors.hours), "receptor_rows": receptors.getTable()}
+    result_cache.put(cache_key, particles=particles, deposition=deposition, eruption_sum=eruption_sum,
+                     boundary_loss=boundary_loss, mass_balance=mass_balance.getRecords(),
+                     **dict(scheduler.getState(), **receptor_state))
+    print("Results stored in the cache ({}).".format(cache_key[:12]))
 
 # FINAL EXECUTION STATEMENTS__________________
 
+# Total fall-out for the surveillance mechanism
+sum_fallout = getTotal(deposition)
+if deposition_writer is not None:
+    deposition_writer.close()
+
 # Prints Eruption Execution Summary
 print("{}{} RESULTS {}{}".format("\n", "---" * 10, "---" * 10, "\n"))
 print("Model ran {} timesteps with total eruption output of {} g/m^3.".format(len(timesteps)*hourly_res, eruption_sum))
 
 # Surveillance mechanism for MASS BALANCE check
-sum_particles = sum(particles[particles != 0])
-comparison_sum = round(sum_particles + sum_fallout)
+sum_particles = getTotal(particles)
+comparison_sum = round(sum_particles + sum_fallout + boundary_loss)
 if abs(round(eruption_sum) - comparison_sum) >= 1:
     print("")
     print("WARNING: MASS BALANCE WAS NOT FULFILLED!!!")
 else:
     print("")
     print("MASS BALANCE FULFILLED!")
+if boundary_loss > 0:
+    print("{} g/m^3 left the domain through open boundaries.".format(boundary_loss))
+
+# Writes the mass balance of every timestep
+if mass_balance_file != "":
+    mass_balance.write(mass_balance_file)
+    print("Mass balance of every timestep written to {}.".format(mass_balance_file))
+
+# Prints the fall-out (deposition) of every size bin
+if size_bins:
+    bin_deposition = deposition.reshape(len(bin_fractions), -1).sum(axis=1)
+    print("")
+    print("Fall-out per size bin:")
+    for b in range(len(bin_fractions)):
+        print("{}: {} g/m^3".format(bin_labels[b], bin_deposition[b]))
+
+# Writes the concentration time series of all receptors (hour = number of the frame)
+if receptors is not None:
+    receptors.writeCSV("Receptors/ReceptorSeries.csv")
+    print("")
+    print("Receptor time series written to Receptors/ReceptorSeries.csv.")
+
+# ADJOINT MODE: sensitivity of every receptor to the emission of every source and timestep in one backward run
+# The dot product of the sensitivities with the emission reproduces the receptor concentrations of the model run
+if adjoint_mode:
+    profiler.start("adjoint")
+    sensitivity = SourceSensitivity(receptors, sources, particle_shape, bin_fall_out_array if size_bins else fall_out)
+    sensitivity.run(wind, timesteps, adjoint_target, hourly_res, resolution, diff_perc, diffusion_type, boundary,
+                    geometry)
+    sensitivity.writeCSV("Receptors/SourceSensitivity.csv", bin_fractions if size_bins else None)
+    profiler.stop("adjoint")
+    print("")
+    print("Source-receptor sensitivity (timestep {}) written to Receptors/SourceSensitivity.csv.".format(
+        adjoint_target))
+    # without the forward concentrations (superposition or cached results) only the adjoint run is printed
+    if adjoint_forward is None:
+        adjoint_forward = [float("nan")] * len(receptors.names)
+    print("Receptor concentrations of the model run / of the adjoint run:")
+    for name, forward, backward in zip(receptors.names, adjoint_forward, sensitivity.getConcentration(
+            sources.emission)):
+        print("{}: {} / {} g/m^3".format(name, forward, backward))
 
 """
 ____________________________________Sixth Section - Generating Plots_______________________________________________
@@ -1133,6 +1557,7 @@ This consists of the following outputs:
         --> beginning at 2*10^-3 g/m^3 (No Fly Zone)
         
         The flight-zone concentrations are chosen following the Civil Aviation Authority (CAA)
+3) Whole World Extent Graph of the accumulated ground deposition at the end of the model run
         
 
 The used colormap is inspired by the visualisation of EUMETRAIN's Volcanic Ash Training Module.
@@ -1169,12 +1594,22 @@ x, y = mbase(lon2, lat2)
 title_string = getTitleString(test, simulation, manual, eyjafjalla)
 diff_string = getDiffusionString(diffusion_type, diff_perc)
 res_string = getResolutionString(resolution, hourly_res)
+if test_wind == "uniform":
+    test_wind_string = "U-component: " + str(test_u) + " m/s" + "\n" + "V-component: " + str(test_v) + " m/s"
+else:
+    test_wind_string = "Wind scenario: " + test_wind
 
+# Animations of the plot products: the rendered figures are encoded directly (see ashplume/frames.py)
+animations = None
+if animation_format != "":
+    animations = dict((product, AnimationWriter("{0}/{0}.{1}".format(product, animation_format), animation_fps))
+                      for product in output_schedule)
 
-prints = np.arange(0, len(figures), 1)
 
 # BASEMAP TRY
-for n in prints:
+profiler.start("plot world")
+for frame, window in zip(scheduler.getFrames("WorldMap"), scheduler.getWindows("WorldMap")):
+    n = window[1]
     #fig, ax = plt.subplots()
     fig = plt.figure(figsize=(19.23, 9.93))
     # m.fillcontinents(color='gray',lake_color='gray')
@@ -1183,32 +1618,21 @@ for n in prints:
     mbase.drawmeridians(np.arange(-180., 181., 20.), labels=[0, 0, 0, 1])
     mbase.drawmapboundary(fill_color='white')
     mbase.drawcountries()
-    cs = mbase.contourf(x, y, figures[n], locator=ticker.LogLocator(), levels=clevs, cmap=cmap, norm=norm)
+    cs = mbase.contourf(x, y, frame, locator=ticker.LogLocator(), levels=clevs, cmap=cmap, norm=norm)
     plt.title(title_string, fontsize=20, pad=30) #20
     cbar = plt.colorbar(fraction=0.05, pad=0.07, shrink=0.82, aspect=20, extendrect=False);
     cbar.set_ticklabels(["0", r'$10^{-4}$', r'$10^{-3}$', r'$10^{-2}$', r'$10^{-1}$', r'$10^0$', r'$10^1$', r'$10^2$',
                          r'$10^3$', r'$10^4$'])
     cbar.ax.set_title("Concentration [g/$m^3$]", pad=20)
 
-    if n == 0:
-        time_string = "Initialisation"
-        counter = 0
-    elif test:
-        time_string = "Timestep: " + "+ " + str(timesteps[n - 1] + 1) + " h"
-    elif simulation:
-        if hourly_res == 1:
-            time_string = str(time_converted[n - 1])
-        else:
-            if (n-1) % hourly_res == 0 and (n-1) > 0:
-                counter += 1
-            time_string = str(time_converted[counter]) + " + " + str((n-1) % hourly_res) + " h"
+    time_string = getTimeString("WorldMap", window)
 
     plt.text(x=90, y=94, s=diff_string, fontdict={'size': 12})
     plt.text(x=90, y=104, s=res_string, fontdict={'size': 12})
     plt.text(x=-200, y=94, s=time_string, fontdict={'size': 12})
 
     if test:
-        plt.text(x=-200, y=100, s="U-component: " + str(test_u) + " m/s" + "\n" + "V-component: " + str(test_v) + " m/s",
+        plt.text(x=-200, y=100, s=test_wind_string,
                  fontdict={'size': 12})
 
     number = str(n)
@@ -1217,25 +1641,24 @@ for n in prints:
     elif int(number) < 100:
         number = "0" + number
 
-    fig.savefig("WorldMap\WorldMap_{}".format(number))
+    if animations is not None:
+        animations["WorldMap"].write(fig)
+    if frame_images:
+        fig.savefig("WorldMap\WorldMap_{}".format(number))
     plt.close(fig)
+if animations is not None:
+    animations["WorldMap"].close()
+profiler.stop("plot world")
 
 # FIGURE 2
 # Creating two plots of Europe
 # Plot 1: As before
 # Plot 2: Flight restriction zones
 
-# Get the closest coordinates with respect to specified longitude and latitude values
+# Get index of closest longitude and latitude values with respect to the zoom extent
 # Extent is defined by user!
-lat_pos_eu1 = lat[np.where(abs(lat - lat_eu1) == min(abs(lat - lat_eu1)))][0]
-lat_pos_eu2 = lat[np.where(abs(lat - lat_eu2) == min(abs(lat - lat_eu2)))][0]
-lon_pos_eu1 = lon[np.where(abs(lon - lon_eu1) == min(abs(lon - lon_eu1)))][0]
-lon_pos_eu2 = lon[np.where(abs(lon - lon_eu2) == min(abs(lon - lon_eu2)))][0]
-# Get index of closest longitude and latitude values
-lat_index_eu1 = int(np.where(lat == lat_pos_eu1)[0])
-lat_index_eu2 = int(np.where(lat == lat_pos_eu2)[0])
-lon_index_eu1 = int(np.where(lon == lon_pos_eu1)[0])
-lon_index_eu2 = int(np.where(lon == lon_pos_eu2)[0])
+lat_index_eu1, lon_index_eu1 = grid.getIndex(lat_eu1, lon_eu1)
+lat_index_eu2, lon_index_eu2 = grid.getIndex(lat_eu2, lon_eu2)
 
 lon_plot = lon[lon_index_eu1:lon_index_eu2]
 lat_plot = lat[lat_index_eu1:lat_index_eu2]
@@ -1248,9 +1671,11 @@ x2, y2 = mbase(lon_eu, lat_eu)
 
 
 # EUROPE ZOOM
-for n in prints:
+profiler.start("plot europe")
+for frame, window in zip(scheduler.getFrames("EuropeZoom"), scheduler.getWindows("EuropeZoom")):
+    n = window[1]
     fig = plt.figure(figsize=(19.23,9.91))
-    ash_picture = figures[n][lat_index_eu1:lat_index_eu2, lon_index_eu1:lon_index_eu2]
+    ash_picture = frame[lat_index_eu1:lat_index_eu2, lon_index_eu1:lon_index_eu2]
     plt.contourf(x2, y2, ash_picture, levels=clevs, cmap=cmap, norm=norm)
     mbase2.drawcoastlines()
     mbase2.drawparallels(np.arange(30., 81., 10.), labels=[1, 0, 0, 0])
@@ -1264,18 +1689,7 @@ for n in prints:
                          r'$10^2$', r'$10^3$', r'$10^4$'])
     cbar.ax.set_title("Concentration [g/$m^3$]", pad=20)
 
-    if n == 0:
-        time_string = "Initialisation"
-        counter = 0
-    elif test:
-        time_string = "Timestep: " + "+ " + str(timesteps[n - 1] + 1) + " h"
-    elif simulation:
-        if hourly_res == 1:
-            time_string = str(time_converted[n - 1])
-        else:
-            if (n - 1) % hourly_res == 0 and (n - 1) > 0:
-                counter += 1
-            time_string = str(time_converted[counter]) + " + " + str((n - 1) % hourly_res) + " h"
+    time_string = getTimeString("EuropeZoom", window)
 
     plt.text(x=25, y=82, s=diff_string, fontdict={'size': 12})
     plt.text(x=25, y=85.75, s=res_string, fontdict={'size': 12})
@@ -1283,7 +1697,7 @@ for n in prints:
     plt.text(x=-41, y=82, s=time_string, fontdict={'size': 12})
 
     if test:
-        plt.text(x=-41, y=83.5, s="U-component: " + str(test_u) + " m/s" + "\n" + "V-component: " + str(test_v) + " m/s",
+        plt.text(x=-41, y=83.5, s=test_wind_string,
                  fontdict={'size': 12})
 
     number = str(n)
@@ -1292,8 +1706,14 @@ for n in prints:
     elif int(number) < 100:
         number = "0" + number
 
-    fig.savefig("EuropeZoom\EuropeZOOM_{}".format(number))
+    if animations is not None:
+        animations["EuropeZoom"].write(fig)
+    if frame_images:
+        fig.savefig("EuropeZoom\EuropeZOOM_{}".format(number))
     plt.close(fig)
+if animations is not None:
+    animations["EuropeZoom"].close()
+profiler.stop("plot europe")
 
 
 
@@ -1308,9 +1728,11 @@ cmap2 = mcolors.ListedColormap(cmap_data2, 'concentrations')
 norm2 = m.colors.BoundaryNorm(clevs2, ncolors=cmap2.N, clip=True)
 
 # EUROPE FLIGHT RESTRICTION ZONES
-for n in prints:
+profiler.start("plot flight zones")
+for frame, window in zip(scheduler.getFrames("EuropeFlyzone"), scheduler.getWindows("EuropeFlyzone")):
+    n = window[1]
     fig = plt.figure(figsize=(19.23,9.91))
-    ash_picture = figures[n][lat_index_eu1:lat_index_eu2, lon_index_eu1:lon_index_eu2]
+    ash_picture = frame[lat_index_eu1:lat_index_eu2, lon_index_eu1:lon_index_eu2]
     plt.contourf(x2, y2, ash_picture, levels=clevs2, cmap=cmap2, norm=norm2)
     mbase2.drawcoastlines()
     mbase2.drawparallels(np.arange(30., 81., 10.), labels=[1, 0, 0, 0])
@@ -1325,18 +1747,7 @@ for n in prints:
     cbar.set_ticklabels(["0", r'$2*10^{-4}$', r'$2*10^{-3}$', r'$10^4$'])
     cbar.ax.set_title("Concentration [g/$m^3$]", pad=20)
 
-    if n == 0:
-        time_string = "Initialisation"
-        counter = 0
-    elif test:
-        time_string = "Timestep: " + "+ " + str(timesteps[n - 1] + 1) + " h"
-    elif simulation:
-        if hourly_res == 1:
-            time_string = str(time_converted[n - 1])
-        else:
-            if (n - 1) % hourly_res == 0 and (n - 1) > 0:
-                counter += 1
-            time_string = str(time_converted[counter]) + " + " + str((n - 1) % hourly_res) + " h"
+    time_string = getTimeString("EuropeFlyzone", window)
 
     plt.text(x=25, y=82, s=diff_string, fontdict={'size': 12})
     plt.text(x=25, y=85.75, s=res_string, fontdict={'size': 12}) #25 84.5
@@ -1344,7 +1755,7 @@ for n in prints:
     plt.text(x=-41, y=82, s=time_string, fontdict={'size': 12})
 
     if test:
-        plt.text(x=41, y=83.5, s="U-component: " + str(test_u) + " m/s" + "\n" + "V-component: " + str(test_v) + " m/s",
+        plt.text(x=41, y=83.5, s=test_wind_string,
                  fontdict={'size': 12})
 
     # plt.text(x=58, y=78, s="Flight Zones", fontdict={'weight':"bold"}, fontsize=14)
@@ -1365,8 +1776,46 @@ for n in prints:
     elif int(number) < 100:
         number = "0" + number
 
-    fig.savefig("EuropeFlyzone\EuropeFLYZONES_{}".format(number))
+    if animations is not None:
+        animations["EuropeFlyzone"].write(fig)
+    if frame_images:
+        fig.savefig("EuropeFlyzone\EuropeFLYZONES_{}".format(number))
     plt.close(fig)
+if animations is not None:
+    animations["EuropeFlyzone"].close()
+profiler.stop("plot flight zones")
+
+# FIGURE 3
+# Accumulated ground deposition (sum of all size bins) at the end of the model run (only with a deposition file)
+if deposition_file != "":
+    profiler.start("plot deposition")
+    ground_deposition = deposition.sum(axis=0) if size_bins else deposition
+
+    fig = plt.figure(figsize=(19.23, 9.93))
+    mbase.drawcoastlines()
+    mbase.drawparallels(np.arange(-80., 81., 20.), labels=[1, 0, 0, 0])
+    mbase.drawmeridians(np.arange(-180., 181., 20.), labels=[0, 0, 0, 1])
+    mbase.drawmapboundary(fill_color='white')
+    mbase.drawcountries()
+    cs = mbase.contourf(x, y, ground_deposition, locator=ticker.LogLocator(), levels=clevs, cmap=cmap, norm=norm)
+    plt.title(title_string + " - Ground Deposition", fontsize=20, pad=30)
+    cbar = plt.colorbar(fraction=0.05, pad=0.07, shrink=0.82, aspect=20, extendrect=False);
+    cbar.set_ticklabels(["0", r'$10^{-4}$', r'$10^{-3}$', r'$10^{-2}$', r'$10^{-1}$', r'$10^0$', r'$10^1$', r'$10^2$',
+                         r'$10^3$', r'$10^4$'])
+    cbar.ax.set_title("Deposition [g/$m^3$]", pad=20)
+    plt.text(x=90, y=94, s=diff_string, fontdict={'size': 12})
+    plt.text(x=90, y=104, s=res_string, fontdict={'size': 12})
+    plt.text(x=-200, y=94, s="Total fall-out: " + str(sum_fallout) + " g/$m^3$", fontdict={'size': 12})
+
+    fig.savefig(os.path.splitext(deposition_file)[0])
+    plt.close(fig)
+    profiler.stop("plot deposition")
+
+# Prints and writes the profile of the model run
+if profile_file != "":
+    profiler.printSummary()
+    profiler.write(profile_file)
+    print("Profile written to {}.".format(profile_file))
 
 
 ''' 
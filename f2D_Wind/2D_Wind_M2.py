@@ -1,6 +1,12 @@
+import os
+import sys
 import numpy as np
 from matplotlib import pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ashplume.kernels import runKernel
+from ashplume.frames import AsyncFrameWriter
+
 
 #This feature tries to model 2D Wind distribution of ash particles
 #03.07.2018, Author: benjamin.schuepbach@students.unibe.ch
@@ -30,6 +36,10 @@ loss = 1
 #diffusion facter for each timestep
 diff_loss = 0.5
 
+#save one image per timestep (in a background thread if async_frames is True)
+save_frames = True
+async_frames = True
+
 #--------------------------------------------------------------------------------------
 #Import actual wind-raster here
 #Be aware, diffusion should probably be taken into account as well...
@@ -48,17 +58,17 @@ def partTransport(direction, particles, eruption, origin, loss, diff_loss):
     ''' calculates transport of particles trough wind'''
 
     q = 0
-    rows = int(np.shape(particles)[0])
-    cols = int(np.shape(particles)[1])
 
     print("Modeling process initiated, goint through {} iterations".format(max(iterations)+1))
 
+    #frames are written by a background thread while the next timestep is calculated
+    frame_writer = None
+    if save_frames and async_frames:
+        frame_writer = AsyncFrameWriter("Ash_Plumes\Ash_Plume{}")
+
     #for-loop to go through specified amount of timesteps
     for n in iterations:
 
-        #create temporary array to save calculated time step
-        temp_arr = np.zeros((rows, cols))
-
         #dynamic particle generation at volcano
         particles[origin[0], origin[1]] = eruption[q]
         particles[origin2[0],origin2[1]] = eruption[q]
@@ -69,174 +79,22 @@ def partTransport(direction, particles, eruption, origin, loss, diff_loss):
         print("..." * 10)
         print("timestep {}, erupting {}ppm".format(q+1, eruption[q]))
 
-        #go through every pixel and evaluate its next time step, then save to temp_arr
-        i = 0
-        while i < rows:
-            j = 0
-
-            while j < cols:
-                #to check if it works correctly:
-                #print("going trough pixel at {},{}".format(i, j))
-
-                try:
-                    # this calculates the following per timestep:
-                    # new location of particles [depending on wind] = sum((old location[s] of particles) * loss)
-                    if direction[i, j] == 0:
-                        # top left
-                        temp_arr[i-1, j-1] += particles[i,j] * loss * (1-diff_loss)
-
-                        #save indices to make further steps look more simple on paper
-                        z = i-1
-                        u = j-1
-
-                        #assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z-1, u-1] += particles[i,j] * loss * diff_loss
-                        temp_arr[z-1, u] += particles[i,j] * loss * diff_loss
-                        temp_arr[z-1, u+1] += particles[i,j] * loss * diff_loss
-                        temp_arr[z, u+1] += particles[i,j] * loss * diff_loss
-                        temp_arr[z+1, u+1] += particles[i,j] * loss * diff_loss
-                        temp_arr[z+1, u] += particles[i,j] * loss * diff_loss
-                        temp_arr[z+1, u-1] += particles[i,j] * loss * diff_loss
-                        temp_arr[z, u-1] += particles[i,j] * loss * diff_loss
-
-                    elif direction[i, j] == 1:
-                        # top middle
-                        temp_arr[i - 1, j] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i - 1
-                        u = j
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 2:
-                        # top right
-                        temp_arr[i - 1, j + 1] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i - 1
-                        u = j + 1
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 3:
-                        # middle right
-                        temp_arr[i, j + 1] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i
-                        u = j + 1
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 4:
-                        # bottom right
-                        temp_arr[i + 1, j + 1] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i + 1
-                        u = j + 1
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 5:
-                        # bottom middle
-                        temp_arr[i + 1, j] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i + 1
-                        u = j
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 6:
-                        # bottom left
-                        temp_arr[i + 1, j - 1] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i + 1
-                        u = j - 1
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-                    elif direction[i, j] == 7:
-                        # middle left
-                        temp_arr[i, j - 1] += particles[i,j] * loss * (1-diff_loss)
-
-                        # save indices to make further steps look more simple on paper
-                        z = i
-                        u = j - 1
-
-                        # assign each surrounding pixel of end-of-timestep-target pixel the diffusion value
-                        temp_arr[z - 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z - 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u + 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u] += particles[i, j] * loss * diff_loss
-                        temp_arr[z + 1, u - 1] += particles[i, j] * loss * diff_loss
-                        temp_arr[z, u - 1] += particles[i, j] * loss * diff_loss
-
-
-                except IndexError:
-                    pass
-
-                j +=1
-            i += 1
+        #vectorized M2 rule: one masked shift per direction code to the target pixels, then one 3x3 convolution
+        #which spreads diff_loss to each surrounding pixel of the target pixels (see ashplume/kernels.py)
+        temp_arr = runKernel("2D_Wind_M2", direction, particles, encoding="prototype", loss=loss, diff_loss=diff_loss)
+
         # enabling iteration for the for loop
         q += 1
 
         # saving temp_arr as the new particles for the next time-step
         particles = temp_arr
-        plt.imsave("Ash_Plumes\Ash_Plume{}".format(q), particles)
+        if frame_writer is not None:
+            frame_writer.write(particles, q)
+        elif save_frames:
+            plt.imsave("Ash_Plumes\Ash_Plume{}".format(q), particles)
+
+    if frame_writer is not None:
+        frame_writer.close()
 
     print("{}{} RESULTS {}{}".format("\n","---"*10,"---"*10, "\n"))
     print("Model ran {} timesteps with volcanic output of \n{}\n".format(iterate,eruption))
@@ -0,0 +1,234 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ashplume.grid import GridGeometry, CellGeometry
+from ashplume.transport import getTransportFields, modelStep, TransportPlan, TRANSPORT_BACKENDS
+from ashplume.operators import SparseTransportOperator, sparse
+from ashplume.wind import NetCDFWindProvider
+from ashplume.windfields import SyntheticWindProvider
+
+
+"""
+_____________________________________Golden Regression__________________________________________
+
+Regression harness which pins the numerical results of the transport-diffusion kernel.
+
+Small canned scenarios are run and compared to the compressed reference fields in regression/golden:
+    - test mode (constant wind) in the 8 wind directions of the transport receiving cells
+    - test mode with gradient dependent and without diffusion
+    - wind direction bands as in f2D_Wind/wind_direction_temp.py on a regional domain with open boundaries
+    - a tiny synthetic NetCDF wind file (decreasing latitudes, longitudes 0 - 360) read by the NetCDF wind provider
+    - test mode and NetCDF wind file with the latitude-aware cell geometry (CellGeometry in ashplume/grid.py)
+
+Every transport backend and the sparse transport engine (ashplume/operators.py, only scenarios without gradient
+dependent diffusion, requires scipy) are compared to the references. The maximum and mean deviation of the particle and deposition
+fields and the differences of the mass balance (erupted, airborne, fall-out, boundary loss) are reported.
+
+The scenarios follow the order of the model loop (injection and fall-out once per wind timestep, then hourly_res
+sub-steps), every sub-step is the sub-step of the model loop (modelStep in ashplume/transport.py).
+
+The references pin the results of the vectorized kernel with the explicit boundary conditions and the scatter-add
+transport (they were written with the "shift" backend). They are not the results of the original per-cell loop of
+the model: the original loop overwrote the contributions of several cells transporting into the same receiving cell
+and handled the domain edges without boundary conditions, thus its results (and mass balance) differ on purpose.
+
+Usage:
+    python regression/golden_regression.py             (compare all engines to the references)
+    python regression/golden_regression.py --update    (write new references with the reference backend)
+"""
+
+golden_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+# Reference backend which is used to write the references
+reference_backend = "shift"
+
+# Compared engines: the transport backends of the kernel and the sparse transport operator
+engines = TRANSPORT_BACKENDS + ("sparse",)
+
+# Model settings of all scenarios
+resolution = 80                         # km
+diffusion_percent = 0.1
+fall_out = 0.99
+eruption = 100.0                        # g/m^3 per wind timestep
+steps = 6                               # wind timesteps
+hourly_res = 2                          # sub-steps per wind timestep
+wind_speed = 25.0                       # m/s
+
+# Direction bands (transport receiving cells 1 - 8) of f2D_Wind/wind_direction_temp.py (20 x 20 cells)
+direction_bands = [1] * 5 + [3] * 2 + [2] * 2 + [3] * 3 + [5] * 8
+
+
+# Function returns the U- and V-wind components (m/s) which transport to the receiving cell (1 - 8)
+def getCellWind(cell, speed=wind_speed):
+    angle = np.radians((np.asarray(cell) - 1) * 45.0)
+    return speed * np.sin(angle), speed * np.cos(angle)
+
+
+# Function writes a tiny synthetic NetCDF wind file (ERA orientation) and reads it again
+# returns the latitudes, longitudes and U- and V-wind components (time, lat, lon) of the file
+def writeSyntheticNetCDF(filename):
+    from netCDF4 import Dataset
+
+    lat = np.arange(90, -91, -10.0)
+    lon = np.arange(0, 360, 10.0)
+    lon2, lat2 = np.meshgrid(lon, lat)
+    dataset = Dataset(filename, "w")
+    dataset.createDimension("time", steps)
+    dataset.createDimension("latitude", len(lat))
+    dataset.createDimension("longitude", len(lon))
+    dataset.createVariable("latitude", "f4", ("latitude",))[:] = lat
+    dataset.createVariable("longitude", "f4", ("longitude",))[:] = lon
+    u = dataset.createVariable("u", "f4", ("time", "latitude", "longitude"))
+    v = dataset.createVariable("v", "f4", ("time", "latitude", "longitude"))
+    for n in range(steps):
+        u[n] = 30.0 * np.cos(np.radians(lat2)) + 5.0 * np.sin(np.radians(lon2) + n)
+        v[n] = 15.0 * np.sin(np.radians(2 * lon2)) * np.cos(np.radians(lat2 + 10 * n))
+    dataset.close()
+
+    dataset = Dataset(filename, "r")
+    variables = [np.array(dataset.variables[key][:]) for key in ("latitude", "longitude", "u", "v")]
+    dataset.close()
+    return variables
+
+
+# Function returns the scenarios (name --> settings)
+def getScenarios():
+    scenarios = {}
+    names = ["north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest"]
+    for cell, name in zip(range(1, 9), names):
+        scenarios["test_" + name] = {"type": "test", "cell": cell, "diffusion_type": 1}
+    scenarios["test_gradient"] = {"type": "test", "cell": 2, "diffusion_type": 0}
+    scenarios["test_no_diffusion"] = {"type": "test", "cell": 4, "diffusion_type": 2}
+    scenarios["bands"] = {"type": "bands", "diffusion_type": 0}
+    scenarios["netcdf"] = {"type": "netcdf", "diffusion_type": 1}
+    scenarios["test_geometry"] = {"type": "test", "cell": 2, "diffusion_type": 0, "geometry": True}
+    scenarios["netcdf_geometry"] = {"type": "netcdf", "diffusion_type": 1, "geometry": True}
+    return scenarios
+
+
+# Function returns the grid, wind provider, source cell and boundary conditions of a scenario
+def setupScenario(scenario, work_dir):
+    if scenario["type"] == "test":
+        grid = GridGeometry(np.arange(-90, 90.25, 4), np.arange(0, 360, 4) - 180)
+        u, v = getCellWind(scenario["cell"])
+        wind = SyntheticWindProvider("uniform", grid, u=u, v=v)
+        return grid, wind, grid.getIndex(63.63, -19.62), ("periodic", "reflective")
+
+    if scenario["type"] == "bands":
+        grid = GridGeometry(np.arange(40, 60, 1.0), np.arange(-30, -10, 1.0))
+        # one wind direction per row, broadcast to all columns
+        u, v = getCellWind(np.array(direction_bands)[:, np.newaxis])
+        return grid, SyntheticWindProvider("uniform", grid, u=u, v=v), (10, 10), ("open", "open")
+
+    lat, lon, u, v = writeSyntheticNetCDF(os.path.join(work_dir, "synthetic_wind.nc"))
+    grid = GridGeometry(lat, lon)
+    wind = NetCDFWindProvider(u, v, grid)
+    return grid, wind, grid.getIndex(63.63, -19.62), ("periodic", "absorbing")
+
+
+# Function returns True if the engine can run the scenario (the sparse operator has no gradient dependent diffusion)
+def isSupported(scenario, engine):
+    return engine != "sparse" or (sparse is not None and scenario["diffusion_type"] != 0)
+
+
+# Function runs a scenario with an engine (transport backend of the kernel or "sparse")
+# returns the particle raster, the deposition raster and the mass balance (erupted, airborne, fall-out, boundary loss)
+def runScenario(scenario, engine, work_dir):
+    grid, wind, source, boundary = setupScenario(scenario, work_dir)
+    geometry = CellGeometry(grid, resolution) if scenario.get("geometry", False) else None
+    particles = np.zeros((grid.dim_lat, grid.dim_lon))
+    deposition = np.zeros_like(particles)
+    erupted = 0.0
+    boundary_loss = 0.0
+
+    for n in range(steps):
+        u, v = wind.getWind(n)
+        cells, transport_perc = getTransportFields(u, v, resolution, geometry)
+        plan = None
+        operator = None
+        if engine == "sparse":
+            operator = SparseTransportOperator(cells, transport_perc, diffusion_percent, scenario["diffusion_type"],
+                                               boundary)
+        elif engine != "shift":
+            plan = TransportPlan(cells, particles.shape, engine)
+        particles[source] += eruption
+        erupted += eruption
+        deposition += particles * (1 - fall_out)
+        particles = particles * fall_out
+        for k in range(hourly_res):
+            particles, loss = modelStep(particles, cells, transport_perc, diffusion_percent,
+                                        scenario["diffusion_type"], boundary, plan, geometry, operator)
+            boundary_loss += loss
+
+    mass = np.array([erupted, particles.sum(), deposition.sum(), boundary_loss])
+    return particles, deposition, mass
+
+
+# Function returns the comparison of a result with the reference
+def compare(result, reference, rtol, atol):
+    particles, deposition, mass = result
+    deviation = np.abs(np.concatenate((np.ravel(particles - reference["particles"]),
+                                       np.ravel(deposition - reference["deposition"]))))
+    passed = (np.allclose(particles, reference["particles"], rtol=rtol, atol=atol) and
+              np.allclose(deposition, reference["deposition"], rtol=rtol, atol=atol) and
+              np.allclose(mass, reference["mass"], rtol=rtol, atol=atol))
+    return {"max": deviation.max(),
+            "mean": deviation.mean(),
+            "mass": np.abs(mass - reference["mass"]).max(),
+            "balance": mass[0] - mass[1:].sum(),
+            "passed": passed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden regression of the transport-diffusion kernel")
+    parser.add_argument("--update", action="store_true", help="write new references with the reference backend")
+    parser.add_argument("--rtol", type=float, default=1e-9, help="relative tolerance")
+    parser.add_argument("--atol", type=float, default=1e-12, help="absolute tolerance (g/m^3)")
+    args = parser.parse_args()
+
+    scenarios = getScenarios()
+    work_dir = tempfile.mkdtemp()
+    failed = 0
+    try:
+        if args.update:
+            if not os.path.exists(golden_dir):
+                os.makedirs(golden_dir)
+            for name in sorted(scenarios):
+                particles, deposition, mass = runScenario(scenarios[name], reference_backend, work_dir)
+                np.savez_compressed(os.path.join(golden_dir, name + ".npz"),
+                                    particles=particles, deposition=deposition, mass=mass)
+                print("Reference written: {} (erupted {}, airborne {}, fall-out {}, boundary loss {})".format(
+                    name, *mass))
+            return 0
+
+        print("{:<22}{:>10}{:>12}{:>12}{:>12}{:>12}{:>8}".format("scenario", "engine", "max dev", "mean dev",
+                                                                 "mass dev", "balance", ""))
+        for name in sorted(scenarios):
+            reference = np.load(os.path.join(golden_dir, name + ".npz"))
+            for engine in engines:
+                if not isSupported(scenarios[name], engine):
+                    continue
+                report = compare(runScenario(scenarios[name], engine, work_dir), reference, args.rtol, args.atol)
+                failed += not report["passed"]
+                print("{:<22}{:>10}{:>12.3e}{:>12.3e}{:>12.3e}{:>12.3e}{:>8}".format(
+                    name, engine, report["max"], report["mean"], report["mass"], report["balance"],
+                    "ok" if report["passed"] else "FAILED"))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("")
+    if failed:
+        print("{} comparisons FAILED.".format(failed))
+        return 1
+    print("All results within tolerance (rtol {}, atol {}).".format(args.rtol, args.atol))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())